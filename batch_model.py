@@ -0,0 +1,361 @@
+from time import time as wall_time
+import random
+import numpy as np
+from fast_model import *
+
+# numpy model of many independent mirror_box_controller instances running in lockstep
+#
+# Every register of fast_model is one array with an entry per instance and the fsm, the seek counters and
+# update_target_position are evaluated for all instances at once on every clock edge. Memory is a few dozen bytes per
+# instance plus the recorded state transitions, so 10k+ instances are no problem.
+#
+# The stimulus is one fast_model event list per instance. An asynchronous reset is applied at the following clock edge,
+# so the state histories are those of fast_model sampled at the clock edges. All instances share one ControllerConfig.
+#
+# jitter_monte_carlo runs traffic whose hall sensor edges are shifted by a random time of up to a given jitter per
+# instance and counts the instances that end a seek in a timeout or error state, the __main__ block for a few jitters.
+
+state_names = m_state._names
+state_codes = dict((getattr(m_state, name), index) for index, name in enumerate(state_names))
+code = dict((name, np.uint8(index)) for index, name in enumerate(state_names))   # state code by state name
+
+register_dtype = {'state': np.uint8}
+for enable, reg, top, maxvalue_name in seek_counters:
+    register_dtype[reg] = np.int32
+
+
+def compile_stimulus(events_per_instance):
+    # sorts the events of all instances by the clock edge that first sees them
+    edges, instances, inputs, values = [], [], [], []
+    for instance, events in enumerate(events_per_instance):
+        for t, name, value in sorted(events, key=lambda e: e[0]):
+            offset = t - c_clock_period / 2
+            if name in delayed_inputs:
+                edge = offset / c_clock_period + 1
+            else:
+                edge = -(-offset / c_clock_period)
+            edges.append(max(edge, 0))
+            instances.append(instance)
+            inputs.append(model_inputs.index(name))
+            values.append(bool(value))
+    order = np.argsort(np.array(edges, dtype=np.int64), kind='mergesort')
+    return (np.array(edges, dtype=np.int64)[order], np.array(instances, dtype=np.int32)[order],
+            np.array(inputs, dtype=np.int8)[order], np.array(values, dtype=np.bool_)[order])
+
+
+def fsm_writes(r, i):
+    # the writes of the fsm generator as (register, instance mask, value), later writes win
+    w = []
+    state = r['state']
+    hall1 = ~i['hall1_not']
+    hall2 = ~i['hall2_not']
+    state_reset = i['state_reset']
+
+    m = state == code['init']
+    if m.any():
+        w += [('state', m, code['seek_home']),
+              ('flag_stepper_direction', m, c_direction_pos1),
+              ('flag_stepper_speed', m, c_speed_slow),
+              ('flag_stepper_enable', m, 0)]
+
+    m = state == code['seek_home']
+    if m.any():
+        w += [('flag_seek_home_slow_enable', m, 1),
+              ('flag_stepper_enable', m, 1),
+              ('state', m, np.where(r['flag_seek_home_slow_counter_top'], code['seek_home_timeout'],
+                                    np.where(hall1 & ~hall2, code['pos1_resting'], code['seek_home'])))]
+
+    m = state == code['seek_home_timeout']
+    if m.any():
+        w += [('flag_seek_home_slow_enable', m, 0),
+              ('flag_stepper_enable', m, 0),
+              ('state', m, np.where(state_reset, code['init'], code['seek_home_timeout']))]
+
+    m = state == code['pos1_resting']
+    if m.any():
+        go = m & (r['target_position'] == c_position_pos2)
+        w += [('flag_seek_home_slow_enable', m, 0),
+              ('flag_seek_pos1_slow_enable', m, 0),
+              ('flag_stepper_enable', m, 0),
+              ('state', m, np.where(go, code['pos2_seeking_fast'],
+                                    np.where(hall1, code['pos1_resting'], code['pos1_resting_error']))),
+              ('flag_stepper_direction', go, c_direction_pos2),
+              ('flag_stepper_speed', go, c_speed_fast)]
+
+    m = state == code['pos2_resting']
+    if m.any():
+        go = m & (r['target_position'] == c_position_pos1)
+        w += [('flag_seek_pos2_slow_enable', m, 0),
+              ('flag_stepper_enable', m, 0),
+              ('state', m, np.where(go, code['pos1_seeking_fast'],
+                                    np.where(hall2, code['pos2_resting'], code['pos2_resting_error']))),
+              ('flag_stepper_direction', go, c_direction_pos1),
+              ('flag_stepper_speed', go, c_speed_fast)]
+
+    for name in ('pos1_resting_error', 'pos2_resting_error', 'pos1_seeking_timeout', 'pos2_seeking_timeout'):
+        m = state == code[name]
+        if m.any():
+            w += [('flag_stepper_enable', m, 0),
+                  ('state', m, np.where(state_reset, code['init'], code[name]))]
+
+    m = state == code['pos1_seeking_slow']
+    if m.any():
+        w += [('flag_seek_pos1_fast_enable', m, 0),
+              ('flag_seek_pos1_slow_enable', m, 1),
+              ('flag_stepper_direction', m, c_direction_pos1),
+              ('flag_stepper_speed', m, c_speed_slow),
+              ('flag_stepper_enable', m, 1),
+              ('state', m, np.where(hall1, code['pos1_resting'],
+                                    np.where(r['flag_seek_pos1_slow_counter_top'], code['pos1_seeking_timeout'],
+                                             code['pos1_seeking_slow'])))]
+
+    m = state == code['pos2_seeking_slow']
+    if m.any():
+        w += [('flag_stepper_enable', m, 1),
+              ('flag_stepper_direction', m, c_direction_pos2),
+              ('flag_stepper_speed', m, c_speed_slow),
+              ('flag_seek_pos2_fast_enable', m, 0),
+              ('flag_seek_pos2_slow_enable', m, 1),
+              ('state', m, np.where(hall2, code['pos2_resting'],
+                                    np.where(r['flag_seek_pos2_slow_counter_top'], code['pos2_seeking_timeout'],
+                                             code['pos2_seeking_slow'])))]
+
+    m = state == code['pos1_seeking_fast']
+    if m.any():
+        top = m & r['flag_seek_pos1_fast_counter_top']
+        w += [('flag_stepper_enable', m, 1),
+              ('flag_stepper_direction', m, c_direction_pos1),
+              ('flag_stepper_speed', m, c_speed_fast),
+              ('flag_seek_pos1_fast_enable', m, 1),
+              ('state', m, np.where(top, code['pos1_seeking_slow'], code['pos1_seeking_fast'])),
+              ('flag_stepper_enable', top, 0),
+              ('flag_stepper_speed', top, c_speed_slow)]
+
+    m = state == code['pos2_seeking_fast']
+    if m.any():
+        top = m & r['flag_seek_pos2_fast_counter_top']
+        w += [('flag_stepper_enable', m, 1),
+              ('flag_seek_pos2_fast_enable', m, 1),
+              ('flag_seek_pos2_slow_enable', m, 0),
+              ('state', m, np.where(top, code['pos2_seeking_slow'], code['pos2_seeking_fast'])),
+              ('flag_stepper_enable', top, 0),
+              ('flag_stepper_speed', top, c_speed_slow),
+              ('flag_stepper_direction', top, c_direction_pos2)]
+
+    m = state == code['undefined']
+    if m.any():
+        w += [('state', m, code['init'])]
+    return w
+
+
+def counters_writes(r, i, maxvalues):
+    # the writes of the seek counters and of update_target_position, maxvalues see fast_model.seek_counter_maxvalues
+    w = []
+    for enable, reg, top, maxvalue_name in seek_counters:
+        maxvalue = maxvalues[reg]
+        own = r['state'] == code[str(seek_counter_state[reg])]
+        w += [(top, ~own, 0), (reg, ~own, 0)]
+        en = own & r[enable]
+        if en.any():
+            over = r[reg] > maxvalue
+            w += [(top, en & over, 1), (top, en & ~over, 0), (reg, en & ~over, r[reg] + 1)]
+    init = r['state'] == code['init']
+    drive2pos1 = (i['drive2pos1_manual'] | i['drive2pos1_PIO']) & ~init
+    drive2pos2 = (i['drive2pos2_manual'] | i['drive2pos2_PIO']) & ~drive2pos1 & ~init
+    w += [('target_position', init, c_position_pos1), ('target_position', drive2pos1, c_position_pos1),
+          ('target_position', drive2pos2, c_position_pos2)]
+    return w
+
+
+class BatchResult(object):
+
+    def __init__(self, n_instances, n_cycles, initial_state, transitions, final_state, step_counts):
+        self.n_instances = n_instances
+        self.n_cycles = n_cycles
+        self.initial_state = initial_state
+        self.transition_edge, self.transition_instance, self.transition_state = transitions
+        self.final_state = final_state      # state code per instance, see state_names
+        self.step_counts = step_counts      # rising edges of stepper_steps per instance
+
+    def state_history(self, instance):
+        # [(clock edge, state name), ...] of one instance, the first entry is the state before the first edge
+        history = [(-1, state_names[self.initial_state[instance]])]
+        selected = self.transition_instance == instance
+        for edge, code in zip(self.transition_edge[selected], self.transition_state[selected]):
+            history.append((int(edge), state_names[code]))
+        return history
+
+    def time_in_state(self):
+        # clock edges each instance spent in each state, array of shape (n_instances, number of states)
+        result = np.zeros((self.n_instances, len(state_names)), dtype=np.int64)
+        last_edge = np.zeros(self.n_instances, dtype=np.int64)
+        last_state = self.initial_state.astype(np.int64)
+        for edge, instance, code in zip(self.transition_edge, self.transition_instance, self.transition_state):
+            result[instance, last_state[instance]] += edge - last_edge[instance]
+            last_edge[instance] = edge
+            last_state[instance] = code
+        result[np.arange(self.n_instances), last_state] += self.n_cycles - last_edge
+        return result
+
+    def state_counts(self):
+        # number of instances in each state at the end of the run
+        return dict((name, int(count)) for name, count in
+                    zip(state_names, np.bincount(self.final_state, minlength=len(state_names))) if count)
+
+
+class BatchModel(object):
+
+    def __init__(self, n_instances, config=None):
+        # config: ControllerConfig of all instances, default: the module level constants
+        self.config = config or ControllerConfig()
+        check_config(self.config)
+        self.maxvalues = seek_counter_maxvalues(self.config)
+        self.n = n_instances
+        self.regs = {}
+        for name, value in register_init.iteritems():
+            if name == 'state':
+                value = state_codes[value]
+            self.regs[name] = np.full(n_instances, value, dtype=register_dtype.get(name, np.bool_))
+        self.inputs = dict((name, np.full(n_instances, input_init[name], dtype=np.bool_)) for name in model_inputs)
+        self.prescaler_origin = np.full(n_instances, -1, dtype=np.int64)
+        self.steps = np.zeros(n_instances, dtype=np.bool_)
+        self.step_counts = np.zeros(n_instances, dtype=np.int64)
+
+    def reset_registers(self, instances):
+        for name, value in register_init.iteritems():
+            if name == 'state':
+                value = state_codes[value]
+            self.regs[name][instances] = value
+
+    def run(self, events_per_instance, n_cycles):
+        edges, instances, inputs, values = compile_stimulus(events_per_instance)
+        first = np.searchsorted(edges, np.arange(n_cycles + 1))
+        initial_state = self.regs['state'].copy()
+        transitions = []
+        n_slow, n_fast = step_generator_periods(self.config)
+        for edge in xrange(n_cycles):
+            previous_state = self.regs['state'].copy()
+            lo, hi = first[edge], first[edge + 1]
+            for k in xrange(lo, hi):
+                name = model_inputs[inputs[k]]
+                if name == 'reset' and not values[k]:
+                    self.reset_registers(instances[k])
+                    self.prescaler_origin[instances[k]] = edge - 1
+                self.inputs[name][instances[k]] = values[k]
+
+            r = self.regs
+            n = dict(r)
+            for name, mask, value in fsm_writes(r, self.inputs) + counters_writes(r, self.inputs, self.maxvalues):
+                n[name] = np.where(mask, value, n[name]).astype(r[name].dtype)
+            held = ~self.inputs['reset']
+            if held.any():
+                for name, value in register_init.iteritems():
+                    if name == 'state':
+                        value = state_codes[value]
+                    n[name] = np.where(held, value, n[name]).astype(r[name].dtype)
+                self.prescaler_origin[held] = edge
+
+            changed = np.flatnonzero(n['state'] != previous_state)
+            if changed.size:
+                transitions.append((np.full(changed.size, edge, dtype=np.int64), changed.astype(np.int32),
+                                    n['state'][changed]))
+            self.regs = n
+
+            edges_since_origin = edge - self.prescaler_origin
+            step_clock = np.where(n['flag_stepper_speed'], (edges_since_origin // n_fast) & 1,
+                                  (edges_since_origin // n_slow) & 1).astype(np.bool_)
+            steps = n['flag_stepper_enable'] & step_clock
+            self.step_counts += steps & ~self.steps
+            self.steps = steps
+
+        if transitions:
+            transitions = tuple(np.concatenate(column) for column in zip(*transitions))
+        else:
+            transitions = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint8))
+        return BatchResult(self.n, n_cycles, initial_state, transitions, self.regs['state'].copy(),
+                           self.step_counts.copy())
+
+
+def model_history(events, n_cycles, config=None):
+    # state history and step count of fast_model in the format of BatchResult, a reset between two clock edges is
+    # attributed to the following edge
+    trace = simulate(events, n_cycles, config)
+    history = [(-1, str(trace[0][1]))]
+    steps = 0
+    for k, (t, state, direction, step) in enumerate(trace[1:]):
+        if step and not trace[k][3]:
+            steps += 1
+        edge = -(-(t - c_clock_period / 2) / c_clock_period)
+        if history[-1][0] == edge:
+            history.pop()
+        if history[-1][1] != str(state):
+            history.append((edge, str(state)))
+    return history, steps
+
+
+def check_against_model(events_per_instance, n_cycles, config=None):
+    # compares every instance with fast_model, returns the indices of the instances that differ
+    result = BatchModel(len(events_per_instance), config).run(events_per_instance, n_cycles)
+    differing = []
+    for instance, events in enumerate(events_per_instance):
+        history, steps = model_history(events, n_cycles, config)
+        if history != result.state_history(instance) or steps != result.step_counts[instance]:
+            differing.append(instance)
+    return differing
+
+
+def jittered_events(events, jitter, rng):
+    # events with every hall sensor edge shifted by a uniformly distributed time of up to jitter ns either way
+    return [(max(0, t + int(round(rng.uniform(-jitter, jitter)))) if name in delayed_inputs else t, name, value)
+            for t, name, value in events]
+
+
+def jitter_monte_carlo(n_instances, n_cycles, interval, jitter, config=None, seed=1):
+    # runs n_instances instances of fast_model.traffic_events with a switch every interval ns and hall sensor edges
+    # jittered by up to jitter ns, returns (BatchResult, number of instances that reached a timeout or error state)
+    rng = random.Random(seed)
+    events = traffic_events(n_cycles * c_clock_period, interval)
+    result = BatchModel(n_instances, config).run([jittered_events(events, jitter, rng) for k in range(n_instances)],
+                                                 n_cycles)
+    failed_codes = [index for index, name in enumerate(state_names) if name.endswith(('_timeout', '_error'))]
+    failed = np.unique(result.transition_instance[np.in1d(result.transition_state, failed_codes)]).size
+    return result, failed
+
+
+if __name__ == '__main__':
+    rng = random.Random(1)
+    # the tb.py stimulus ends in timeouts with hardly a step, traffic with a switch interval of its own per instance
+    # completes its seeks and keeps the steppers busy
+    events_per_instance = [traffic_events(tb_cycles * c_clock_period, rng.randrange(3000, 15000, 100))
+                           for k in range(10000)]
+
+    checked = events_per_instance[:50]
+    differing = check_against_model(checked, tb_cycles)
+    print '%d of %d instances differ from fast_model' % (len(differing), len(checked))
+    other_config = ControllerConfig(c_microsteps_per_seconds_fast=20000, c_pos1_seeking_slow_counter_maxvalue=40,
+                                    c_pos2_seeking_slow_counter_maxvalue=40)
+    other_differing = check_against_model(checked[:10], tb_cycles, other_config)
+    print '%d of 10 instances differ from fast_model with 20000 microsteps per second fast and slow counters of 40' % (
+        len(other_differing))
+
+    start = wall_time()
+    result = BatchModel(len(events_per_instance)).run(events_per_instance, tb_cycles)
+    elapsed = wall_time() - start
+    print '%d instances x %d cycles in %.2f s, %.0f instance cycles per second' % (
+        result.n_instances, tb_cycles, elapsed, result.n_instances * tb_cycles / elapsed)
+    print 'final states:', result.state_counts()
+    print 'mean steps per instance: %.1f' % result.step_counts.mean()
+    model_steps = sum(model_history(events, tb_cycles)[1] for events in checked)
+    batch_steps = result.step_counts[:len(checked)].sum()
+    print 'steps of the %d checked instances: %d, fast_model: %d' % (len(checked), batch_steps, model_steps)
+    assert batch_steps > 0 and batch_steps == model_steps and not differing and not other_differing
+
+    # hall sensor jitter: the magnet leaves the old hall sensor 0.5 us after the command and reaches the new one after
+    # 2 us. A jitter of 0.5 us or more can make it leave before the fsm left the resting state, which ends in
+    # *_resting_error.
+    for jitter in (0, 200, 500, 1000):
+        start = wall_time()
+        result, failed = jitter_monte_carlo(1000, tb_cycles, 10000, jitter)
+        print 'jitter %4d ns: %4d of %d instances reached a timeout or error state in %.2f s, final states: %s' % (
+            jitter, failed, result.n_instances, wall_time() - start, result.state_counts())
+        assert jitter or not failed, 'traffic without jitter reached a timeout or error state'
@@ -0,0 +1,155 @@
+import argparse
+import json
+from multiprocessing import Pool, cpu_count
+from time import time as wall_time
+from main import *
+from event_log import EventLog, event_logger
+from bench_ramp import mirror_box, error_states
+
+# command to rest latency under rapid toggling between pos1 and pos2, with and without c_preempt_seek
+#
+# Runs against the mechanics model of bench_ramp.py. After homing, toggles drive2pos2_PIO/drive2pos1_PIO commands are
+# given interval clock cycles apart, pos2 first, whatever the controller is doing. With an even number of toggles the
+# operator changes the mind while the mirror is on its way to pos2. The fast phases are set to end c_travel_margin
+# microsteps before the hall sensors. Reported are the time from the last command to the rest in its target position
+# and from the first command to that rest, and for the reversals of the carriage the shortest time it stood still
+# between the last microstep in one direction and the first in the other and the highest step rate of the last
+# microstep before one.
+#
+#   python bench_preempt.py [--travel 20] [--toggles 2] [--intervals 1000 4000] [-j 4] [--json bench_preempt.json]
+
+# c_preempt_seek needs the seek counters, mirror_box_axis rejects it with timeout_timer
+configurations = [('fixed', {'c_preempt_seek': False}),
+                  ('preempt', {'c_preempt_seek': True}),
+                  ('ramp', {'c_preempt_seek': False, 'c_step_generator_ramp': True}),
+                  ('ramp_preempt', {'c_preempt_seek': True, 'c_step_generator_ramp': True})]
+
+# faster than the defaults so that a switch takes some 10000 clock cycles, the ramp cruises at the fixed fast speed
+bench_speeds = {'c_microsteps_per_seconds_fast': 50000,
+                'c_microsteps_per_seconds_slow': 5000,
+                'c_microsteps_per_seconds_cruise': 50000}
+
+
+def seek_constants(travel, constants):
+    config = ControllerConfig(**dict(bench_speeds, **constants))
+    fast = (travel - config.c_travel_margin) * config.c_prescaler_fast
+    slow = 4 * travel * config.c_prescaler_slow
+    return dict(bench_speeds,
+                c_pos1_seeking_fast_counter_maxvalue=fast, c_pos2_seeking_fast_counter_maxvalue=fast,
+                c_pos1_seeking_slow_counter_maxvalue=slow, c_pos2_seeking_slow_counter_maxvalue=slow,
+                **constants)
+
+
+def bench(travel, max_cycles, log, steps, toggles, interval, config):
+    clk = Signal(bool(0))
+    reset = ResetSignal(1, active=0, async=True)
+    state_reset = Signal(bool(0))
+    state = Signal(m_state.init)
+    hall1_not = Signal(bool(0))
+    hall2_not = Signal(bool(1))
+    drive2pos1_manual = Signal(bool(0))
+    drive2pos2_manual = Signal(bool(0))
+    drive2pos1_PIO = Signal(bool(0))
+    drive2pos2_PIO = Signal(bool(0))
+    lock_manual_input = Signal(bool(0))
+    stepper_direction = Signal(bool(c_direction_pos1))
+    stepper_steps = Signal(bool(0))
+
+    dut = mirror_box_controller(clk, reset, state_reset, state, hall1_not, hall2_not, drive2pos1_manual,
+                                drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO, lock_manual_input, stepper_direction,
+                                stepper_steps, config)
+    mechanics = mirror_box(stepper_steps, stepper_direction, hall1_not, hall2_not, travel, steps)
+    logger = event_logger(log, dut, state, stepper_direction,
+                          (drive2pos1_manual, drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO))
+
+    @always(delay(50))
+    def clkgen():
+        clk.next = not clk
+
+    @instance
+    def command():
+        while state != m_state.pos1_resting:
+            yield clk.posedge
+        for k in range(toggles):
+            drive = drive2pos2_PIO if k % 2 == 0 else drive2pos1_PIO
+            yield clk.negedge
+            drive.next = 1
+            yield clk.negedge
+            drive.next = 0
+            for i in range(interval - 1):
+                yield clk.posedge
+        while state != (m_state.pos2_resting if toggles % 2 else m_state.pos1_resting):
+            yield clk.posedge
+        raise StopSimulation
+
+    @instance
+    def stop():
+        for i in xrange(max_cycles):
+            yield clk.posedge
+            if state in error_states:
+                raise StopSimulation
+        raise StopSimulation
+
+    return dut, mechanics, logger, clkgen, command, stop
+
+
+def run_configuration(args):
+    name, constants, travel, toggles, interval = args
+    constants = seek_constants(travel, constants)
+    log = EventLog()
+    steps = []
+    max_cycles = (toggles + 2) * (constants['c_pos1_seeking_fast_counter_maxvalue'] +
+                                  constants['c_pos1_seeking_slow_counter_maxvalue'] + interval)
+    start = wall_time()
+    Simulation(bench(travel, max_cycles, log, steps, toggles, interval, ControllerConfig(**constants))).run(quiet=1)
+    log.finish(now())
+    elapsed = wall_time() - start
+    target = 'pos2_resting' if toggles % 2 else 'pos1_resting'
+    commands = sorted(t for kind in ('drive2pos1_PIO', 'drive2pos2_PIO') for t, value in log.events(kind) if value)
+    last_time, final_state = log.events('state')[-1]
+    rest = last_time if final_state == target else None
+    # (stand still ns, rate of the last microstep before it) of every reversal of the carriage
+    reversals = [(t2 - t1, 1e9 / (t1 - t0)) for (t0, p0), (t1, p1), (t2, p2) in zip(steps, steps[1:], steps[2:])
+                 if (p1 - p0) * (p2 - p1) < 0]
+    return {'name': name,
+            'interval': interval,
+            'final_state': final_state,
+            'latency': rest - commands[-1] if rest is not None else None,
+            'settle': rest - commands[0] if rest is not None else None,
+            'microsteps': len(steps),
+            'final_position': steps[-1][1] if steps else 0,
+            'reversals': len(reversals),
+            'reversal_still': min(still for still, rate in reversals) if reversals else None,
+            'reversal_rate': max(rate for still, rate in reversals) if reversals else None,
+            'wall_time': elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='command to rest latency under rapid toggling, with c_preempt_seek')
+    parser.add_argument('--travel', type=int, default=20, help='microsteps between the hall sensors')
+    parser.add_argument('--toggles', type=int, default=2, help='number of commands, pos2 first')
+    parser.add_argument('--intervals', type=int, nargs='+', default=[1000, 4000],
+                        help='clock cycles between two commands')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes, default: all cores')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    pool = Pool(args.processes or cpu_count())
+    try:
+        results = pool.map(run_configuration, [(name, constants, args.travel, args.toggles, interval)
+                                               for interval in args.intervals for name, constants in configurations])
+    finally:
+        pool.close()
+        pool.join()
+    print '%-14s  %8s  %-20s  %10s  %10s  %6s  %8s  %9s  %8s  %9s' % (
+        'config', 'interval', 'final state', 'latency ms', 'settle ms', 'steps', 'position', 'reversals', 'still us',
+        'rate 1/s')
+    for result in results:
+        print '%-14s  %8d  %-20s  %10.3f  %10.3f  %6d  %8d  %9d  %8s  %9s' % (
+            result['name'], result['interval'], result['final_state'], (result['latency'] or 0) / 1e6,
+            (result['settle'] or 0) / 1e6, result['microsteps'], result['final_position'], result['reversals'],
+            '%.1f' % (result['reversal_still'] / 1e3) if result['reversals'] else '-',
+            '%.0f' % result['reversal_rate'] if result['reversals'] else '-')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'travel': args.travel, 'toggles': args.toggles, 'results': results}, f, indent=2)
@@ -0,0 +1,195 @@
+import argparse
+import json
+from time import time as wall_time
+from main import *
+from event_log import EventLog, event_logger
+
+# benchmark of the pos1 -> pos2 transition time with the fixed speed prescalers and with step_generator_ramp
+#
+# A model of the mirror box mechanics moves the carriage by one microstep per cycle of stepper_steps, hall sensor 1 is
+# active at microstep 0 and hall sensor 2 from microstep travel on. For every configuration the fast seek counter is
+# set such that the fast phase, including the deceleration of the ramp, ends margin microsteps before hall sensor 2,
+# the slow seek counter leaves enough time for the rest of the way.
+#
+# ramp_fast has the top speed of fixed, c_microsteps_per_seconds_fast, ramp_cruise that of
+# c_microsteps_per_seconds_cruise. Only the comparison of fixed with ramp_fast shows what the ramp itself costs or
+# gains, ramp_cruise is faster because of its higher top speed. At the same top speed the ramp is slower, it buys its
+# smaller jumps of the step rate with latency, see README.md.
+#
+#   python bench_ramp.py [--travel 50] [--margin 2] [--json bench_ramp.json]
+
+configurations = [('fixed', {'c_step_generator_ramp': False}),
+                  ('ramp_fast', {'c_step_generator_ramp': True,
+                                 'c_microsteps_per_seconds_cruise': c_microsteps_per_seconds_fast}),
+                  ('ramp_cruise', {'c_step_generator_ramp': True,
+                                   'c_microsteps_per_seconds_cruise': c_microsteps_per_seconds_cruise})]
+error_states = (m_state.seek_home_timeout, m_state.pos1_resting_error, m_state.pos1_seeking_timeout,
+                m_state.pos2_resting_error, m_state.pos2_seeking_timeout)
+
+
+def fast_phase_distance(cycles, constants):
+    # microsteps moved when the fast phase lasts cycles clock cycles, including the deceleration after it
+    if not constants['c_step_generator_ramp']:
+        return float(cycles) * c_microsteps_per_seconds_fast / c_clock_freq, 0.0
+    tick = 1.0 / c_ramp_update_freq
+    ticks, rest = divmod(cycles, c_clock_freq / c_ramp_update_freq)
+    speed = c_microsteps_per_seconds_slow
+    distance = 0.0
+    for k in range(ticks):
+        distance += speed * tick
+        speed = min(speed + c_acceleration * tick, constants['c_microsteps_per_seconds_cruise'])
+    distance += speed * float(rest) / c_clock_freq
+    deceleration_time = 0.0
+    while speed > c_microsteps_per_seconds_slow:
+        distance += speed * tick
+        deceleration_time += tick
+        speed = max(speed - c_deceleration * tick, c_microsteps_per_seconds_slow)
+    return distance, deceleration_time
+
+
+def seek_counters(travel, margin, constants):
+    # maxvalues of the pos2 seek counters for travel and margin
+    low, high = 0, c_clock_freq
+    while low < high:
+        middle = (low + high) / 2
+        if fast_phase_distance(middle, constants)[0] < travel - margin:
+            low = middle + 1
+        else:
+            high = middle
+    deceleration_time = fast_phase_distance(low, constants)[1]
+    slow_time = deceleration_time + float(margin + 1) / c_microsteps_per_seconds_slow
+    return {'c_pos2_seeking_fast_counter_maxvalue': low,
+            'c_pos2_seeking_slow_counter_maxvalue': int(4 * slow_time * c_clock_freq)}
+
+
+def mirror_box(stepper_steps, stepper_direction, hall1_not, hall2_not, travel, steps):
+    # mechanics: steps gets (time, position) of every microstep
+    @instance
+    def carriage():
+        position = 0
+        while True:
+            yield stepper_steps.posedge
+            position += 1 if stepper_direction == c_direction_pos2 else -1
+            steps.append((now(), position))
+            hall1_not.next = position > 0
+            hall2_not.next = position < travel
+
+    return carriage
+
+
+def bench(travel, max_cycles, log, steps, moves=1, config=None):
+    # moves alternating switches, pos1 -> pos2 first, config: ControllerConfig of the dut
+    clk = Signal(bool(0))
+    reset = ResetSignal(1, active=0, async=True)
+    state_reset = Signal(bool(0))
+    state = Signal(m_state.init)
+    hall1_not = Signal(bool(0))
+    hall2_not = Signal(bool(1))
+    drive2pos1_manual = Signal(bool(0))
+    drive2pos2_manual = Signal(bool(0))
+    drive2pos1_PIO = Signal(bool(0))
+    drive2pos2_PIO = Signal(bool(0))
+    lock_manual_input = Signal(bool(0))
+    stepper_direction = Signal(bool(c_direction_pos1))
+    stepper_steps = Signal(bool(0))
+
+    dut = mirror_box_controller(clk, reset, state_reset, state, hall1_not, hall2_not, drive2pos1_manual,
+                                drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO, lock_manual_input, stepper_direction,
+                                stepper_steps, config)
+    mechanics = mirror_box(stepper_steps, stepper_direction, hall1_not, hall2_not, travel, steps)
+    logger = event_logger(log, dut, state, stepper_direction,
+                          (drive2pos1_manual, drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO))
+
+    @always(delay(50))
+    def clkgen():
+        clk.next = not clk
+
+    @instance
+    def command():
+        for k in range(moves):
+            drive, resting = ((drive2pos2_PIO, m_state.pos1_resting) if k % 2 == 0 else
+                              (drive2pos1_PIO, m_state.pos2_resting))
+            while state != resting:
+                yield clk.posedge
+            yield clk.negedge
+            drive.next = 1
+            yield clk.negedge
+            drive.next = 0
+        while state != (m_state.pos2_resting if moves % 2 else m_state.pos1_resting):
+            yield clk.posedge
+        raise StopSimulation
+
+    @instance
+    def stop():
+        for i in xrange(max_cycles):
+            yield clk.posedge
+            if state in error_states:
+                raise StopSimulation
+        raise StopSimulation
+
+    return dut, mechanics, logger, clkgen, command, stop
+
+
+def speed_statistics(steps, states):
+    # top speed and largest change of speed between two microsteps in microsteps/s. The top speed only counts the
+    # intervals between two microsteps in the same state: with the fixed speed prescalers the first microstep after a
+    # change of speed can come early, the step clock runs freely (see shared_generators), and that shortened interval
+    # is not a speed the stepper runs at.
+    speeds = [1e9 / (t - last) for (last, p), (t, q) in zip(steps, steps[1:])]
+    changes = [t for t, state in states]
+    steady = [speed for ((last, p), (t, q)), speed in zip(zip(steps, steps[1:]), speeds)
+              if not any(last < change <= t for change in changes)]
+    jumps = [abs(b - a) for a, b in zip(speeds, speeds[1:])]
+    return max(steady or [0]), max(jumps or [0])
+
+
+def run_configuration(name, constants, travel, margin):
+    constants = dict(constants, **seek_counters(travel, margin, constants))
+    log = EventLog()
+    steps = []
+    max_cycles = 2 * (constants['c_pos2_seeking_fast_counter_maxvalue'] +
+                      constants['c_pos2_seeking_slow_counter_maxvalue']) + 1000
+    start = wall_time()
+    Simulation(bench(travel, max_cycles, log, steps, config=ControllerConfig(**constants))).run(quiet=1)
+    elapsed = wall_time() - start
+    latency = log.command_latency('pos2_resting')
+    states = log.events('state')
+    fast = [t for t, state in states if state == 'pos2_seeking_fast']
+    slow = [t for t, state in states if state == 'pos2_seeking_slow']
+    top_speed, speed_jump = speed_statistics(steps, states)
+    return {'name': name,
+            'final_state': states[-1][1],
+            'latency': latency[0][1] if latency else None,
+            'fast_phase': slow[0] - fast[0] if fast and slow else None,
+            'microsteps': len(steps),
+            'final_position': steps[-1][1] if steps else 0,
+            'top_speed': top_speed,
+            'speed_jump': speed_jump,
+            'fast_counter_maxvalue': constants['c_pos2_seeking_fast_counter_maxvalue'],
+            'wall_time': elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pos1 -> pos2 transition time with and without step_generator_ramp')
+    parser.add_argument('--travel', type=int, default=50, help='microsteps between the hall sensors')
+    parser.add_argument('--margin', type=int, default=2, help='microsteps in slow speed before hall sensor 2')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = [run_configuration(name, constants, args.travel, args.margin) for name, constants in configurations]
+    print '%-12s  %-20s  %10s  %10s  %6s  %10s  %10s' % ('config', 'final state', 'latency ms', 'fast ms',
+                                                          'steps', 'top 1/s', 'jump 1/s')
+    for result in results:
+        print '%-12s  %-20s  %10.3f  %10.3f  %6d  %10.0f  %10.0f' % (
+            result['name'], result['final_state'], (result['latency'] or 0) / 1e6, (result['fast_phase'] or 0) / 1e6,
+            result['microsteps'], result['top_speed'], result['speed_jump'])
+    fixed = results[0]
+    for result in results[1:]:
+        if fixed['latency'] and result['latency']:
+            change = 100.0 * result['latency'] / fixed['latency'] - 100
+            print '%s (top %.0f 1/s) takes %.1f%% %s than fixed (top %.0f 1/s)' % (
+                result['name'], result['top_speed'], abs(change), 'longer' if change > 0 else 'less',
+                fixed['top_speed'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'travel': args.travel, 'margin': args.margin, 'results': results}, f, indent=2)
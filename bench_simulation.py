@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+from multiprocessing import Pool
+from timeit import default_timer
+import myhdl
+from main import *
+from event_log import internal_signal
+from tb import testbench
+
+# simulation throughput of mirror_box_controller with tracing and printing on and off
+#
+# Every case elaborates tb.testbench on a fixed stimulus of the given number of clock cycles and simulates it in a fresh
+# worker process, so that its peak memory is its own. The stimulus homes the mirror and then moves it back and forth
+# every period clock cycles, with the hall sensors following. Tracing is traceSignals into a temporary directory,
+# printing is one line per change of state, stepper_direction or stepper_steps written to os.devnull. Reported per
+# case are the elaboration time (testbench, traceSignals and Simulation until the first clock edge), the simulated
+# clock cycles per second of wall time and the peak resident memory of the process.
+#
+# With --baseline the results are compared with those of an earlier --json file and the exit status is 1 if a metric
+# is worse by more than --threshold (relative). Elaboration times only count as a regression when they also grew by
+# more than elaboration_floor, they are short enough for scheduling noise to be a large part of them.
+#
+#   python bench_simulation.py [--cycles 10000 100000 1000000] [--modes quiet print trace trace_print] [-j 1]
+#                              [--json bench.json] [--baseline bench.json] [--threshold 0.2]
+
+modes = {'quiet': (False, False),
+         'print': (False, True),
+         'trace': (True, False),
+         'trace_print': (True, True)}
+mode_order = ('quiet', 'print', 'trace', 'trace_print')
+
+# (name, True if higher is better)
+metrics = (('cycles_per_second', True), ('peak_memory_kb', False), ('elaboration_time', False))
+elaboration_floor = 0.05    # s
+
+
+def bench_scenario(cycles, period=200, reach=1500):
+    # homing, then a drive2pos2_PIO or drive2pos1_PIO command every period clock cycles. The hall sensor that is left
+    # goes inactive 500 ns after the command and the one of the target becomes active reach ns after it.
+    events = [(400, 'hall1_not', 0)]
+    t = 20 * 100
+    k = 0
+    while t + period * 100 <= cycles * 100:
+        if k % 2 == 0:
+            drive, leave, arrive = 'drive2pos2_PIO', 'hall1_not', 'hall2_not'
+        else:
+            drive, leave, arrive = 'drive2pos1_PIO', 'hall2_not', 'hall1_not'
+        events += [(t, drive, 1), (t + 100, drive, 0), (t + 500, leave, 1), (t + reach, arrive, 0)]
+        t += period * 100
+        k += 1
+    return {'name': 'bench_%d' % cycles, 'cycles': cycles, 'events': events}
+
+
+def printer(out, state, stepper_direction, stepper_steps):
+    @instance
+    def print_changes():
+        while True:
+            yield state, stepper_direction, stepper_steps
+            print >>out, now(), state, int(stepper_direction), int(stepper_steps)
+
+    return print_changes
+
+
+def run_case(args):
+    cycles, mode = args
+    trace, printing = modes[mode]
+    # traceSignals writes <name>.vcd, MyHDL needs the source files by their relative path, so no chdir
+    workdir = tempfile.mkdtemp(prefix='bench_simulation_')
+    vcd_name = os.path.join(workdir, 'bench')
+    out = open(os.devnull, 'w')
+    try:
+        scenario = bench_scenario(cycles)
+        start = default_timer()
+        if trace:
+            traceSignals.name = vcd_name
+            tb = traceSignals(testbench, scenario)
+        else:
+            tb = testbench(scenario)
+        printers = []
+        if printing:
+            dut = tb[0]
+            printers.append(printer(out, internal_signal(dut, 'state'), internal_signal(dut, 'stepper_direction'),
+                                    internal_signal(dut, 'stepper_steps')))
+        sim = Simulation(tb, printers)
+        elaboration_time = default_timer() - start
+        start = default_timer()
+        sim.run(quiet=1)
+        run_time = default_timer() - start
+        vcd_bytes = os.path.getsize(vcd_name + '.vcd') if trace else 0
+    finally:
+        out.close()
+        shutil.rmtree(workdir)
+    return {'name': '%d_%s' % (cycles, mode),
+            'cycles': cycles,
+            'mode': mode,
+            'elaboration_time': elaboration_time,
+            'run_time': run_time,
+            'cycles_per_second': cycles / run_time,
+            'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,    # kB on Linux
+            'vcd_bytes': vcd_bytes}
+
+
+def run_benchmarks(cycles_list, mode_names, processes=1):
+    # one worker process per case, by default one case after the other so that they do not compete for the cores
+    pool = Pool(processes, maxtasksperchild=1)
+    try:
+        return pool.map(run_case, [(cycles, mode) for cycles in cycles_list for mode in mode_names], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def regressions(results, baseline, threshold):
+    # ['<case>: <metric> <value> vs <baseline value>', ...] for metrics worse than baseline by more than threshold
+    previous = dict((result['name'], result) for result in baseline['results'])
+    found = []
+    for result in results:
+        if result['name'] not in previous:
+            continue
+        for name, higher_is_better in metrics:
+            value, reference = result[name], previous[result['name']][name]
+            if higher_is_better:
+                worse = value < reference * (1 - threshold)
+            else:
+                worse = value > reference * (1 + threshold)
+                if name == 'elaboration_time':
+                    worse = worse and value - reference > elaboration_floor
+            if worse:
+                found.append('%s: %s %.4g vs %.4g' % (result['name'], name, value, reference))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='simulation throughput of mirror_box_controller')
+    parser.add_argument('--cycles', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6],
+                        help='clock cycles per case')
+    parser.add_argument('--modes', nargs='+', choices=mode_order, default=list(mode_order),
+                        help='tracing and printing on or off')
+    parser.add_argument('-j', '--processes', type=int, default=1, help='worker processes, default: 1')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change that counts as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cycles, args.modes, args.processes)
+    print '%-20s  %10s  %10s  %12s  %10s  %12s' % ('case', 'elab s', 'run s', 'cycles/s', 'peak MB', 'vcd MB')
+    for result in results:
+        print '%-20s  %10.3f  %10.2f  %12.0f  %10.1f  %12.1f' % (
+            result['name'], result['elaboration_time'], result['run_time'], result['cycles_per_second'],
+            result['peak_memory_kb'] / 1024.0, result['vcd_bytes'] / 1e6)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'myhdl': myhdl.__version__,
+                       'config': ControllerConfig().as_dict(), 'results': results}, f, indent=2)
+    failed = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed = regressions(results, json.load(f), args.threshold)
+        for line in failed:
+            print 'REGRESSION', line
+        print '%d regressions against %s, threshold %g' % (len(failed), args.baseline, args.threshold)
+    sys.exit(1 if failed else 0)
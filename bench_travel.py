@@ -0,0 +1,88 @@
+import argparse
+import json
+from time import time as wall_time
+from main import *
+from event_log import EventLog
+from bench_ramp import bench
+
+# slow approach time per switch with the fixed time fast phases and with travel_memory (c_learn_travel)
+#
+# Runs alternating pos1 <-> pos2 switches against the mechanics model of bench_ramp.py. The fixed fast phases are
+# set to cover fast_fraction of the travel, the first pos1 -> pos2 switch is the one in which travel_memory learns the
+# distance.
+#
+#   python bench_travel.py [--travel 30] [--moves 3] [--fast-fraction 0.5] [--json bench_travel.json]
+
+configurations = [('fixed_time', {'c_learn_travel': False}),
+                  ('learned', {'c_learn_travel': True})]
+
+
+def seek_counters(travel, fast_fraction):
+    fast = int(travel * fast_fraction * c_clock_freq / c_microsteps_per_seconds_fast)
+    slow = int(2.0 * travel * c_clock_freq / c_microsteps_per_seconds_slow)
+    return {'c_pos1_seeking_fast_counter_maxvalue': fast,
+            'c_pos2_seeking_fast_counter_maxvalue': fast,
+            'c_pos1_seeking_slow_counter_maxvalue': slow,
+            'c_pos2_seeking_slow_counter_maxvalue': slow}
+
+
+def switches(log):
+    # [(target, latency, slow approach time), ...] of every drive2pos*_PIO command, times in ns
+    commands = sorted([(t, 'pos1') for t, value in log.events('drive2pos1_PIO') if value] +
+                      [(t, 'pos2') for t, value in log.events('drive2pos2_PIO') if value])
+    states = log.events('state') + [(log.end_time, None)]
+    result = []
+    for t, target in commands:
+        slow = 0
+        arrival = None
+        for (start, state), (end, next_state) in zip(states, states[1:]):
+            if end <= t:
+                continue
+            if state == target + '_seeking_slow':
+                slow += end - max(start, t)
+            if next_state == target + '_resting':
+                arrival = end
+                break
+        result.append((target, arrival - t if arrival is not None else None, slow))
+    return result
+
+
+def run_configuration(name, constants, travel, moves, fast_fraction):
+    constants = dict(constants, **seek_counters(travel, fast_fraction))
+    log = EventLog()
+    steps = []
+    start = wall_time()
+    sim = Simulation(bench(travel, 4 * moves * constants['c_pos1_seeking_slow_counter_maxvalue'], log, steps, moves,
+                           ControllerConfig(**constants)))
+    sim.run(quiet=1)
+    log.finish(now())
+    elapsed = wall_time() - start
+    return {'name': name,
+            'final_state': log.states()[-1],
+            'switches': [{'target': target, 'latency': latency, 'slow_approach': slow}
+                         for target, latency, slow in switches(log)],
+            'wall_time': elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='slow approach time per switch with and without travel_memory')
+    parser.add_argument('--travel', type=int, default=30, help='microsteps between the hall sensors')
+    parser.add_argument('--moves', type=int, default=3, help='number of switches, pos1 -> pos2 first')
+    parser.add_argument('--fast-fraction', type=float, default=0.5,
+                        help='part of the travel covered by the fixed time fast phase')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = [run_configuration(name, constants, args.travel, args.moves, args.fast_fraction)
+               for name, constants in configurations]
+    print '%-12s  %6s  %-6s  %10s  %10s' % ('config', 'switch', 'target', 'latency ms', 'slow ms')
+    for result in results:
+        for k, switch in enumerate(result['switches']):
+            print '%-12s  %6d  %-6s  %10.3f  %10.3f' % (result['name'], k + 1, switch['target'],
+                                                        (switch['latency'] or 0) / 1e6, switch['slow_approach'] / 1e6)
+        print '%-12s  final state %s, slow approach %.3f ms in total' % (
+            result['name'], result['final_state'], sum(s['slow_approach'] for s in result['switches']) / 1e6)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'travel': args.travel, 'moves': args.moves, 'fast_fraction': args.fast_fraction,
+                       'margin': c_travel_margin, 'results': results}, f, indent=2)
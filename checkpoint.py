@@ -0,0 +1,170 @@
+import argparse
+import sys
+from time import time as wall_time
+from myhdl import intbv
+from myhdl._Signal import _Signal
+from myhdl._enum import EnumItemType
+from main import *
+from event_log import EventLog
+from fast_model import c_clock_period, input_init, MirrorBoxModel
+from scenarios import prefixes, scenarios
+
+# checkpoint/fork of simulations: a prefix stimulus (scenarios.prefixes) is simulated once, the state of the
+# controller after it is kept in a snapshot and every scenario that starts with the same events continues from there
+#
+# A snapshot is a plain dict that pickles, so it can be taken in the parent process and forked in the workers of
+# regression.py. For the fast_model twin it holds what MirrorBoxModel.snapshot returns. For MyHDL it holds the values
+# of all signals of the elaborated controller, registers, flags, prescaler counters and comb outputs alike. A fork
+# elaborates a new controller, sets its signals to those values and runs the rest of the scenario shifted to time 0,
+# with the inputs at the time of the snapshot applied at time 0.
+#
+# The snapshot is taken between two clock edges. Every register of the controller has a single driver, so a fork does
+# not depend on the order in which MyHDL resumes the generators and may start after any number of clock edges.
+#
+#   python checkpoint.py [--engine model]    compares every forked scenario with its full simulation
+
+
+def controller_signals(instances, found=None):
+    # [(name, signal), ...] of all signals in the symbol tables of the blocks of a dut, every signal once under the
+    # first name it was found with, in the same order for every elaboration of the same configuration
+    if found is None:
+        found = []
+    if isinstance(instances, (tuple, list)):
+        for inst in instances:
+            controller_signals(inst, found)
+    else:
+        for name, sig in sorted(getattr(instances, 'symdict', {}).items()):
+            if isinstance(sig, _Signal) and not any(sig is other for other_name, other in found):
+                found.append((name, sig))
+    return found
+
+
+def signal_value(sig):
+    if isinstance(sig.val, EnumItemType):
+        return str(sig.val)
+    return int(sig.val)
+
+
+def restore_signal(sig, value):
+    # sets the current and the next value of a signal before the simulation starts. Signal has no api for it, so this
+    # writes the private _val and _next attributes of the MyHDL 0.9 Signal, and of its intbv, directly. Nothing is
+    # scheduled, the blocks see the values at their first evaluation.
+    if isinstance(sig.val, EnumItemType):
+        sig._val = sig._next = getattr(m_state, value)
+    elif isinstance(sig.val, intbv):
+        sig._val._val = sig._next._val = value
+    else:
+        sig._val = sig._next = type(sig.val)(value)
+
+
+def restore_signals(dut, values):
+    signals = controller_signals(dut)
+    if [name for name, sig in signals] != [name for name, value in values]:
+        raise ValueError('the snapshot was taken from a controller with other signals')
+    for (name, sig), (snapshot_name, value) in zip(signals, values):
+        restore_signal(sig, value)
+
+
+def inputs_at(events, t):
+    # values of the inputs after all events before time t
+    values = dict(input_init)
+    for event_time, name, value in sorted(events, key=lambda e: e[0]):
+        if event_time < t:
+            values[name] = int(value)
+    return values
+
+
+def take_snapshot(prefix, engine='myhdl'):
+    # simulates prefix['cycles'] clock edges of the prefix stimulus
+    cycles = prefix['cycles']
+    t = cycles * c_clock_period
+    if any(event_time >= t for event_time, name, value in prefix['events']):
+        raise ValueError('prefix %s has events after its last clock edge' % prefix['name'])
+    snapshot = {'prefix': prefix['name'], 'engine': engine, 'cycles': cycles, 'time': t}
+    if engine == 'model':
+        model = MirrorBoxModel(prefix['events'])
+        model.run(cycles)
+        snapshot['model'] = model.snapshot()
+    else:
+        from tb import testbench
+        log = EventLog()
+        tb = testbench(dict(prefix, cycles=cycles + 1), log)
+        Simulation(tb).run(t, quiet=1)
+        snapshot['signals'] = [(name, signal_value(sig)) for name, sig in controller_signals(tb[0])]
+        snapshot['inputs'] = inputs_at(prefix['events'], t)
+        snapshot['transitions'] = log.events('state')
+    return snapshot
+
+
+def check_prefix(scenario, prefix, t):
+    # the scenario has to have exactly the events of the prefix before time t
+    own = sorted((event for event in scenario['events'] if event[0] < t), key=lambda e: e[0])
+    if own != sorted(prefix['events'], key=lambda e: e[0]):
+        raise ValueError('scenario %s does not start with the events of prefix %s' % (scenario['name'],
+                                                                                      prefix['name']))
+
+
+def fork(snapshot, scenario):
+    # runs the part of the scenario after the snapshot, returns the state transitions of the whole scenario as
+    # [(time, state name), ...]
+    t = snapshot['time']
+    check_prefix(scenario, prefixes[snapshot['prefix']], t)
+    events = [event for event in scenario['events'] if event[0] >= t]
+    if snapshot['engine'] == 'model':
+        model = MirrorBoxModel.from_snapshot(snapshot['model'], events)
+        return [(event_time, str(state)) for event_time, state, direction, steps in model.run(scenario['cycles'])]
+    from tb import testbench
+    start_events = [(0, name, value) for name, value in sorted(snapshot['inputs'].items())
+                    if value != input_init[name]]
+    forked = dict(scenario, cycles=scenario['cycles'] - snapshot['cycles'],
+                  events=start_events + [(event_time - t, name, value) for event_time, name, value in events])
+    log = EventLog()
+    Simulation(testbench(forked, log, snapshot=snapshot['signals'])).run(quiet=1)
+    return snapshot['transitions'] + [(event_time + t, name) for event_time, name in log.events('state')]
+
+
+def full_transitions(scenario, engine):
+    if engine == 'model':
+        model = MirrorBoxModel(scenario['events'])
+        return [(event_time, str(state)) for event_time, state, direction, steps in model.run(scenario['cycles'])]
+    from tb import testbench
+    log = EventLog()
+    Simulation(testbench(scenario, log)).run(quiet=1)
+    return log.events('state')
+
+
+def distinct(transitions):
+    # drops entries that repeat the state before them
+    result = []
+    for t, name in transitions:
+        if not result or result[-1][1] != name:
+            result.append((t, name))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compares forked scenarios with their full simulation')
+    parser.add_argument('--engine', choices=('myhdl', 'model'), default='myhdl')
+    args = parser.parse_args()
+
+    failed = 0
+    snapshots = {}
+    for scenario in scenarios:
+        if 'prefix' not in scenario:
+            continue
+        if scenario['prefix'] not in snapshots:
+            snapshots[scenario['prefix']] = take_snapshot(prefixes[scenario['prefix']], args.engine)
+        start = wall_time()
+        full = distinct(full_transitions(scenario, args.engine))
+        full_time = wall_time() - start
+        start = wall_time()
+        forked = distinct(fork(snapshots[scenario['prefix']], scenario))
+        fork_time = wall_time() - start
+        equal = full == forked
+        failed += not equal
+        print '%-30s  %-6s  full %.3f s  fork %.3f s' % (scenario['name'], 'equal' if equal else 'DIFFER', full_time,
+                                                          fork_time)
+        if not equal:
+            print '    full:', full
+            print '    fork:', forked
+    sys.exit(1 if failed else 0)
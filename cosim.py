@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from distutils.spawn import find_executable
+from time import time as wall_time
+from main import *
+from fast_model import c_clock_period, delayed_inputs, input_init, model_inputs, myhdl_trace
+from gen_verilog import controller_ports, to_verilog
+from scenarios import scenario_tb, scenario_by_name, scenarios
+
+# runs a stimulus of scenarios.py against the Verilog of mirror_box_controller under Icarus Verilog and compares the
+# state, stepper_direction and stepper_steps traces with the MyHDL simulation
+#
+# The controller is converted with toVerilog, a generated testbench applies the events and prints every change of the
+# three outputs, iverilog compiles both and vvp runs them. The traces are in the format of fast_model.myhdl_trace.
+# The controller is the one of the default configuration.
+#
+# Not verified yet: no Icarus Verilog was available where this was written, so the comparison has never been run and
+# the testbench and the trace parsing may still need fixes. --sources-only writes mirror_box_controller.v and
+# tb_cosim.v to the work directory without running a simulator. --self-test cosimulates all scenarios of scenarios.py
+# and fails on the first difference, without iverilog and vvp it says so and is skipped.
+#
+#   python cosim.py [scenario] [--cycles 1000000] [--workdir cosim] [--json cosim.json] [--sources-only]
+#   python cosim.py --self-test
+
+# tb_cosim holds the reset from 1 ns over reset_cycles rising clock edges and releases it on a falling edge. The
+# stimulus starts then, and the times of the trace count from there.
+reset_cycles = 2
+reset_time = reset_cycles * c_clock_period
+
+
+def testbench_verilog(events, n_cycles):
+    # tb_cosim drives the inputs like tb.py. The registers of the converted controller have no initial values, the
+    # reset they get before the stimulus starts (see reset_time) gives them the initial values of the MyHDL signals.
+    # MyHDL updates a clock edge and the input changes of the same time together and only then runs the sequential
+    # blocks, so these see a changed input at that edge, but see hall1/hall2 of the inverter_hall* comb blocks one edge
+    # later. In tb_cosim the clock toggles with a non blocking assignment, so the inputs, which change with blocking
+    # assignments, have their new values when the always @(posedge clk) blocks run, and hall*_not change 1 ns late.
+    state_width = len(Signal(m_state.init))
+    lines = ['`timescale 1ns/10ps', '', 'module tb_cosim;', '', 'reg clk = 0;']
+    lines += ['reg %s = %d;' % (name, input_init[name]) for name in model_inputs]
+    lines += ['wire [%d:0] state;' % (state_width - 1), 'wire stepper_direction;', 'wire stepper_steps;', '']
+    ports = ['clk', 'reset', 'state_reset', 'state', 'hall1_not', 'hall2_not', 'drive2pos1_manual',
+             'drive2pos2_manual', 'drive2pos1_PIO', 'drive2pos2_PIO', 'lock_manual_input', 'stepper_direction',
+             'stepper_steps']
+    lines += ['mirror_box_controller dut(',
+              ',\n'.join('    .%s(%s)' % (port, port) for port in ports),
+              ');', '',
+              'always #%d clk <= !clk;' % (c_clock_period / 2), '',
+              'initial begin',
+              '    #1 reset = 0;',
+              '    #%d reset = %d;' % (reset_time - 1, input_init['reset']),
+              'end', '',
+              'initial begin']
+    t = -reset_time
+    for event_time, name, value in sorted(((event_time + (name in delayed_inputs), name, value)
+                                           for event_time, name, value in events), key=lambda e: e[0]):
+        lines.append('    #%d %s = %d;' % (event_time - t, name, bool(value)))
+        t = event_time
+    lines += ['end', '',
+              'initial #%d $finish;' % (reset_time + n_cycles * c_clock_period), '',
+              'initial #%d $strobe("%%0t %%0d %%0d %%0d", $time, state, stepper_direction, stepper_steps);' % (
+                  reset_time),
+              'always @(state, stepper_direction, stepper_steps)',
+              '    $strobe("%0t %0d %0d %0d", $time, state, stepper_direction, stepper_steps);', '',
+              'endmodule', '']
+    return '\n'.join(lines)
+
+
+def parse_trace(output):
+    # the $strobe lines of tb_cosim from the end of the reset on in the format of fast_model.myhdl_trace, states by
+    # name, unknown values as 'x'
+    trace = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 4 or not fields[0].isdigit() or int(fields[0]) < reset_time:
+            continue
+        t = int(fields[0]) - reset_time
+        state = m_state._names[int(fields[1])] if fields[1].isdigit() else 'x'
+        out = (state,) + tuple(int(field) if field.isdigit() else 'x' for field in fields[2:])
+        if trace and trace[-1][0] == t:
+            trace.pop()
+        if not trace or trace[-1][1:] != out:
+            trace.append((t,) + out)
+    return trace
+
+
+def first_difference(expected, actual, end_time):
+    # None or a description of the first difference of two traces before end_time
+    expected = [(t, str(state), direction, steps) for t, state, direction, steps in expected if t < end_time]
+    actual = [entry for entry in actual if entry[0] < end_time]
+    for e, a in zip(expected, actual):
+        if e != a:
+            return 'MyHDL: %s %s %s %s, iverilog: %s %s %s %s' % (e + a)
+    if len(expected) != len(actual):
+        return 'MyHDL trace has %d entries, iverilog trace has %d' % (len(expected), len(actual))
+    return None
+
+
+def write_sources(events, n_cycles, config, workdir):
+    # converts the controller and writes the testbench into workdir
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    toVerilog.directory = workdir
+    toVerilog.no_testbench = True
+    to_verilog(mirror_box_controller, *(controller_ports() + (config,)))
+    with open(os.path.join(workdir, 'tb_cosim.v'), 'w') as f:
+        f.write(testbench_verilog(events, n_cycles))
+
+
+def run_iverilog(events, n_cycles, config, workdir):
+    # converts the controller, compiles it with the testbench and runs it, returns (trace, compile time, run time)
+    write_sources(events, n_cycles, config, workdir)
+    start = wall_time()
+    subprocess.check_call(['iverilog', '-o', 'tb_cosim.vvp', 'mirror_box_controller.v', 'tb_cosim.v'], cwd=workdir)
+    compile_time = wall_time() - start
+    start = wall_time()
+    output = subprocess.check_output(['vvp', '-n', 'tb_cosim.vvp'], cwd=workdir)
+    return parse_trace(output), compile_time, wall_time() - start
+
+
+def cosimulate(scenario=scenario_tb, n_cycles=None, config=None, workdir='cosim'):
+    n_cycles = n_cycles or scenario['cycles']
+    config = config or ControllerConfig()
+    start = wall_time()
+    expected = myhdl_trace(scenario['events'], n_cycles, config)
+    myhdl_time = wall_time() - start
+    actual, compile_time, iverilog_time = run_iverilog(scenario['events'], n_cycles, config, workdir)
+    return {'name': scenario['name'],
+            'cycles': n_cycles,
+            'difference': first_difference(expected, actual, n_cycles * c_clock_period),
+            'myhdl_time': myhdl_time,
+            'iverilog_compile_time': compile_time,
+            'iverilog_time': iverilog_time,
+            'myhdl_cycles_per_second': n_cycles / myhdl_time,
+            'iverilog_cycles_per_second': n_cycles / iverilog_time if iverilog_time else None}
+
+
+def missing_tools():
+    return [tool for tool in ('iverilog', 'vvp') if not find_executable(tool)]
+
+
+def self_test(workdir='cosim'):
+    # cosimulates every scenario of scenarios.py, returns the number of scenarios whose traces differ, None when
+    # iverilog or vvp is missing
+    if missing_tools():
+        return None
+    failed = 0
+    for scenario in scenarios:
+        result = cosimulate(scenario, workdir=workdir)
+        failed += result['difference'] is not None
+        print '%-30s  %-5s  %s' % (scenario['name'], 'FAIL' if result['difference'] else 'equal',
+                                   result['difference'] or '')
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='cosimulation of the Verilog mirror_box_controller under iverilog')
+    parser.add_argument('scenario', nargs='?', default=scenario_tb['name'], help='scenario of scenarios.py')
+    parser.add_argument('--cycles', type=int, default=None, help='clock cycles, default: those of the scenario')
+    parser.add_argument('--workdir', default='cosim', help='directory for the Verilog files and the simulator')
+    parser.add_argument('--json', help='also write the result to this file')
+    parser.add_argument('--sources-only', action='store_true', help='only write the Verilog files to the workdir')
+    parser.add_argument('--self-test', action='store_true', help='cosimulate all scenarios, skipped without iverilog')
+    args = parser.parse_args()
+
+    if args.self_test:
+        failed = self_test(args.workdir)
+        if failed is None:
+            print 'cosimulation self test skipped: %s not found, install Icarus Verilog to run it' % (
+                ' and '.join(missing_tools()))
+            sys.exit(0)
+        print '%d scenarios, %d with differing traces' % (len(scenarios), failed)
+        sys.exit(1 if failed else 0)
+
+    scenario = scenario_by_name[args.scenario]
+    if args.sources_only:
+        write_sources(scenario['events'], args.cycles or scenario['cycles'], ControllerConfig(), args.workdir)
+        print 'mirror_box_controller.v and tb_cosim.v written to %s' % args.workdir
+        sys.exit(0)
+    missing = missing_tools()
+    if missing:
+        sys.exit('%s not found, install Icarus Verilog' % ' and '.join(missing))
+    result = cosimulate(scenario, args.cycles, workdir=args.workdir)
+    print 'MyHDL:    %d cycles in %.3f s, %.0f cycles/s' % (result['cycles'], result['myhdl_time'],
+                                                          result['myhdl_cycles_per_second'])
+    print 'iverilog: %d cycles in %.3f s (compile %.3f s), %.0f cycles/s, speedup %.1f' % (
+        result['cycles'], result['iverilog_time'], result['iverilog_compile_time'],
+        result['iverilog_cycles_per_second'], result['myhdl_time'] / result['iverilog_time'])
+    if result['difference']:
+        print 'traces differ:', result['difference']
+    else:
+        print 'state, stepper_direction and stepper_steps traces are equal'
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if result['difference'] else 0)
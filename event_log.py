@@ -0,0 +1,190 @@
+import csv
+import json
+from array import array
+from myhdl import instance, now
+from myhdl._Signal import _Signal
+from main import m_state
+
+# buffered log of state transitions, stepper direction/enable changes and commands of a simulation
+#
+# Events are kept in columns (time, kind, value) of compact arrays instead of being printed on every clock edge.
+# The log can be written in bulk to CSV or to a columnar binary file and queried afterwards, e.g.
+#   log.time_in_state()                       -- ns spent in every state
+#   log.command_latency('pos2_resting')       -- ns from every drive2pos2_* command to the next pos2_resting
+#
+# A log that streams to CSV only keeps the events since its last flush. time_in_state keeps working on it from a
+# summary of the flushed state transitions, the queries that need the single events raise ValueError once something
+# was flushed, read the CSV back with read_csv for them.
+
+kinds = ('state', 'stepper_direction', 'stepper_enable', 'drive2pos1_manual', 'drive2pos2_manual', 'drive2pos1_PIO',
+         'drive2pos2_PIO')
+state_names = m_state._names
+commands_for = {'pos1_resting': ('drive2pos1_manual', 'drive2pos1_PIO'),
+                'pos2_resting': ('drive2pos2_manual', 'drive2pos2_PIO')}
+
+
+def internal_signal(instances, name):
+    # finds a signal of a dut by its local name in the symbol tables of its always_seq/always_comb blocks
+    if isinstance(instances, (tuple, list)):
+        for inst in instances:
+            sig = internal_signal(inst, name)
+            if sig is not None:
+                return sig
+    else:
+        sig = getattr(instances, 'symdict', {}).get(name)
+        if isinstance(sig, _Signal):
+            return sig
+    return None
+
+
+class EventLog(object):
+
+    def __init__(self, csv_filename=None, chunk=65536):
+        # with csv_filename set the buffer is appended to that file whenever it holds chunk events
+        self.times = array('l')
+        self.kinds = array('B')
+        self.values = array('B')
+        self.csv_filename = csv_filename
+        self.chunk = chunk
+        self.end_time = 0
+        self.flushed = 0                # events written to the CSV file and dropped from the buffer
+        self.flushed_state_time = {}    # ns per state of the flushed transitions, without the last one
+        self.flushed_state = None       # (time, state name) of the last flushed transition
+        if csv_filename:
+            with open(csv_filename, 'wb') as f:
+                csv.writer(f).writerow(('time', 'kind', 'value'))
+
+    def append(self, t, kind, value):
+        self.times.append(t)
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.end_time = max(self.end_time, t)
+        if self.csv_filename and len(self.times) >= self.chunk:
+            self.flush()
+
+    def finish(self, t):
+        # marks the end of the simulation, writes what is left in the buffer when logging to CSV
+        self.end_time = max(self.end_time, t)
+        if self.csv_filename:
+            self.flush()
+
+    def flush(self):
+        # appends the buffered events to the CSV file and empties the buffer, the state transitions are summed up
+        with open(self.csv_filename, 'ab') as f:
+            self.write_rows(csv.writer(f))
+        transitions = self.state_transitions()
+        if transitions:
+            for (t, name), (next_t, next_name) in zip(transitions, transitions[1:]):
+                self.flushed_state_time[name] = self.flushed_state_time.get(name, 0) + next_t - t
+            self.flushed_state = transitions[-1]
+        self.flushed += len(self.times)
+        del self.times[:]
+        del self.kinds[:]
+        del self.values[:]
+
+    def write_rows(self, writer):
+        for t, kind, value in zip(self.times, self.kinds, self.values):
+            writer.writerow((t, kinds[kind], state_names[value] if kind == 0 else value))
+
+    def write_csv(self, filename):
+        with open(filename, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(('time', 'kind', 'value'))
+            self.write_rows(writer)
+
+    def write_columns(self, filename):
+        # one json header line followed by the raw columns
+        with open(filename, 'wb') as f:
+            f.write(json.dumps({'rows': len(self.times), 'end_time': self.end_time, 'kinds': kinds,
+                                'states': state_names,
+                                'columns': [('time', self.times.typecode, self.times.itemsize),
+                                            ('kind', 'B', 1), ('value', 'B', 1)]}) + '\n')
+            self.times.tofile(f)
+            self.kinds.tofile(f)
+            self.values.tofile(f)
+
+    @classmethod
+    def read_columns(cls, filename):
+        log = cls()
+        with open(filename, 'rb') as f:
+            header = json.loads(f.readline())
+            log.times.fromfile(f, header['rows'])
+            log.kinds.fromfile(f, header['rows'])
+            log.values.fromfile(f, header['rows'])
+        log.end_time = header['end_time']
+        return log
+
+    @classmethod
+    def read_csv(cls, filename):
+        log = cls()
+        with open(filename, 'rb') as f:
+            rows = csv.reader(f)
+            next(rows)
+            for t, kind, value in rows:
+                kind = kinds.index(kind)
+                log.append(int(t), kind, state_names.index(value) if kind == 0 else int(value))
+        return log
+
+    def buffered_events(self, kind):
+        # [(time, value), ...] of one kind of event in the buffer, states by name
+        k = kinds.index(kind)
+        return [(t, state_names[value] if k == 0 else value)
+                for t, event_kind, value in zip(self.times, self.kinds, self.values) if event_kind == k]
+
+    def state_transitions(self):
+        # the state transitions in the buffer, starting with the last flushed one
+        return ([self.flushed_state] if self.flushed_state else []) + self.buffered_events('state')
+
+    def events(self, kind):
+        # [(time, value), ...] of one kind of event, states by name
+        if self.flushed:
+            raise ValueError('%d events were flushed to %s, read it back with EventLog.read_csv' % (
+                self.flushed, self.csv_filename))
+        return self.buffered_events(kind)
+
+    def states(self):
+        return [name for t, name in self.events('state')]
+
+    def time_in_state(self, end_time=None):
+        end_time = self.end_time if end_time is None else end_time
+        result = dict(self.flushed_state_time)
+        transitions = self.state_transitions()
+        for (t, name), (next_t, next_name) in zip(transitions, transitions[1:] + [(end_time, None)]):
+            result[name] = result.get(name, 0) + next_t - t
+        return result
+
+    def command_latency(self, target_state='pos2_resting', commands=None):
+        # [(command time, ns until target_state is entered or None), ...] for every rising edge of a command input
+        commands = commands or commands_for[target_state]
+        command_times = sorted(t for command in commands for t, value in self.events(command) if value)
+        entries = [t for t, name in self.events('state') if name == target_state]
+        result = []
+        for t in command_times:
+            later = [entry for entry in entries if entry >= t]
+            result.append((t, later[0] - t if later else None))
+        return result
+
+
+def event_logger(log, dut, state, stepper_direction, commands):
+    # generator that feeds log, commands is a list of the drive2pos* signals in the order of kinds
+    stepper_enable = internal_signal(dut, 'flag_stepper_enable')
+    sigs = (state, stepper_direction, stepper_enable) + tuple(commands)
+
+    def code(k, sig):
+        return sig.val._index if k == 0 else int(sig.val)
+
+    @instance
+    def logger():
+        values = [code(k, sig) for k, sig in enumerate(sigs)]
+        for k, value in enumerate(values):
+            log.append(now(), k, value)
+        while True:
+            yield sigs
+            t = now()
+            for k, sig in enumerate(sigs):
+                value = code(k, sig)
+                if value != values[k]:
+                    values[k] = value
+                    log.append(t, k, value)
+
+    return logger
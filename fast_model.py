@@ -0,0 +1,527 @@
+from time import time as wall_time
+from main import *
+from scenarios import scenario_tb
+
+# pure python, cycle accurate twin of mirror_box_controller
+#
+# The model does not evaluate every clock edge. Whenever an edge only advanced counters by one, the following edges
+# will do the same until an input changes, a seek counter passes its maxvalue or the selected step clock toggles, so
+# the model jumps straight to that edge. The prescalers of step_generator_slow/step_generator_fast are free running
+# and are computed in closed form from the number of edges since the last reset.
+#
+# Stimulus is a list of (time in ns, input name, value) events, e.g. (400, 'hall1_not', 0).
+# The trace is a list of (time in ns, state, stepper_direction, stepper_steps) entries, one entry for time 0 and one
+# for every time at which one of the three values changed.
+#
+# The prescalers and seek counter maxvalues are those of a ControllerConfig, the clock edges are those of tb.py,
+# whatever c_clock_freq the configuration has.
+
+c_clock_period = 1000000000 / c_clock_freq      # ns, tb.py drives clk with delay(50) per half period
+
+model_inputs = ('reset', 'state_reset', 'hall1_not', 'hall2_not', 'drive2pos1_manual', 'drive2pos2_manual',
+                'drive2pos1_PIO', 'drive2pos2_PIO', 'lock_manual_input')
+
+# value of the inputs before the first event, same as in tb.py
+input_init = {'reset': 1,
+              'state_reset': 0,
+              'hall1_not': 1,
+              'hall2_not': 1,
+              'drive2pos1_manual': 0,
+              'drive2pos2_manual': 0,
+              'drive2pos1_PIO': 0,
+              'drive2pos2_PIO': 0,
+              'lock_manual_input': 0}
+
+# hall*_not go through the inverter_hall* comb blocks, so an edge on them at the very time of a clock edge is seen by
+# the fsm one clock edge later. All other inputs are read directly by the sequential blocks.
+delayed_inputs = ('hall1_not', 'hall2_not')
+
+# registers of mirror_box_controller and their reset values
+register_init = {'state': m_state.init,
+                 'target_position': c_position_pos1,
+                 'reg_home_seeking_slow_counter': 0,
+                 'reg_pos1_seeking_fast_counter': 0,
+                 'reg_pos1_seeking_slow_counter': 0,
+                 'reg_pos2_seeking_fast_counter': 0,
+                 'reg_pos2_seeking_slow_counter': 0,
+                 'flag_stepper_direction': 0,
+                 'flag_stepper_enable': 0,
+                 'flag_stepper_speed': 0,
+                 'flag_seek_home_slow_enable': 0,
+                 'flag_seek_pos1_slow_enable': 0,
+                 'flag_seek_pos1_fast_enable': 0,
+                 'flag_seek_pos2_slow_enable': 0,
+                 'flag_seek_pos2_fast_enable': 0,
+                 'flag_seek_home_slow_counter_top': 0,
+                 'flag_seek_pos1_slow_counter_top': 0,
+                 'flag_seek_pos1_fast_counter_top': 0,
+                 'flag_seek_pos2_slow_counter_top': 0,
+                 'flag_seek_pos2_fast_counter_top': 0}
+
+# (enable flag, counter register, top flag, name of the maxvalue in ControllerConfig) of the five seek counters
+seek_counters = (('flag_seek_home_slow_enable', 'reg_home_seeking_slow_counter', 'flag_seek_home_slow_counter_top',
+                  'c_home_seeking_slow_counter_maxvalue'),
+                 ('flag_seek_pos1_slow_enable', 'reg_pos1_seeking_slow_counter', 'flag_seek_pos1_slow_counter_top',
+                  'c_pos1_seeking_slow_counter_maxvalue'),
+                 ('flag_seek_pos1_fast_enable', 'reg_pos1_seeking_fast_counter', 'flag_seek_pos1_fast_counter_top',
+                  'c_pos1_seeking_fast_counter_maxvalue'),
+                 ('flag_seek_pos2_slow_enable', 'reg_pos2_seeking_slow_counter', 'flag_seek_pos2_slow_counter_top',
+                  'c_pos2_seeking_slow_counter_maxvalue'),
+                 ('flag_seek_pos2_fast_enable', 'reg_pos2_seeking_fast_counter', 'flag_seek_pos2_fast_counter_top',
+                  'c_pos2_seeking_fast_counter_maxvalue'))
+# the seeking state in which a seek counter counts, in every other state it is held at 0
+seek_counter_state = {'reg_home_seeking_slow_counter': m_state.seek_home,
+                      'reg_pos1_seeking_slow_counter': m_state.pos1_seeking_slow,
+                      'reg_pos1_seeking_fast_counter': m_state.pos1_seeking_fast,
+                      'reg_pos2_seeking_slow_counter': m_state.pos2_seeking_slow,
+                      'reg_pos2_seeking_fast_counter': m_state.pos2_seeking_fast}
+
+# the stimulus of tb.py
+tb_events = scenario_tb['events']
+tb_cycles = scenario_tb['cycles']
+
+
+def traffic_events(duration, interval):
+    # homing followed by a switch between pos1 and pos2 every interval ns, the magnet reaches the next hall sensor
+    # 2 us after the command
+    events = [(400, 'hall1_not', 0)]
+    position = c_position_pos1
+    for t in range(interval, duration, interval):
+        position = not position
+        drive, old_hall, new_hall = (('drive2pos2_PIO', 'hall1_not', 'hall2_not') if position == c_position_pos2
+                                     else ('drive2pos1_PIO', 'hall2_not', 'hall1_not'))
+        events += [(t, drive, 1), (t + 1000, drive, 0), (t + 500, old_hall, 1), (t + 2000, new_hall, 0)]
+    return events
+
+
+def check_config(config):
+    # ValueError for the parts of mirror_box_controller the models do not cover
+    if config.c_step_generator_ramp or config.c_learn_travel or config.c_timeout_timer or config.c_preempt_seek:
+        raise ValueError('the model covers the fixed speed prescalers, seek counters and fast phases only, not '
+                         'step_generator_ramp, travel_memory, timeout_timer or c_preempt_seek')
+
+
+def seek_counter_maxvalues(config):
+    # {counter register: maxvalue} of config
+    return dict((reg, getattr(config, maxvalue_name)) for enable, reg, top, maxvalue_name in seek_counters)
+
+
+def step_generator_periods(config):
+    # clock edges between two toggles of step_clock_slow and of step_clock_fast, see shared_generators
+    return (config.c_prescaler_slow - 2) / 2 + 2, (config.c_prescaler_fast - 2) / 2 + 2
+
+
+def edge_time(edge):
+    # time of the given rising clock edge, the first one is at half a clock period
+    return c_clock_period / 2 + edge * c_clock_period
+
+
+def fsm_next(r, i):
+    # the writes of the fsm generator for registers r and inputs i
+    n = {}
+    state = r['state']
+    hall1 = not i['hall1_not']
+    hall2 = not i['hall2_not']
+    if state == m_state.init:
+        n['state'] = m_state.seek_home
+        n['flag_stepper_direction'] = c_direction_pos1
+        n['flag_stepper_speed'] = c_speed_slow
+        n['flag_stepper_enable'] = 0
+
+    elif state == m_state.seek_home:
+        n['flag_seek_home_slow_enable'] = 1
+        n['flag_stepper_enable'] = 1
+        if r['flag_seek_home_slow_counter_top'] == c_reached:
+            n['state'] = m_state.seek_home_timeout
+        elif hall1 == c_reached and hall2 == c_not_reached:
+            n['state'] = m_state.pos1_resting
+        else:
+            n['state'] = m_state.seek_home
+
+    elif state == m_state.seek_home_timeout:
+        n['flag_seek_home_slow_enable'] = 0
+        n['flag_stepper_enable'] = 0
+        n['state'] = m_state.init if i['state_reset'] else m_state.seek_home_timeout
+
+    elif state == m_state.pos1_resting:
+        n['flag_seek_home_slow_enable'] = 0
+        n['flag_seek_pos1_slow_enable'] = 0
+        n['flag_stepper_enable'] = 0
+        if r['target_position'] == c_position_pos2:
+            n['state'] = m_state.pos2_seeking_fast
+            n['flag_stepper_direction'] = c_direction_pos2
+            n['flag_stepper_speed'] = c_speed_fast
+        elif hall1 == c_reached:
+            n['state'] = m_state.pos1_resting
+        else:
+            n['state'] = m_state.pos1_resting_error
+
+    elif state == m_state.pos2_resting:
+        n['flag_seek_pos2_slow_enable'] = 0
+        n['flag_stepper_enable'] = 0
+        if r['target_position'] == c_position_pos1:
+            n['state'] = m_state.pos1_seeking_fast
+            n['flag_stepper_direction'] = c_direction_pos1
+            n['flag_stepper_speed'] = c_speed_fast
+        elif hall2 == c_reached:
+            n['state'] = m_state.pos2_resting
+        else:
+            n['state'] = m_state.pos2_resting_error
+
+    elif state == m_state.pos1_resting_error:
+        n['flag_stepper_enable'] = 0
+        n['state'] = m_state.init if i['state_reset'] else m_state.pos1_resting_error
+
+    elif state == m_state.pos2_resting_error:
+        n['flag_stepper_enable'] = 0
+        n['state'] = m_state.init if i['state_reset'] else m_state.pos2_resting_error
+
+    elif state == m_state.pos1_seeking_slow:
+        n['flag_seek_pos1_fast_enable'] = 0
+        n['flag_seek_pos1_slow_enable'] = 1
+        n['flag_stepper_direction'] = c_direction_pos1
+        n['flag_stepper_speed'] = c_speed_slow
+        n['flag_stepper_enable'] = 1
+        if hall1 == c_reached:
+            n['state'] = m_state.pos1_resting
+        elif r['flag_seek_pos1_slow_counter_top'] == c_reached:
+            n['state'] = m_state.pos1_seeking_timeout
+        else:
+            n['state'] = m_state.pos1_seeking_slow
+
+    elif state == m_state.pos2_seeking_slow:
+        n['flag_stepper_enable'] = 1
+        n['flag_stepper_direction'] = c_direction_pos2
+        n['flag_stepper_speed'] = c_speed_slow
+        n['flag_seek_pos2_fast_enable'] = 0
+        n['flag_seek_pos2_slow_enable'] = 1
+        if hall2 == c_reached:
+            n['state'] = m_state.pos2_resting
+        elif r['flag_seek_pos2_slow_counter_top'] == 1:
+            n['state'] = m_state.pos2_seeking_timeout
+        else:
+            n['state'] = m_state.pos2_seeking_slow
+
+    elif state == m_state.pos1_seeking_fast:
+        n['flag_stepper_enable'] = 1
+        n['flag_stepper_direction'] = c_direction_pos1
+        n['flag_stepper_speed'] = c_speed_fast
+        n['flag_seek_pos1_fast_enable'] = 1
+        if r['flag_seek_pos1_fast_counter_top'] == 1:
+            n['state'] = m_state.pos1_seeking_slow
+            n['flag_stepper_enable'] = 0
+            n['flag_stepper_speed'] = c_speed_slow
+        else:
+            n['state'] = m_state.pos1_seeking_fast
+
+    elif state == m_state.pos2_seeking_fast:
+        n['flag_stepper_enable'] = 1
+        n['flag_seek_pos2_fast_enable'] = 1
+        n['flag_seek_pos2_slow_enable'] = 0
+        if r['flag_seek_pos2_fast_counter_top'] == 1:
+            n['state'] = m_state.pos2_seeking_slow
+            n['flag_stepper_enable'] = 0
+            n['flag_stepper_speed'] = c_speed_slow
+            n['flag_stepper_direction'] = c_direction_pos2
+        else:
+            n['state'] = m_state.pos2_seeking_fast
+
+    elif state == m_state.pos1_seeking_timeout:
+        n['flag_stepper_enable'] = 0
+        n['state'] = m_state.init if i['state_reset'] else m_state.pos1_seeking_timeout
+
+    elif state == m_state.pos2_seeking_timeout:
+        n['flag_stepper_enable'] = 0
+        n['state'] = m_state.init if i['state_reset'] else m_state.pos2_seeking_timeout
+
+    else:
+        n['state'] = m_state.init
+    return n
+
+
+def counters_next(r, i, maxvalues):
+    # the writes of the seek counters and of update_target_position for registers r and inputs i, maxvalues see
+    # seek_counter_maxvalues
+    n = {}
+    for enable, reg, top, maxvalue_name in seek_counters:
+        maxvalue = maxvalues[reg]
+        if r['state'] != seek_counter_state[reg]:
+            n[top] = 0
+            n[reg] = 0
+        elif r[enable]:
+            if r[reg] > maxvalue:
+                n[top] = 1
+            else:
+                n[top] = 0
+                n[reg] = r[reg] + 1
+    if r['state'] == m_state.init:
+        n['target_position'] = c_position_pos1
+    elif i['drive2pos1_manual'] or i['drive2pos1_PIO']:
+        n['target_position'] = c_position_pos1
+    elif i['drive2pos2_manual'] or i['drive2pos2_PIO']:
+        n['target_position'] = c_position_pos2
+    return n
+
+
+def counting(r, enable, reg):
+    # True when the seek counter reg counts at the next clock edge, up to its maxvalue + 1
+    return r[enable] and r['state'] == seek_counter_state[reg]
+
+
+class MirrorBoxModel(object):
+
+    def __init__(self, events=(), config=None):
+        # config: ControllerConfig of the modelled controller, default: the module level constants
+        self.config = config or ControllerConfig()
+        check_config(self.config)
+        self.maxvalues = seek_counter_maxvalues(self.config)
+        self.slow_period, self.fast_period = step_generator_periods(self.config)
+        self.regs = dict(register_init)
+        self.inputs = dict(input_init)
+        self.events = sorted(events, key=lambda e: e[0])   # stable, so the last event at a time wins as in MyHDL
+        self.next_event = 0
+        self.edge = 0                # index of the next clock edge
+        self.prescaler_origin = -1   # last clock edge that left the prescalers at 0
+        self.trace = [(0,) + self.outputs(-1)]
+        self.evaluated_edges = 0     # clock edges that were actually computed, the rest was skipped
+
+    def step_clocks(self, edge):
+        # values of step_clock_slow and step_clock_fast after the given clock edge
+        edges = edge - self.prescaler_origin
+        return (edges / self.slow_period) & 1, (edges / self.fast_period) & 1
+
+    def outputs(self, edge):
+        r = self.regs
+        steps = 0
+        if r['flag_stepper_enable']:
+            step_clock_slow, step_clock_fast = self.step_clocks(edge)
+            steps = step_clock_fast if r['flag_stepper_speed'] == c_speed_fast else step_clock_slow
+        return r['state'], int(r['flag_stepper_direction']), int(steps)
+
+    def apply_events(self, t):
+        # apply all events the sequential blocks see at a clock edge at time t
+        events = self.events
+        while self.next_event < len(events) and events[self.next_event][0] < t:
+            self.set_input(*events[self.next_event])
+            self.next_event += 1
+        k = self.next_event
+        while k < len(events) and events[k][0] == t:
+            if events[k][1] not in delayed_inputs:
+                self.set_input(*events[k])
+            k += 1
+
+    def set_input(self, t, name, value):
+        if name == 'reset' and not value:
+            # asynchronous reset, takes effect right away
+            self.regs.update(register_init)
+            self.prescaler_origin = self.edge - 1
+            self.record(t, self.outputs(self.edge - 1))
+        self.inputs[name] = int(value)
+
+    def record(self, t, out):
+        trace = self.trace
+        if trace[-1][0] == t:
+            trace.pop()
+        if not trace or trace[-1][1:] != out:
+            trace.append((t,) + out)
+
+    def evaluate_edge(self):
+        # computes one clock edge, returns True when the edge only incremented counters
+        edge = self.edge
+        self.evaluated_edges += 1
+        self.apply_events(edge_time(edge))
+        r = self.regs
+        if not self.inputs['reset']:
+            self.prescaler_origin = edge
+            self.edge += 1
+            return False
+
+        # fsm and the counter blocks drive disjoint registers
+        n = dict(r)
+        n.update(fsm_next(r, self.inputs))
+        n.update(counters_next(r, self.inputs, self.maxvalues))
+        linear = True
+        for name, value in n.iteritems():
+            if value != r[name] and not (name in self.maxvalues and value == r[name] + 1):
+                linear = False
+        self.regs = n
+        self.edge += 1
+        return linear
+
+    def skip_limit(self, n_cycles):
+        # number of clock edges after the last evaluated one that would only increment the counters again
+        edge = self.edge - 1
+        r = self.regs
+        limit = n_cycles - self.edge
+        for enable, reg, top, maxvalue_name in seek_counters:
+            maxvalue = self.maxvalues[reg]
+            if counting(r, enable, reg):
+                if r[reg] <= maxvalue:
+                    limit = min(limit, maxvalue + 1 - r[reg])
+                elif not r[top]:
+                    limit = 0
+        if r['flag_stepper_enable']:
+            if r['flag_stepper_speed'] == c_speed_fast:
+                period = self.fast_period
+            else:
+                period = self.slow_period
+            limit = min(limit, period - 1 - (edge - self.prescaler_origin) % period)
+        if self.next_event < len(self.events):
+            t = self.events[self.next_event][0]
+            first_edge = max(self.edge, -(-(t - c_clock_period / 2) / c_clock_period))
+            limit = min(limit, first_edge - self.edge)
+        return max(limit, 0)
+
+    def run(self, n_cycles):
+        # simulate up to the clock edge n_cycles - 1 and return the trace
+        while self.edge < n_cycles:
+            linear = self.evaluate_edge()
+            edge = self.edge - 1
+            self.record(edge_time(edge), self.outputs(edge))
+            if linear:
+                skip = self.skip_limit(n_cycles)
+                if skip:
+                    for enable, reg, top, maxvalue_name in seek_counters:
+                        if counting(self.regs, enable, reg) and self.regs[reg] <= self.maxvalues[reg]:
+                            self.regs[reg] += skip
+                    self.edge += skip
+        # a reset after the last clock edge still shows up in the trace
+        events = self.events
+        while self.next_event < len(events) and events[self.next_event][0] < n_cycles * c_clock_period:
+            self.set_input(*events[self.next_event])
+            self.next_event += 1
+        return self.trace
+
+    def snapshot(self):
+        # state after run(), the registers, inputs, prescalers and trace with states by name, so that it pickles and
+        # can be handed to worker processes, see checkpoint.py
+        regs = dict(self.regs)
+        regs['state'] = str(regs['state'])
+        return {'edge': self.edge,
+                'regs': regs,
+                'inputs': dict(self.inputs),
+                'prescaler_origin': self.prescaler_origin,
+                'trace': [(t, str(state), direction, steps) for t, state, direction, steps in self.trace]}
+
+    @classmethod
+    def from_snapshot(cls, snapshot, events=(), config=None):
+        # continues a snapshot with events, events before the next clock edge of the snapshot have to be left out,
+        # config has to be the one the snapshot was taken with
+        model = cls(events, config)
+        model.regs = dict(snapshot['regs'], state=getattr(m_state, snapshot['regs']['state']))
+        model.inputs = dict(snapshot['inputs'])
+        model.edge = snapshot['edge']
+        model.prescaler_origin = snapshot['prescaler_origin']
+        model.trace = [(t, getattr(m_state, state), direction, steps)
+                       for t, state, direction, steps in snapshot['trace']]
+        return model
+
+
+def simulate(events, n_cycles, config=None):
+    return MirrorBoxModel(events, config).run(n_cycles)
+
+
+def myhdl_trace(events, n_cycles, config=None):
+    # runs the MyHDL mirror_box_controller on the same stimulus and records the trace in the same format, config is
+    # the ControllerConfig of the controller
+    clk = Signal(bool(0))
+    reset = ResetSignal(input_init['reset'], active=0, async=True)
+    state = Signal(m_state.init)
+    stepper_direction = Signal(bool(c_direction_pos1))
+    stepper_steps = Signal(bool(0))
+    inputs = {'reset': reset}
+    for name in model_inputs[1:]:
+        inputs[name] = Signal(bool(input_init[name]))
+    trace = []
+
+    def testbench():
+        dut = mirror_box_controller(clk, reset, inputs['state_reset'], state, inputs['hall1_not'],
+                                    inputs['hall2_not'], inputs['drive2pos1_manual'], inputs['drive2pos2_manual'],
+                                    inputs['drive2pos1_PIO'], inputs['drive2pos2_PIO'], inputs['lock_manual_input'],
+                                    stepper_direction, stepper_steps, config)
+
+        @always(delay(c_clock_period / 2))
+        def clkgen():
+            clk.next = not clk
+
+        @instance
+        def stimulus():
+            t = 0
+            for event_time, name, value in sorted(events, key=lambda e: e[0]):
+                if event_time > t:
+                    yield delay(event_time - t)
+                    t = event_time
+                inputs[name].next = bool(value)
+
+        @instance
+        def recorder():
+            trace.append((0, state.val, int(stepper_direction.val), int(stepper_steps.val)))
+            while True:
+                yield state, stepper_direction, stepper_steps
+                # several delta cycles at the same time only leave their final value
+                if trace[-1][0] == now():
+                    trace.pop()
+                out = (state.val, int(stepper_direction.val), int(stepper_steps.val))
+                if not trace or trace[-1][1:] != out:
+                    trace.append((now(),) + out)
+
+        return dut, clkgen, stimulus, recorder
+
+    sim = Simulation(testbench())
+    sim.run(n_cycles * c_clock_period, quiet=1)
+    return trace
+
+
+def check_equivalence(events=tb_events, n_cycles=tb_cycles, config=None):
+    # compares the model with the MyHDL simulation, returns None or a description of the first difference
+    expected = myhdl_trace(events, n_cycles, config)
+    actual = simulate(events, n_cycles, config)
+    for e, a in zip(expected, actual):
+        if e != a:
+            return 'MyHDL: %s %s %d %d, model: %s %s %d %d' % (e + a)
+    if len(expected) != len(actual):
+        return 'MyHDL trace has %d entries, model trace has %d' % (len(expected), len(actual))
+    return None
+
+
+if __name__ == '__main__':
+    start = wall_time()
+    myhdl_trace(tb_events, tb_cycles)
+    myhdl_time = wall_time() - start
+    start = wall_time()
+    model = MirrorBoxModel(tb_events)
+    model.run(tb_cycles)
+    model_time = wall_time() - start
+    difference = check_equivalence()
+    if difference:
+        print 'model differs from the MyHDL simulation:', difference
+    else:
+        print 'model is equivalent to the MyHDL simulation for the tb.py stimulus'
+    # a configuration with other prescalers and seek counters, on traffic that steps through long fast phases
+    other_config = ControllerConfig(c_microsteps_per_seconds_fast=20000, c_microsteps_per_seconds_slow=2000,
+                                    c_pos1_seeking_fast_counter_maxvalue=3000,
+                                    c_pos2_seeking_fast_counter_maxvalue=3000,
+                                    c_pos1_seeking_slow_counter_maxvalue=20000,
+                                    c_pos2_seeking_slow_counter_maxvalue=20000)
+    other_difference = check_equivalence(traffic_events(tb_cycles * c_clock_period, 10000), tb_cycles, other_config)
+    print 'model %s the MyHDL simulation for traffic with 20000/2000 microsteps per second and longer seeks' % (
+        'differs from' if other_difference else 'is equivalent to')
+    assert difference is None and other_difference is None, difference or other_difference
+    print 'MyHDL: %d cycles in %.3f s, model: %d cycles in %.4f s (%d evaluated), speedup %.0f' % (
+        tb_cycles, myhdl_time, tb_cycles, model_time, model.evaluated_edges, myhdl_time / model_time)
+
+    # one hour of traffic with a switch every second, every seek has to end in the resting state of its target
+    hour = 3600 * 1000000000
+    start = wall_time()
+    model = MirrorBoxModel(traffic_events(hour, 1000000000))
+    trace = model.run(hour / c_clock_period)
+    elapsed = wall_time() - start
+    states = [str(state) for t, state, direction, steps in trace]
+    switches = hour / 1000000000 - 1
+    # the first arrival in pos1_resting is the end of homing
+    seeks = len([k for k in range(1, len(states)) if states[k] != states[k - 1] and states[k].endswith('_resting')]) - 1
+    failures = set(state for state in states if state.endswith(('_timeout', '_error')))
+    assert not failures, 'traffic reached %s' % ', '.join(sorted(failures))
+    assert seeks == switches, '%d of %d seeks reached their position' % (seeks, switches)
+    print 'model: 1 h of traffic (%d cycles) in %.2f s, %d evaluated cycles, %d trace entries, %d seeks completed, ' \
+        'final state %s' % (hour / c_clock_period, elapsed, model.evaluated_edges, len(trace), seeks, states[-1])
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import random
+import sys
+from time import time as wall_time
+from main import *
+from fast_model import MirrorBoxModel, c_clock_period
+
+# coverage driven constrained random stimulus for mirror_box_controller
+#
+# Every run draws a random stimulus from its seed and simulates it with the fast_model twin in windows of clock cycles.
+# After every window the state and transition coverage of the run is merged into the overall coverage. A run stops as
+# soon as it did not add anything for patience windows or the overall coverage reaches the target, the next run starts
+# with the next seed. The overall coverage can be loaded from and saved to a json file, so it adds up across
+# invocations.
+#
+#   python fsm_coverage.py [--seed 1] [--runs 50] [--target 1.0] [--coverage coverage.json]
+
+state_names = m_state._names
+n_states = len(state_names)
+
+# coverage bins: all states but undefined and all transitions the fsm can take without an asynchronous reset
+target_states = [name for name in state_names if name != 'undefined']
+target_transitions = [('init', 'seek_home'),
+                      ('seek_home', 'seek_home_timeout'), ('seek_home', 'pos1_resting'),
+                      ('seek_home_timeout', 'init'),
+                      ('pos1_resting', 'pos2_seeking_fast'), ('pos1_resting', 'pos1_resting_error'),
+                      ('pos2_resting', 'pos1_seeking_fast'), ('pos2_resting', 'pos2_resting_error'),
+                      ('pos1_resting_error', 'init'), ('pos2_resting_error', 'init'),
+                      ('pos1_seeking_fast', 'pos1_seeking_slow'), ('pos2_seeking_fast', 'pos2_seeking_slow'),
+                      ('pos1_seeking_slow', 'pos1_resting'), ('pos1_seeking_slow', 'pos1_seeking_timeout'),
+                      ('pos2_seeking_slow', 'pos2_resting'), ('pos2_seeking_slow', 'pos2_seeking_timeout'),
+                      ('pos1_seeking_timeout', 'init'), ('pos2_seeking_timeout', 'init')]
+
+commands = ('drive2pos1_manual', 'drive2pos2_manual', 'drive2pos1_PIO', 'drive2pos2_PIO')
+
+
+class Coverage(object):
+    # bitmaps of the visited states and of the taken transitions. The bit of a state is its index in m_state, the bit
+    # of the transition from state a to state b is a * n_states + b.
+
+    def __init__(self, states=0, transitions=0):
+        self.states = states
+        self.transitions = transitions
+
+    def bit_count(self):
+        return bin(self.states).count('1') + bin(self.transitions).count('1')
+
+    def add_trace(self, trace):
+        # adds the states of a fast_model trace, returns the number of new bits
+        before = self.bit_count()
+        last = None
+        for entry in trace:
+            index = state_names.index(str(entry[1]))
+            self.states |= 1 << index
+            if last is not None and last != index:
+                self.transitions |= 1 << (last * n_states + index)
+            last = index
+        return self.bit_count() - before
+
+    def merge(self, other):
+        # adds the bits of other, returns the number of new bits
+        before = self.bit_count()
+        self.states |= other.states
+        self.transitions |= other.transitions
+        return self.bit_count() - before
+
+    def has_state(self, name):
+        return bool(self.states >> state_names.index(name) & 1)
+
+    def has_transition(self, a, b):
+        return bool(self.transitions >> (state_names.index(a) * n_states + state_names.index(b)) & 1)
+
+    def missing(self):
+        # target states and transitions that are not covered yet
+        return ([name for name in target_states if not self.has_state(name)],
+                [(a, b) for a, b in target_transitions if not self.has_transition(a, b)])
+
+    def ratio(self):
+        # covered part of the target bins
+        missing_states, missing_transitions = self.missing()
+        total = len(target_states) + len(target_transitions)
+        return 1.0 - float(len(missing_states) + len(missing_transitions)) / total
+
+    def as_dict(self):
+        return {'states': '%x' % self.states, 'transitions': '%x' % self.transitions}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(int(d['states'], 16), int(d['transitions'], 16))
+
+
+class StimulusGenerator(object):
+    # constrained random events for hall1_not, hall2_not, the drive2pos* commands and state_reset
+    #
+    # The magnet moves between pos1, the space between the sensors and pos2, so the two hall sensors are never active
+    # at the same time. Commands and state_reset are pulses. Actions do not overlap and follow each other after
+    # random pauses on a 10 ns grid, short enough to hit the 10 cycle seek counters of the default configuration.
+
+    positions = ('pos1', 'between', 'pos2')
+    actions = (('move', 6), ('command', 3), ('state_reset', 1))
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.t = 0
+        self.position = 'between'    # hall1_not and hall2_not start inactive
+
+    def choose_action(self):
+        k = self.rng.randrange(sum(weight for action, weight in self.actions))
+        for action, weight in self.actions:
+            if k < weight:
+                return action
+            k -= weight
+
+    def pulse(self, name):
+        width = self.rng.randrange(5, 30) * 10
+        events = [(self.t, name, 1), (self.t + width, name, 0)]
+        self.t += width
+        return events
+
+    def move(self):
+        index = self.positions.index(self.position)
+        if index == 1:
+            index = self.rng.choice((0, 2))
+        else:
+            index = 1
+        events = []
+        if self.position != 'between':
+            events.append((self.t, 'hall1_not' if self.position == 'pos1' else 'hall2_not', 1))
+        self.position = self.positions[index]
+        if self.position != 'between':
+            events.append((self.t, 'hall1_not' if self.position == 'pos1' else 'hall2_not', 0))
+        return events
+
+    def events_until(self, end_time):
+        # the events of the actions that start before end_time, in time order
+        events = []
+        while True:
+            pause = self.rng.randrange(5, 250) * 10
+            if self.t + pause >= end_time:
+                break
+            self.t += pause
+            action = self.choose_action()
+            if action == 'move':
+                events += self.move()
+            elif action == 'command':
+                events += self.pulse(self.rng.choice(commands))
+            else:
+                events += self.pulse('state_reset')
+        return events
+
+
+def run_seed(seed, coverage, window=500, patience=10, target=1.0, max_cycles=1000000):
+    # one run, merges into coverage, window and max_cycles in clock cycles
+    stimulus = StimulusGenerator(seed)
+    model = MirrorBoxModel()
+    seed_coverage = Coverage()
+    new_bits = 0
+    idle = 0
+    cycles = 0
+    processed = 0
+    while cycles < max_cycles and coverage.ratio() < target and idle < patience:
+        cycles += window
+        model.events.extend(stimulus.events_until(cycles * c_clock_period))
+        trace = model.run(cycles)
+        # the last entry of the previous window is taken again for the transition into this window
+        seed_coverage.add_trace(trace[max(processed - 1, 0):])
+        processed = len(trace)
+        new = coverage.merge(seed_coverage)
+        new_bits += new
+        idle = 0 if new else idle + 1
+    return {'seed': seed, 'cycles': cycles, 'new_bits': new_bits, 'ratio': coverage.ratio()}
+
+
+def run_coverage(seed, runs, coverage=None, **kwargs):
+    # runs seed, seed + 1, ... until runs are done or the target is reached, returns (coverage, [run result, ...])
+    coverage = coverage or Coverage()
+    results = []
+    for k in range(runs):
+        if coverage.ratio() >= kwargs.get('target', 1.0):
+            break
+        results.append(run_seed(seed + k, coverage, **kwargs))
+    return coverage, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='coverage driven constrained random stimulus for the controller fsm')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the first run, the runs use consecutive seeds')
+    parser.add_argument('--runs', type=int, default=50, help='maximum number of runs')
+    parser.add_argument('--window', type=int, default=500, help='clock cycles between two coverage checks')
+    parser.add_argument('--patience', type=int, default=10, help='windows without new coverage that end a run')
+    parser.add_argument('--max-cycles', type=int, default=1000000, help='clock cycles after which a run ends anyway')
+    parser.add_argument('--target', type=float, default=1.0, help='part of the coverage bins that ends all runs')
+    parser.add_argument('--coverage', help='json file with the coverage of earlier runs, updated at the end')
+    args = parser.parse_args()
+
+    coverage = Coverage()
+    if args.coverage and os.path.exists(args.coverage):
+        with open(args.coverage) as f:
+            coverage = Coverage.from_dict(json.load(f))
+    start = wall_time()
+    coverage, results = run_coverage(args.seed, args.runs, coverage, window=args.window, patience=args.patience,
+                                     target=args.target, max_cycles=args.max_cycles)
+    elapsed = wall_time() - start
+    for result in results:
+        print 'seed %6d  %8d cycles  %3d new bins  coverage %5.1f%%' % (
+            result['seed'], result['cycles'], result['new_bits'], 100 * result['ratio'])
+    missing_states, missing_transitions = coverage.missing()
+    print '%d runs, %d cycles in %.2f s, coverage %.1f%% of %d states and %d transitions' % (
+        len(results), sum(result['cycles'] for result in results), elapsed, 100 * coverage.ratio(),
+        len(target_states), len(target_transitions))
+    for name in missing_states:
+        print 'state not covered:', name
+    for a, b in missing_transitions:
+        print 'transition not covered: %s -> %s' % (a, b)
+    if args.coverage:
+        with open(args.coverage, 'w') as f:
+            json.dump(coverage.as_dict(), f, indent=2)
+    sys.exit(0 if coverage.ratio() >= args.target else 1)
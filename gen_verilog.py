@@ -1,33 +1,199 @@
+import argparse
+import ast
+import inspect
+import os
+import sys
+from myhdl._always_comb import _AlwaysComb
+from myhdl._always_seq import _AlwaysSeq, _SigNameVisitor
+from myhdl._util import _dedent
 from main import *
 
-clk = Signal(bool(0))
-reset = ResetSignal(1, active=0, async=True)
-state_reset = Signal(bool(0))
-state = Signal(m_state.init)
-hall1_not = Signal(bool(1))
-hall2_not = Signal(bool(1))
-drive2pos1_manual = Signal(bool(0))
-drive2pos2_manual = Signal(bool(0))
-drive2pos1_PIO = Signal(bool(0))
-drive2pos2_PIO = Signal(bool(0))
-lock_manual_input = Signal(bool(0))
-stepper_direction = Signal(bool(c_direction_pos1))
-stepper_steps = Signal(bool(0))
-
-controller_inst = toVerilog(mirror_box_controller, clk, reset, state_reset, state, hall1_not, hall2_not, drive2pos1_manual,
-                            drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO, lock_manual_input, stepper_direction,
-                            stepper_steps)
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+def registers(instances, found=None):
+    # {name: signal} of all signals driven by the always_seq blocks of an instance tree, named as in the blocks
+    found = {} if found is None else found
+    if isinstance(instances, (tuple, list)):
+        for inst in instances:
+            registers(inst, found)
+    elif isinstance(instances, _AlwaysSeq):
+        names = dict((id(sig), name) for name, sig in instances.symdict.items() if isinstance(sig, SignalType))
+        for name, sigs in instances.symdict.items():
+            if isinstance(sigs, list):
+                names.update((id(sig), '%s[%d]' % (name, i)) for i, sig in enumerate(sigs)
+                             if isinstance(sig, SignalType))
+        for sig in instances.sigregs:
+            found.setdefault(names.get(id(sig), '?'), sig)
+    return found
+
+
+def signals_read(instances, found=None):
+    # ids of all signals read by the always_seq and always_comb blocks of an instance tree
+    found = set() if found is None else found
+    if isinstance(instances, (tuple, list)):
+        for inst in instances:
+            signals_read(inst, found)
+    elif isinstance(instances, _AlwaysComb):
+        found.update(id(sig) for sig in instances.senslist)
+    elif isinstance(instances, _AlwaysSeq):
+        visitor = _SigNameVisitor(instances.symdict)
+        visitor.visit(ast.parse(_dedent(inspect.getsource(instances.func))))
+        for name in visitor.inputs:
+            sigs = instances.symdict[name]
+            found.update(id(sig) for sig in (sigs if isinstance(sigs, list) else [sigs]))
+    return found
+
+
+def resource_summary(instances, ports=()):
+    # {register name: flip-flops}. Registers that are neither read by any block nor a port are left out, synthesis
+    # removes them.
+    read = signals_read(instances) | set(id(sig) for sig in ports)
+    return dict((name, len(sig)) for name, sig in registers(instances).items() if id(sig) in read)
+
+
+def print_resource_summary(summary):
+    # flip-flops per register and in total, the widest register is a rough measure of the longest carry chain
+    width = max(len(name) for name in summary)
+    print '%-*s  %4s' % (width, 'register', 'ffs')
+    for name, bits in sorted(summary.items()):
+        print '%-*s  %4d' % (width, name, bits)
+    print '%-*s  %4d' % (width, 'total', sum(summary.values()))
+    widest = max(summary, key=summary.get)
+    print 'widest register: %s, %d bits' % (widest, summary[widest])
+
+
+def controller_ports():
+    # signals for the ports of mirror_box_controller, in the order of its arguments
+    return (Signal(bool(0)),                        # clk
+            ResetSignal(1, active=0, async=True),   # reset
+            Signal(bool(0)),                        # state_reset
+            Signal(m_state.init),                   # state
+            Signal(bool(1)),                        # hall1_not
+            Signal(bool(1)),                        # hall2_not
+            Signal(bool(0)),                        # drive2pos1_manual
+            Signal(bool(0)),                        # drive2pos2_manual
+            Signal(bool(0)),                        # drive2pos1_PIO
+            Signal(bool(0)),                        # drive2pos2_PIO
+            Signal(bool(0)),                        # lock_manual_input
+            Signal(bool(c_direction_pos1)),         # stepper_direction
+            Signal(bool(0)))                        # stepper_steps
+
+
+def telemetry_ports(config):
+    # signals for telemetry_select and telemetry_data of mirror_box_controller, none without c_telemetry
+    if not config.c_telemetry:
+        return ()
+    return Signal(intbv(0)[telemetry_select_width:]), Signal(intbv(0)[config.c_telemetry_width:])
+
+
+def controller_resources(config):
+    # resource_summary of mirror_box_controller elaborated with config
+    ports = controller_ports()
+    telemetry = telemetry_ports(config)
+    outputs = (ports[3], ports[11], ports[12]) + telemetry[1:]   # state, stepper_direction, stepper_steps, data
+    return resource_summary(mirror_box_controller(*(ports + (config,) + telemetry)), outputs)
+
+
+# seek counter maxvalue and timeout_timer time in ms of the same seeking state, see timeout_configs
+timeout_pairs = (('c_home_seeking_slow_counter_maxvalue', 'c_home_seeking_timeout_ms'),
+                 ('c_pos1_seeking_fast_counter_maxvalue', 'c_pos1_seeking_fast_ms'),
+                 ('c_pos1_seeking_slow_counter_maxvalue', 'c_pos1_seeking_timeout_ms'),
+                 ('c_pos2_seeking_fast_counter_maxvalue', 'c_pos2_seeking_fast_ms'),
+                 ('c_pos2_seeking_slow_counter_maxvalue', 'c_pos2_seeking_timeout_ms'))
+
+
+def timeout_configs(config):
+    # (config with the five seek counters sized for the timeout_timer times of config, config with timeout_timer), the
+    # two designs of the resource comparison of --compare-timeouts
+    counters = config.as_dict()
+    counters['c_timeout_timer'] = False
+    for counter_name, ms_name in timeout_pairs:
+        counters[counter_name] = int(round(getattr(config, ms_name) * config.c_clock_freq / 1000.0))
+    timer = config.as_dict()
+    timer['c_timeout_timer'] = True
+    return ControllerConfig(**counters), ControllerConfig(**timer)
+
+
+def compare_timeouts(config):
+    # prints the resource_summary of both designs of timeout_configs, returns True if timeout_timer needs fewer
+    # flip-flops than the seek counters
+    totals = []
+    for title, design in zip(('seek counters', 'timebase and timeout_timer'), timeout_configs(config)):
+        print '%s for %.0f ms homing, %.0f ms fast, %.0f ms timeout:' % (
+            title, config.c_home_seeking_timeout_ms, config.c_pos1_seeking_fast_ms, config.c_pos1_seeking_timeout_ms)
+        summary = controller_resources(design)
+        print_resource_summary(summary)
+        print
+        totals.append(sum(summary.values()))
+    print 'flip-flops: %d with seek counters, %d with timeout_timer' % tuple(totals)
+    return totals[1] < totals[0]
+
+
+def to_verilog(func, *args):
+    # toVerilog(func, *args). A failed conversion leaves an empty or partial <name>.v behind, that is removed before the
+    # error is raised again.
+    name = str(toVerilog.name or func.__name__)
+    directory = toVerilog.directory or ''
+    try:
+        return toVerilog(func, *args)
+    except Exception:
+        for filename in (name + '.v', 'tb_' + name + '.v'):
+            if os.path.exists(os.path.join(directory, filename)):
+                os.remove(os.path.join(directory, filename))
+        toVerilog.name = None
+        raise
+
+
+def multi_axis_ports(n_axes):
+    # signals for the ports of multi_axis_controller with n_axes axes, in the order of its arguments
+    return (Signal(bool(0)),                                            # clk
+            ResetSignal(1, active=0, async=True),                       # reset
+            Signal(intbv(0)[n_axes:]),                                  # state_reset
+            Signal(intbv(2 ** n_axes - 1)[n_axes:]),                    # hall1_not
+            Signal(intbv(2 ** n_axes - 1)[n_axes:]),                    # hall2_not
+            Signal(intbv(0)[n_axes:]),                                  # drive2pos1_manual
+            Signal(intbv(0)[n_axes:]),                                  # drive2pos2_manual
+            Signal(intbv(0)[n_axes:]),                                  # drive2pos1_PIO
+            Signal(intbv(0)[n_axes:]),                                  # drive2pos2_PIO
+            Signal(intbv(0)[n_axes:]),                                  # lock_manual_input
+            Signal(intbv(c_direction_pos1 * (2 ** n_axes - 1))[n_axes:]),  # stepper_direction
+            Signal(intbv(0)[n_axes:]))                                  # stepper_steps
+
+
+def multi_axis_resources(config, n_axes):
+    # (resource_summary of the shared generators, [resource_summary of every axis]) of multi_axis_controller. The
+    # registers of an axis have the same names in every axis, so they are summed up per axis.
+    ports = multi_axis_ports(n_axes)
+    shared, axes, outputs = multi_axis_controller(*(ports + (config,)))
+    read = signals_read((shared, axes, outputs))
+    summaries = []
+    for instances in [shared] + axes:
+        summaries.append(dict((name, len(sig)) for name, sig in registers(instances).items() if id(sig) in read))
+    return summaries[0], summaries[1:]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='converts mirror_box_controller and step_generator_ramp to Verilog')
+    parser.add_argument('--compare-timeouts', action='store_true',
+                        help='compare the flip-flops of the seek counters and of timeout_timer for the same times '
+                             'instead, fails if timeout_timer does not need fewer')
+    args = parser.parse_args()
+    config = ControllerConfig()
+    if args.compare_timeouts:
+        sys.exit(0 if compare_timeouts(config) else 1)
+
+    clk, reset, state_reset, state, hall1_not, hall2_not, drive2pos1_manual, drive2pos2_manual, drive2pos1_PIO,\
+        drive2pos2_PIO, lock_manual_input, stepper_direction, stepper_steps = controller_ports()
+    stepper_enable = Signal(bool(0))
+    stepper_speed = Signal(bool(0))
+    step_clock = Signal(bool(0))
+    at_slow = Signal(bool(0))
+    telemetry = telemetry_ports(config)
+
+    ramp_inst = to_verilog(step_generator_ramp, clk, reset, stepper_enable, stepper_speed, step_clock, at_slow, config)
+
+    controller_inst = to_verilog(mirror_box_controller, clk, reset, state_reset, state, hall1_not, hall2_not,
+                                 drive2pos1_manual, drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO,
+                                 lock_manual_input, stepper_direction, stepper_steps, config, *telemetry)
+
+    # the flip-flops of the design that was converted
+    print_resource_summary(resource_summary(controller_inst, (state, stepper_direction, stepper_steps) + telemetry[1:]))
@@ -0,0 +1,140 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+from time import time as wall_time
+import myhdl
+import main
+from main import *
+from gen_verilog import controller_ports, resource_summary, telemetry_ports, to_verilog
+
+# emits the Verilog of mirror_box_controller for many configurations
+#
+# Every variant is converted into its own directory of the cache, named by the variant and a hash of its
+# ControllerConfig, of the sources in conversion_sources and of the MyHDL version.
+# Variants whose directory already holds a result.json are skipped, the others are converted in a process pool.
+# result.json holds the configuration and the flip-flops per register of the converted design. It is only written
+# when the conversion succeeded, so a failed variant is converted again on the next run.
+#
+#   python gen_verilog_batch.py                        the variants below
+#   python gen_verilog_batch.py boxes.json -j 4        variants from a file: [{"name": ..., "config": {...}}, ...]
+#   python gen_verilog_batch.py --force                convert all variants again
+
+variants = [{'name': 'default', 'config': {}},
+            {'name': 'clock_50MHz', 'config': {'c_clock_freq': 50000000}},
+            {'name': 'fast_20k', 'config': {'c_microsteps_per_seconds_fast': 20000}},
+            {'name': 'ramp', 'config': {'c_step_generator_ramp': True}},
+            {'name': 'timeout_timer', 'config': {'c_timeout_timer': True}},
+            {'name': 'preempt', 'config': {'c_preempt_seek': True}},
+            {'name': 'ramp_preempt', 'config': {'c_step_generator_ramp': True, 'c_preempt_seek': True}},
+            {'name': 'timeout_timer_telemetry', 'config': {'c_timeout_timer': True, 'c_telemetry': True}}]
+
+
+# the sources a converted variant depends on: the design and ControllerConfig, to_verilog and resource_summary, and
+# convert below. A change to any of them converts all variants again.
+conversion_sources = ('main.py', 'gen_verilog.py', 'gen_verilog_batch.py')
+
+
+def source_files():
+    directory = os.path.dirname(os.path.abspath(main.__file__))
+    return [os.path.join(directory, filename) for filename in conversion_sources]
+
+
+def source_hash():
+    sha = hashlib.sha1()
+    for filename in source_files():
+        with open(filename, 'rb') as f:
+            sha.update('%s\n%s\n' % (os.path.basename(filename), f.read()))
+    return sha.hexdigest()
+
+
+def variant_key(name, config, source):
+    # name of the cache directory of a variant. The name is part of it, so that two variants with the same
+    # configuration never share a directory while being converted.
+    return '%s-%s' % (name, hashlib.sha1('\n'.join((config.key(), source, myhdl.__version__))).hexdigest())
+
+
+def convert(args):
+    name, values, directory = args
+    config = ControllerConfig(**values)
+    start = wall_time()
+    result = {'name': name, 'config': config.as_dict(), 'resources': {}, 'error': None}
+    ports = controller_ports()
+    telemetry = telemetry_ports(config)
+    try:
+        toVerilog.directory = directory
+        toVerilog.no_testbench = True
+        instances = to_verilog(mirror_box_controller, *(ports + (config,) + telemetry))
+        # state, stepper_direction, stepper_steps, telemetry_data
+        result['resources'] = resource_summary(instances, (ports[3], ports[11], ports[12]) + telemetry[1:])
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, str(e).strip())
+    result['wall_time'] = wall_time() - start
+    if not result['error']:
+        with open(os.path.join(directory, 'result.json'), 'w') as f:
+            json.dump(result, f, indent=2)
+    return directory, result
+
+
+def generate(selected, cache_dir, processes=None, force=False):
+    # [(variant, directory, result, cached), ...] in the order of selected
+    source = source_hash()
+    jobs = []
+    entries = []
+    for variant in selected:
+        directory = os.path.join(cache_dir, variant_key(variant['name'], ControllerConfig(**variant['config']),
+                                                        source))
+        result_file = os.path.join(directory, 'result.json')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(result_file) and not force:
+            with open(result_file) as f:
+                entries.append((variant, directory, json.load(f), True))
+        else:
+            if directory not in [job[2] for job in jobs]:
+                jobs.append((variant['name'], variant['config'], directory))
+            entries.append((variant, directory, None, False))
+    results = {}
+    if jobs:
+        pool = Pool(min(processes or cpu_count(), len(jobs)))
+        try:
+            for directory, result in pool.imap_unordered(convert, jobs):
+                results[directory] = result
+        finally:
+            pool.close()
+            pool.join()
+    return [(variant, directory, result or results[directory], cached)
+            for variant, directory, result, cached in entries]
+
+
+def print_report(entries, elapsed):
+    width = max(len(variant['name']) for variant, directory, result, cached in entries)
+    for variant, directory, result, cached in entries:
+        status = 'FAIL' if result['error'] else 'OK'
+        print '%-*s  %-4s  %-6s  %4d ffs  %s' % (width, variant['name'], status, 'cached' if cached else 'new',
+                                                 sum(result['resources'].values()), directory)
+        if result['error']:
+            print '%*s  %s' % (width, '', result['error'].replace('\n', ' '))
+    print '%d variants, %d converted, %d failed, %.2f s wall time' % (
+        len(entries), len([entry for entry in entries if not entry[3]]),
+        len([entry for entry in entries if entry[2]['error']]), elapsed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verilog of mirror_box_controller for many configurations')
+    parser.add_argument('variants', nargs='?', help='json file with the variants, default: the list in this script')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes, default: all cores')
+    parser.add_argument('--cache-dir', default='verilog_cache', help='directory of the converted variants')
+    parser.add_argument('--force', action='store_true', help='convert also the variants that are in the cache')
+    args = parser.parse_args()
+
+    selected = variants
+    if args.variants:
+        with open(args.variants) as f:
+            selected = json.load(f)
+    start = wall_time()
+    entries = generate(selected, args.cache_dir, args.processes, args.force)
+    print_report(entries, wall_time() - start)
+    sys.exit(0 if not any(result['error'] for variant, directory, result, cached in entries) else 1)
@@ -1,3 +1,4 @@
+import json
 from myhdl import *
 
 # definition of constants / configuration parameters
@@ -19,6 +20,36 @@ c_microsteps_per_seconds_fast = 10000
 c_microsteps_per_seconds_slow = 1000
 c_prescaler_slow = c_clock_freq / c_microsteps_per_seconds_slow
 c_prescaler_fast = c_clock_freq / c_microsteps_per_seconds_fast
+c_step_generator_ramp = False               # True replaces the two fixed speed prescalers by step_generator_ramp
+c_microsteps_per_seconds_cruise = 20000     # top speed of step_generator_ramp while seeking fast
+c_acceleration = 20000000                   # microsteps/s^2, speeding up to the cruise speed
+c_deceleration = 20000000                   # microsteps/s^2, slowing down to c_microsteps_per_seconds_slow
+c_ramp_update_freq = 100000                 # the speed of step_generator_ramp is updated with this frequency
+c_nco_width = 24                            # width of the phase accumulator of step_generator_ramp
+c_learn_travel = False                      # True ends the fast seeking phases by the learned travel distance
+c_travel_margin = 4                         # microsteps in slow speed before reaching a hall sensor
+c_travel_max = 65535                        # microsteps, limit of the position counter of travel_memory
+c_timeout_timer = False                     # True replaces the five seek counters by timebase and timeout_timer
+c_timebase_freq = 10000                     # frequency of the tick of timebase, resolution of the times below
+c_home_seeking_timeout_ms = 5000.0          # times of timeout_timer in ms
+c_pos1_seeking_fast_ms = 50.0
+c_pos1_seeking_timeout_ms = 1000.0
+c_pos2_seeking_fast_ms = 50.0
+c_pos2_seeking_timeout_ms = 1000.0
+c_preempt_seek = False                      # True lets a new target turn a seek around instead of waiting for its end,
+                                            # not together with c_timeout_timer
+c_telemetry = False                         # True adds seek_telemetry and its readout ports to mirror_box_controller
+c_telemetry_width = 24                      # bits of the telemetry words, they count clock cycles and saturate
+
+# constants above that can be set per controller by ControllerConfig
+config_names = ('c_home_seeking_slow_counter_maxvalue', 'c_pos1_seeking_fast_counter_maxvalue',
+                'c_pos1_seeking_slow_counter_maxvalue', 'c_pos2_seeking_fast_counter_maxvalue',
+                'c_pos2_seeking_slow_counter_maxvalue', 'c_clock_freq', 'c_microsteps_per_seconds_fast',
+                'c_microsteps_per_seconds_slow', 'c_step_generator_ramp', 'c_microsteps_per_seconds_cruise',
+                'c_acceleration', 'c_deceleration', 'c_ramp_update_freq', 'c_nco_width', 'c_learn_travel',
+                'c_travel_margin', 'c_travel_max', 'c_timeout_timer', 'c_timebase_freq', 'c_home_seeking_timeout_ms',
+                'c_pos1_seeking_fast_ms', 'c_pos1_seeking_timeout_ms', 'c_pos2_seeking_fast_ms',
+                'c_pos2_seeking_timeout_ms', 'c_preempt_seek', 'c_telemetry', 'c_telemetry_width')
 
 m_state = enum('undefined',
                'init',
@@ -35,8 +66,406 @@ m_state = enum('undefined',
                'pos1_seeking_slow',
                'pos1_seeking_timeout')
 
+# words of seek_telemetry by their address on telemetry_select: durations in clock cycles of the last and the
+# longest fast phase, slow phase and whole seek towards each position, the number of seek timeouts towards each
+# position and the number of seek_home timeouts
+telemetry_names = ('pos1_fast_last', 'pos1_fast_max', 'pos1_slow_last', 'pos1_slow_max', 'pos1_total_last',
+                   'pos1_total_max', 'pos1_timeouts',
+                   'pos2_fast_last', 'pos2_fast_max', 'pos2_slow_last', 'pos2_slow_max', 'pos2_total_last',
+                   'pos2_total_max', 'pos2_timeouts',
+                   'home_timeouts')
+telemetry_select_width = (len(telemetry_names) - 1).bit_length()
 
-def mirror_box_controller(
+
+class ControllerConfig(object):
+    # configuration of one mirror_box_controller, every name of config_names is an attribute. Names that are not
+    # given are taken from the module level constants at the time the configuration is created, e.g.
+    #   ControllerConfig(c_clock_freq=50000000, c_microsteps_per_seconds_fast=20000)
+
+    def __init__(self, **values):
+        unknown = sorted(set(values) - set(config_names))
+        if unknown:
+            raise TypeError('unknown configuration constants: %s' % ', '.join(unknown))
+        for name in config_names:
+            setattr(self, name, values.get(name, globals()[name]))
+
+    @property
+    def c_prescaler_slow(self):
+        return self.c_clock_freq / self.c_microsteps_per_seconds_slow
+
+    @property
+    def c_prescaler_fast(self):
+        return self.c_clock_freq / self.c_microsteps_per_seconds_fast
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in config_names)
+
+    def key(self):
+        # stable text form of the configuration, e.g. for hashing
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+
+def step_generator_ramp(
+        clk,            # input, main clock
+        reset,          # input, main reset, active low
+        enable,         # input, flag_stepper_enable of the controller
+        speed,          # input, flag_stepper_speed of the controller, fast ramps up to cruise speed, slow down to slow
+        step_clock,     # output, gated clock for the stepper driver, each cycle equals one microstep
+        at_slow,        # output, 1 while the step frequency is the slow speed
+        config=None     # ControllerConfig, default: the module level constants
+):
+    # phase accumulator (NCO): step_clock is the MSB of reg_phase, which is advanced by reg_increment every clock cycle,
+    # so the step frequency is reg_increment * c_clock_freq / 2**c_nco_width. c_ramp_update_freq times per second
+    # reg_increment is moved by one acceleration/deceleration step towards the speed selected by speed, which gives a
+    # trapezoidal speed profile. After the stepper was disabled for two clock cycles the next move starts at slow speed
+    # and reg_phase starts at 0, so every move starts with the same full first step instead of one that depends on
+    # where the phase stood when the last move ended.
+    # The fsm disables the stepper for one clock cycle when it switches from fast to slow seeking, step_clock is kept
+    # running through that cycle so that neither a step is lost nor an extra one is produced.
+    config = config or ControllerConfig()
+    clock_freq = float(config.c_clock_freq)
+    phase_modulo = 2 ** config.c_nco_width
+    phase_msb = config.c_nco_width - 1
+    increment_slow = int(round(config.c_microsteps_per_seconds_slow * phase_modulo / clock_freq))
+    increment_cruise = int(round(config.c_microsteps_per_seconds_cruise * phase_modulo / clock_freq))
+    ramp_prescaler = config.c_clock_freq / config.c_ramp_update_freq
+    ramp_step = phase_modulo / clock_freq / config.c_ramp_update_freq    # increment per microsteps/s^2
+    acceleration_step = max(1, int(round(config.c_acceleration * ramp_step)))
+    deceleration_step = max(1, int(round(config.c_deceleration * ramp_step)))
+
+    reg_phase = Signal(intbv(0)[config.c_nco_width:])
+    reg_increment = Signal(intbv(increment_slow, min=0, max=max(increment_slow, increment_cruise) + 1))
+    reg_ramp_counter = Signal(intbv(0, min=0, max=ramp_prescaler))
+    flag_enable_last = Signal(bool(0))
+
+    @always_seq(clk.posedge, reset=reset)
+    def nco():
+        if enable == 0 and flag_enable_last == 0:
+            reg_phase.next = 0
+        else:
+            reg_phase.next = (reg_phase + reg_increment) % phase_modulo
+
+    @always_seq(clk.posedge, reset=reset)
+    def ramp():
+        flag_enable_last.next = enable
+        if enable == 0 and flag_enable_last == 0:
+            reg_increment.next = increment_slow
+            reg_ramp_counter.next = 0
+        elif reg_ramp_counter < ramp_prescaler - 1:
+            reg_ramp_counter.next = reg_ramp_counter + 1
+        else:
+            reg_ramp_counter.next = 0
+            if speed == c_speed_fast:
+                if reg_increment + acceleration_step < increment_cruise:
+                    reg_increment.next = reg_increment + acceleration_step
+                else:
+                    reg_increment.next = increment_cruise
+            else:
+                if reg_increment > increment_slow + deceleration_step:
+                    reg_increment.next = reg_increment - deceleration_step
+                else:
+                    reg_increment.next = increment_slow
+
+    @always_comb
+    def phase_output():
+        if enable == 1 or flag_enable_last == 1:
+            step_clock.next = reg_phase[phase_msb]
+        else:
+            step_clock.next = 0
+
+    @always_comb
+    def speed_output():
+        at_slow.next = reg_increment == increment_slow
+
+    return nco, ramp, phase_output, speed_output
+
+
+def travel_memory(
+        clk,                # input, main clock
+        reset,              # input, main reset, active low
+        state,              # input, state of the FSM
+        hall1,              # input, hallsensor on position 1, active high
+        hall2,              # input, hallsensor on position 2, active high
+        stepper_steps,      # input, step signal of the stepper driver
+        stepper_direction,  # input, direction signal of the stepper driver
+        time_up,            # input, flag_time_up of the controller, 1 when the time for fast seeking is up
+        pos1_fast_done,     # output, 1 when seeking position 1 has to switch to slow speed
+        pos2_fast_done,     # output, 1 when seeking position 2 has to switch to slow speed
+        config=None         # ControllerConfig, default: the module level constants
+):
+    # reg_position counts the microsteps from hallsensor 1 on. The first time hallsensor 2 is reached coming from
+    # position 1 the distance is stored in reg_travel. From then on the fast phases end c_travel_margin microsteps
+    # before the hallsensor, before that (and again after the fsm went through init) the fixed time counters are used.
+    config = config or ControllerConfig()
+    travel_max = config.c_travel_max
+    travel_margin = config.c_travel_margin
+    reg_position = Signal(intbv(0, min=0, max=travel_max + 1))
+    reg_travel = Signal(intbv(0, min=0, max=travel_max + 1))
+    flag_travel_learned = Signal(bool(0))
+    flag_stepper_steps_last = Signal(bool(0))
+
+    @always_seq(clk.posedge, reset=reset)
+    def position_counter():
+        flag_stepper_steps_last.next = stepper_steps
+        if hall1 == 1:
+            reg_position.next = 0
+        elif stepper_steps == 1 and flag_stepper_steps_last == 0:
+            if stepper_direction == c_direction_pos2:
+                if reg_position < travel_max:
+                    reg_position.next = reg_position + 1
+            else:
+                if reg_position > 0:
+                    reg_position.next = reg_position - 1
+
+    @always_seq(clk.posedge, reset=reset)
+    def learn_travel():
+        if state == m_state.init:
+            flag_travel_learned.next = 0
+        elif hall2 == 1 and flag_travel_learned == 0 and stepper_direction == c_direction_pos2 and reg_position > 0:
+            reg_travel.next = reg_position
+            flag_travel_learned.next = 1
+
+    @always_comb
+    def fast_done():
+        if flag_travel_learned == 1:
+            pos1_fast_done.next = reg_position <= travel_margin
+            pos2_fast_done.next = reg_position + travel_margin >= reg_travel
+        else:
+            pos1_fast_done.next = time_up
+            pos2_fast_done.next = time_up
+
+    return position_counter, learn_travel, fast_done
+
+
+def timebase(
+        clk,        # input, main clock
+        reset,      # input, main reset, active low
+        tick,       # output, high for one clock cycle c_timebase_freq times per second
+        config=None  # ControllerConfig, default: the module level constants
+):
+    config = config or ControllerConfig()
+    prescaler = config.c_clock_freq / config.c_timebase_freq
+    reg_timebase_counter = Signal(intbv(0, min=0, max=prescaler))
+
+    @always_seq(clk.posedge, reset=reset)
+    def timebase_counter():
+        if reg_timebase_counter < prescaler - 1:
+            reg_timebase_counter.next = reg_timebase_counter + 1
+            tick.next = 0
+        else:
+            reg_timebase_counter.next = 0
+            tick.next = 1
+
+    return timebase_counter
+
+
+def timeout_ticks(ms, config):
+    # number of ticks of timebase in ms milliseconds
+    return int(round(ms * config.c_timebase_freq / 1000.0))
+
+
+def timeout_timer(
+        clk,        # input, main clock
+        reset,      # input, main reset, active low
+        state,      # input, state of the FSM
+        tick,       # input, tick of timebase
+        time_up,    # output, 1 when the time of the current state is up
+        config=None  # ControllerConfig, default: the module level constants
+):
+    # one down counter for all seeking states: it is loaded with the time of a state one clock cycle after the fsm
+    # entered it and counts the ticks of timebase down to 0. Only one of the times is needed in any state, so this
+    # replaces the five seek counters, which count clock cycles and need much wider registers for the same time.
+    config = config or ControllerConfig()
+    ticks_home = timeout_ticks(config.c_home_seeking_timeout_ms, config)
+    ticks_pos1_fast = timeout_ticks(config.c_pos1_seeking_fast_ms, config)
+    ticks_pos1_slow = timeout_ticks(config.c_pos1_seeking_timeout_ms, config)
+    ticks_pos2_fast = timeout_ticks(config.c_pos2_seeking_fast_ms, config)
+    ticks_pos2_slow = timeout_ticks(config.c_pos2_seeking_timeout_ms, config)
+    ticks_max = max(ticks_home, ticks_pos1_fast, ticks_pos1_slow, ticks_pos2_fast, ticks_pos2_slow)
+
+    reg_timeout_counter = Signal(intbv(0, min=0, max=ticks_max + 1))
+    reg_state_last = Signal(m_state.init)
+
+    @always_seq(clk.posedge, reset=reset)
+    def timeout_counter():
+        reg_state_last.next = state
+        if state != reg_state_last:
+            if state == m_state.seek_home:
+                reg_timeout_counter.next = ticks_home
+            elif state == m_state.pos1_seeking_fast:
+                reg_timeout_counter.next = ticks_pos1_fast
+            elif state == m_state.pos1_seeking_slow:
+                reg_timeout_counter.next = ticks_pos1_slow
+            elif state == m_state.pos2_seeking_fast:
+                reg_timeout_counter.next = ticks_pos2_fast
+            elif state == m_state.pos2_seeking_slow:
+                reg_timeout_counter.next = ticks_pos2_slow
+            else:
+                reg_timeout_counter.next = 0
+        elif tick == 1 and reg_timeout_counter > 0:
+            reg_timeout_counter.next = reg_timeout_counter - 1
+
+    @always_comb
+    def timeout_output():
+        time_up.next = reg_timeout_counter == 0 and state == reg_state_last
+
+    return timeout_counter, timeout_output
+
+
+def reverse_dwell(
+        clk,            # input, main clock
+        reset,          # input, main reset, active low
+        reversing,      # input, flag_reversing of the axis, 1 in the reversal phase of a preempted seek
+        enable,         # input, flag_stepper_enable of the axis
+        ready,          # output, 1 when the stepper stood still for one slow step period in the reversal phase
+        config=None     # ControllerConfig, default: the module level constants
+):
+    # the stand still before a preempted seek turns around, so the stepper never reverses at speed
+    config = config or ControllerConfig()
+    dwell_cycles = config.c_prescaler_slow
+    reg_reverse_dwell_counter = Signal(intbv(0, min=0, max=dwell_cycles))
+
+    @always_seq(clk.posedge, reset=reset)
+    def reverse_dwell_counter():
+        if reversing == 1 and enable == 0:
+            if reg_reverse_dwell_counter < dwell_cycles - 1:
+                reg_reverse_dwell_counter.next = reg_reverse_dwell_counter + 1
+            else:
+                ready.next = 1
+        else:
+            reg_reverse_dwell_counter.next = 0
+            ready.next = 0
+
+    return reverse_dwell_counter
+
+
+def shared_generators(
+        clk,                # input, main clock
+        reset,              # input, main reset, active low
+        step_clock_slow,    # output, clock for the stepper driver when seeking slowly
+        step_clock_fast,    # output, clock for the stepper driver when seeking fast
+        timebase_tick,      # output, tick of timebase for timeout_timer
+        config=None         # ControllerConfig, default: the module level constants
+):
+    # the free running parts of the controller that do not depend on the state of an axis, so several axes can share
+    # them: the fixed speed prescalers (not needed with step_generator_ramp) and timebase (only with timeout_timer).
+    # The prescalers are not restarted when the fsm enables the stepper or changes its speed, so the first step after
+    # that comes anywhere between that clock edge and one step period later, and if the step clock is high at that
+    # edge the first step is a shortened pulse. step_generator_ramp restarts its phase at the start of every move.
+    config = config or ControllerConfig()
+    step_generator_slow_top = (config.c_prescaler_slow - 2) / 2
+    step_generator_fast_top = (config.c_prescaler_fast - 2) / 2
+
+    # the prescaler counters stop at their top + 1
+    reg_step_generator_slow_counter = Signal(intbv(0, min=0, max=step_generator_slow_top + 2))
+    reg_step_generator_fast_counter = Signal(intbv(0, min=0, max=step_generator_fast_top + 2))
+
+    @always_seq(clk.posedge, reset=reset)
+    def step_generator_slow():
+        if reg_step_generator_slow_counter <= step_generator_slow_top:
+            reg_step_generator_slow_counter.next = reg_step_generator_slow_counter + 1
+        else:
+            reg_step_generator_slow_counter.next = 0
+            step_clock_slow.next = not step_clock_slow
+
+    @always_seq(clk.posedge, reset=reset)
+    def step_generator_fast():
+        if reg_step_generator_fast_counter <= step_generator_fast_top:
+            reg_step_generator_fast_counter.next = reg_step_generator_fast_counter + 1
+        else:
+            reg_step_generator_fast_counter.next = 0
+            step_clock_fast.next = not step_clock_fast
+
+    generators = []
+    if not config.c_step_generator_ramp:
+        generators += [step_generator_slow, step_generator_fast]
+    if config.c_timeout_timer:
+        generators.append(timebase(clk, reset, timebase_tick, config))
+    return generators
+
+
+def seek_telemetry(
+        clk,        # input, main clock
+        reset,      # input, main reset, active low
+        state,      # input, state of the FSM
+        select,     # input, address of a word of telemetry_names
+        data,       # output, the word at select, 0 for addresses after the last word
+        config=None  # ControllerConfig, default: the module level constants
+):
+    # measures the seeks of the fsm in clock cycles, the unit of the seek counters. A phase ends when the fsm leaves the
+    # seeking state, also when a new target preempts it, a seek starts with the first seeking state towards a position
+    # and ends in the resting state of that position. Like timeout_timer, state changes are seen one clock cycle late.
+    # With the default c_telemetry_width of 24 bits the words saturate after 1.6 s at 10 MHz.
+    config = config or ControllerConfig()
+    word_max = 2 ** config.c_telemetry_width - 1
+    n_words = len(telemetry_names)
+
+    words = [Signal(intbv(0, min=0, max=word_max + 1)) for name in telemetry_names]
+    reg_state_last = Signal(m_state.init)
+    reg_phase_cycles = Signal(intbv(0, min=0, max=word_max + 1))
+    reg_seek_cycles = Signal(intbv(0, min=0, max=word_max + 1))
+
+    @always_seq(clk.posedge, reset=reset)
+    def telemetry_counters():
+        reg_state_last.next = state
+        if reg_phase_cycles < word_max:
+            reg_phase_cycles.next = reg_phase_cycles + 1
+        if reg_seek_cycles < word_max:
+            reg_seek_cycles.next = reg_seek_cycles + 1
+        if state != reg_state_last:
+            reg_phase_cycles.next = 0
+            record = False
+            index = 0
+            if reg_state_last == m_state.pos1_seeking_fast:
+                record = True
+                index = 0
+            elif reg_state_last == m_state.pos1_seeking_slow:
+                record = True
+                index = 2
+            elif reg_state_last == m_state.pos2_seeking_fast:
+                record = True
+                index = 7
+            elif reg_state_last == m_state.pos2_seeking_slow:
+                record = True
+                index = 9
+            if record:
+                words[index].next = reg_phase_cycles
+                if reg_phase_cycles > words[index + 1]:
+                    words[index + 1].next = reg_phase_cycles
+
+            if state == m_state.pos1_resting and reg_state_last == m_state.pos1_seeking_slow:
+                words[4].next = reg_seek_cycles
+                if reg_seek_cycles > words[5]:
+                    words[5].next = reg_seek_cycles
+            elif state == m_state.pos2_resting and reg_state_last == m_state.pos2_seeking_slow:
+                words[11].next = reg_seek_cycles
+                if reg_seek_cycles > words[12]:
+                    words[12].next = reg_seek_cycles
+            elif state == m_state.pos1_seeking_timeout and words[6] < word_max:
+                words[6].next = words[6] + 1
+            elif state == m_state.pos2_seeking_timeout and words[13] < word_max:
+                words[13].next = words[13] + 1
+            elif state == m_state.seek_home_timeout and words[14] < word_max:
+                words[14].next = words[14] + 1
+
+            if state == m_state.pos1_seeking_fast or state == m_state.pos1_seeking_slow:
+                if reg_state_last != m_state.pos1_seeking_fast and reg_state_last != m_state.pos1_seeking_slow:
+                    reg_seek_cycles.next = 0
+            elif state == m_state.pos2_seeking_fast or state == m_state.pos2_seeking_slow:
+                if reg_state_last != m_state.pos2_seeking_fast and reg_state_last != m_state.pos2_seeking_slow:
+                    reg_seek_cycles.next = 0
+
+    @always_comb
+    def telemetry_readout():
+        if select < n_words:
+            data.next = words[select]
+        else:
+            data.next = 0
+
+    return telemetry_counters, telemetry_readout
+
+
+def mirror_box_axis(
         clk,                # input, main clock
         reset,              # input, main reset, active low
         state_reset,        # input, synchronous reset for the FSM state, active low
@@ -49,18 +478,63 @@ def mirror_box_controller(
         drive2pos2_PIO,     # input, driving this signal high sets the target_position to pos2, PIO interface
         lock_manual_input,  # input, driving this signal high disables the manual operation
         stepper_direction,  # output, direction signal for the stepper driver, 1==CW, 0==CCW
-        stepper_steps       # output, step signal for the stepper driver, each cycle equals one microstep
+        stepper_steps,      # output, step signal for the stepper driver, each cycle equals one microstep
+        step_clock_slow,    # input, step_clock_slow of shared_generators
+        step_clock_fast,    # input, step_clock_fast of shared_generators
+        timebase_tick,      # input, timebase_tick of shared_generators
+        config=None         # ControllerConfig, default: the module level constants
 ):
+    # everything of mirror_box_controller that belongs to one mirror box: fsm, seek counters or timeout_timer, the
+    # step output and, if configured, step_generator_ramp and travel_memory
+    config = config or ControllerConfig()
+    if config.c_preempt_seek and config.c_timeout_timer:
+        raise ValueError('c_preempt_seek presets the fast seek counter of the way back, timeout_timer cannot be preset '
+                         'and would do the way back at slow speed')
+    home_seeking_slow_counter_maxvalue = config.c_home_seeking_slow_counter_maxvalue
+    pos1_seeking_fast_counter_maxvalue = config.c_pos1_seeking_fast_counter_maxvalue
+    pos1_seeking_slow_counter_maxvalue = config.c_pos1_seeking_slow_counter_maxvalue
+    pos2_seeking_fast_counter_maxvalue = config.c_pos2_seeking_fast_counter_maxvalue
+    pos2_seeking_slow_counter_maxvalue = config.c_pos2_seeking_slow_counter_maxvalue
+
+    # A seek that is preempted by a new target turns around: the fsm goes to the fast seeking state of the new target
+    # with the stepper direction unchanged, which is its reversal phase. There the stepper slows down to slow speed
+    # (step_generator_ramp decelerates, the fixed prescalers stop at once), stands still for one slow step period (see
+    # reverse_dwell) and only then starts at fast speed in the new direction.
+    # The fast counter of a seek counts the clock cycles at fast speed away from the hall sensor it started at, so the
+    # fast phase back is preset to end c_travel_margin microsteps before reaching that sensor again. A slow seek has
+    # done its whole fast phase. The margin is limited to the fast phase it is compared with, with the default seek
+    # counters a fast phase is shorter than c_travel_margin microsteps and every way back is done at slow speed, with
+    # counters sized to the travel (see bench_preempt.py) the fast phase back is preset.
+    preempt_seek = config.c_preempt_seek
+    travel_margin_cycles = config.c_travel_margin * config.c_prescaler_fast
+    pos1_reverse_margin = min(travel_margin_cycles, pos2_seeking_fast_counter_maxvalue + 1)
+    pos2_reverse_margin = min(travel_margin_cycles, pos1_seeking_fast_counter_maxvalue + 1)
+    pos1_reverse_base = pos1_seeking_fast_counter_maxvalue + 1 + pos1_reverse_margin
+    pos2_reverse_base = pos2_seeking_fast_counter_maxvalue + 1 + pos2_reverse_margin
+    pos1_reverse_from_slow = min(pos1_seeking_fast_counter_maxvalue + 1,
+                                 max(0, pos1_reverse_base - pos2_seeking_fast_counter_maxvalue - 1))
+    pos2_reverse_from_slow = min(pos2_seeking_fast_counter_maxvalue + 1,
+                                 max(0, pos2_reverse_base - pos1_seeking_fast_counter_maxvalue - 1))
+    # every preset has to fit into the fast counter it is loaded into, which stops at maxvalue + 1. The presets from a
+    # fast seek lie between those of its shortest and its longest distance that is not handled by a constant.
+    for presets, maxvalue in (((pos1_reverse_from_slow, pos1_reverse_base - pos1_reverse_margin - 1, 1),
+                               pos1_seeking_fast_counter_maxvalue),
+                              ((pos2_reverse_from_slow, pos2_reverse_base - pos2_reverse_margin - 1, 1),
+                               pos2_seeking_fast_counter_maxvalue)):
+        for preset in presets:
+            assert 0 <= preset <= maxvalue + 1, \
+                'reverse preset %d does not fit a fast seek counter with maxvalue %d' % (preset, maxvalue)
 
-    # definition of internal registers
+    # definition of internal registers. Each seek counter and its top flag are driven by their counter block only:
+    # they count while the fsm enables them in their seeking state and are held at 0 in every other state, except
+    # that a fast counter is preset when a preempted seek turns around towards its position.
     target_position =  Signal(bool(c_position_pos1))  # 0==Pos1, 1==Pos2
-    reg_home_seeking_slow_counter = Signal(0)
-    reg_pos1_seeking_fast_counter = Signal(0)
-    reg_pos1_seeking_slow_counter = Signal(0)
-    reg_pos2_seeking_fast_counter = Signal(0)
-    reg_pos2_seeking_slow_counter = Signal(0)
-    reg_step_generator_slow_counter = Signal(0)
-    reg_step_generator_fast_counter = Signal(0)
+    # the seek counters stop at maxvalue + 1
+    reg_home_seeking_slow_counter = Signal(intbv(0, min=0, max=home_seeking_slow_counter_maxvalue + 2))
+    reg_pos1_seeking_fast_counter = Signal(intbv(0, min=0, max=pos1_seeking_fast_counter_maxvalue + 2))
+    reg_pos1_seeking_slow_counter = Signal(intbv(0, min=0, max=pos1_seeking_slow_counter_maxvalue + 2))
+    reg_pos2_seeking_fast_counter = Signal(intbv(0, min=0, max=pos2_seeking_fast_counter_maxvalue + 2))
+    reg_pos2_seeking_slow_counter = Signal(intbv(0, min=0, max=pos2_seeking_slow_counter_maxvalue + 2))
 
     # definition of internal flags
     flag_stepper_direction = Signal(bool(0))
@@ -76,38 +550,60 @@ def mirror_box_controller(
     flag_seek_pos1_fast_counter_top = Signal(bool(0))    # 1 when time for fast seeking is up
     flag_seek_pos2_slow_counter_top = Signal(bool(0))    # 1 when seeking position 2 goes into timeout
     flag_seek_pos2_fast_counter_top = Signal(bool(0))    # 1 when time for fast seeking is up
+    flag_time_up = Signal(bool(0))   # 1 when the time of the current seeking state is up
+    flag_seek_pos1_fast_done = Signal(bool(0))   # 1 when seeking position 1 switches to slow speed
+    flag_seek_pos2_fast_done = Signal(bool(0))   # 1 when seeking position 2 switches to slow speed
+    flag_reverse_to_pos1 = Signal(bool(0))   # 1 when a seek to position 2 is preempted by target position 1
+    flag_reverse_to_pos2 = Signal(bool(0))   # 1 when a seek to position 1 is preempted by target position 2
+    flag_reversing = Signal(bool(0))   # 1 in the reversal phase of a preempted seek
+    # without c_preempt_seek the fsm never reverses and these are constants, so they cost no logic
+    if preempt_seek:
+        flag_reverse_ready = Signal(bool(0))   # 1 when the stepper stood still for one slow step period
+    else:
+        flag_reverse_ready = 0
+    if config.c_step_generator_ramp:
+        flag_stepper_slow = Signal(bool(0))   # 1 when step_generator_ramp is down to slow speed
+    else:
+        flag_stepper_slow = 1     # the fixed prescalers change the speed at once
 
     # definition of internal signals
     hall1 = Signal(bool(0))     # 1 when the magnet has reached hallsensor 1, active high
     hall2 = Signal(bool(0))     # 1 when the magnet has reached hallsensor 2, active high
-    step_clock_slow = Signal(bool(0))    # clock for the stepper driver when seeking slowly
-    step_clock_fast = Signal(bool(0))    # clock for the stepper driver when seeking fast
-
-    @always_seq(clk.posedge, reset=reset)
-    def step_generator_slow():
-        if reg_step_generator_slow_counter <= Signal((c_prescaler_slow -2) / 2):
-            reg_step_generator_slow_counter.next = reg_step_generator_slow_counter + 1
-        else:
-            reg_step_generator_slow_counter.next = Signal(0)
-            step_clock_slow.next = not step_clock_slow
-
-    @always_seq(clk.posedge, reset=reset)
-    def step_generator_fast():
-        if reg_step_generator_fast_counter <= Signal((c_prescaler_fast -2) / 2):
-            reg_step_generator_fast_counter.next = reg_step_generator_fast_counter + 1
-        else:
-            reg_step_generator_fast_counter.next = Signal(0)
-            step_clock_fast.next = not step_clock_fast
+    step_clock_ramp = Signal(bool(0))    # gated clock for the stepper driver from step_generator_ramp
 
     @always_comb
     def step_output():
-        if flag_stepper_enable == Signal(bool(1)):
-            if flag_stepper_speed == Signal(bool(c_speed_fast)):
+        if flag_stepper_enable == 1:
+            if flag_stepper_speed == c_speed_fast:
                 stepper_steps.next = step_clock_fast
             else:
                 stepper_steps.next = step_clock_slow
         else:
-            stepper_steps.next = Signal(bool(0))
+            stepper_steps.next = 0
+
+    @always_comb
+    def step_output_ramp():
+        stepper_steps.next = step_clock_ramp
+
+    @always_comb
+    def seek_fast_done():
+        flag_seek_pos1_fast_done.next = flag_time_up
+        flag_seek_pos2_fast_done.next = flag_time_up
+
+    @always_comb
+    def seek_time_up():
+        if state == m_state.seek_home:
+            flag_time_up.next = flag_seek_home_slow_counter_top
+        elif state == m_state.pos1_seeking_fast:
+            flag_time_up.next = flag_seek_pos1_fast_counter_top
+        elif state == m_state.pos1_seeking_slow:
+            flag_time_up.next = flag_seek_pos1_slow_counter_top
+        elif state == m_state.pos2_seeking_fast:
+            flag_time_up.next = flag_seek_pos2_fast_counter_top
+        elif state == m_state.pos2_seeking_slow:
+            flag_time_up.next = flag_seek_pos2_slow_counter_top
+        else:
+            flag_time_up.next = 0
 
     @always_comb
     def generate_stepper_direction():
@@ -123,242 +619,420 @@ def mirror_box_controller(
 
     @always_seq(clk.posedge, reset=reset)
     def update_target_position():
-        if drive2pos1_manual == Signal(bool(1)):
-            target_position.next = Signal(bool(c_position_pos1))
-        elif drive2pos1_PIO == Signal(bool(1)):
-            target_position.next = Signal(bool(c_position_pos1))
-        elif drive2pos2_manual == Signal(bool(1)):
-            target_position.next = Signal(bool(c_position_pos2))
-        elif drive2pos2_PIO == Signal(bool(1)):
-            target_position.next = Signal(bool(c_position_pos2))
+        if state == m_state.init:
+            target_position.next = c_position_pos1
+        elif drive2pos1_manual == 1:
+            target_position.next = c_position_pos1
+        elif drive2pos1_PIO == 1:
+            target_position.next = c_position_pos1
+        elif drive2pos2_manual == 1:
+            target_position.next = c_position_pos2
+        elif drive2pos2_PIO == 1:
+            target_position.next = c_position_pos2
+
+    @always_comb
+    def seek_reverse():
+        flag_reverse_to_pos1.next = 0
+        flag_reverse_to_pos2.next = 0
+        flag_reversing.next = 0
+        if preempt_seek:
+            # in the reversal phase the stepper direction still points away from the target
+            if state == m_state.pos1_seeking_fast and flag_stepper_direction == c_direction_pos2:
+                flag_reversing.next = 1
+            elif state == m_state.pos2_seeking_fast and flag_stepper_direction == c_direction_pos1:
+                flag_reversing.next = 1
+            if target_position == c_position_pos1:
+                if state == m_state.pos2_seeking_fast:
+                    flag_reverse_to_pos1.next = 1
+                elif state == m_state.pos2_seeking_slow and hall2 == c_not_reached:
+                    flag_reverse_to_pos1.next = 1
+            else:
+                if state == m_state.pos1_seeking_fast:
+                    flag_reverse_to_pos2.next = 1
+                elif state == m_state.pos1_seeking_slow and hall1 == c_not_reached:
+                    flag_reverse_to_pos2.next = 1
 
     @always_seq(clk.posedge, reset=reset)
     def home_seeking_slow_counter():
-        if flag_seek_home_slow_enable == Signal(bool(1)):
-            if reg_home_seeking_slow_counter > c_home_seeking_slow_counter_maxvalue:
-                flag_seek_home_slow_counter_top.next = Signal(bool(1))
-            else:
-                flag_seek_home_slow_counter_top.next = Signal(bool(0))
-                reg_home_seeking_slow_counter.next = reg_home_seeking_slow_counter + 1
+        if state == m_state.seek_home:
+            if flag_seek_home_slow_enable == 1:
+                if reg_home_seeking_slow_counter > home_seeking_slow_counter_maxvalue:
+                    flag_seek_home_slow_counter_top.next = 1
+                else:
+                    flag_seek_home_slow_counter_top.next = 0
+                    reg_home_seeking_slow_counter.next = reg_home_seeking_slow_counter + 1
+        else:
+            flag_seek_home_slow_counter_top.next = 0
+            reg_home_seeking_slow_counter.next = 0
 
     @always_seq(clk.posedge, reset=reset)
     def pos1_seeking_slow_counter():
-        if flag_seek_pos1_slow_enable == Signal(bool(1)):
-            if reg_pos1_seeking_slow_counter > c_pos1_seeking_slow_counter_maxvalue:
-                flag_seek_pos1_slow_counter_top.next = Signal(bool(1))
-            else:
-                flag_seek_pos1_slow_counter_top.next = Signal(bool(0))
-                reg_pos1_seeking_slow_counter.next = reg_pos1_seeking_slow_counter + 1
+        if state == m_state.pos1_seeking_slow:
+            if flag_seek_pos1_slow_enable == 1:
+                if reg_pos1_seeking_slow_counter > pos1_seeking_slow_counter_maxvalue:
+                    flag_seek_pos1_slow_counter_top.next = 1
+                else:
+                    flag_seek_pos1_slow_counter_top.next = 0
+                    reg_pos1_seeking_slow_counter.next = reg_pos1_seeking_slow_counter + 1
+        else:
+            flag_seek_pos1_slow_counter_top.next = 0
+            reg_pos1_seeking_slow_counter.next = 0
 
     @always_seq(clk.posedge, reset=reset)
     def pos1_seeking_fast_counter():
-        if flag_seek_pos1_fast_enable == Signal(bool(1)):
-            if reg_pos1_seeking_fast_counter > c_pos1_seeking_fast_counter_maxvalue:
-                flag_seek_pos1_fast_counter_top.next = Signal(bool(1))
+        if state == m_state.pos1_seeking_fast:
+            if flag_seek_pos1_fast_enable == 1:
+                if reg_pos1_seeking_fast_counter > pos1_seeking_fast_counter_maxvalue:
+                    flag_seek_pos1_fast_counter_top.next = 1
+                else:
+                    flag_seek_pos1_fast_counter_top.next = 0
+                    reg_pos1_seeking_fast_counter.next = reg_pos1_seeking_fast_counter + 1
+        elif flag_reverse_to_pos1 == 1:
+            flag_seek_pos1_fast_counter_top.next = 0
+            if state == m_state.pos2_seeking_slow:
+                reg_pos1_seeking_fast_counter.next = pos1_reverse_from_slow
+            elif reg_pos2_seeking_fast_counter >= pos1_reverse_base:
+                reg_pos1_seeking_fast_counter.next = 0
+            elif reg_pos2_seeking_fast_counter <= pos1_reverse_margin:
+                reg_pos1_seeking_fast_counter.next = pos1_seeking_fast_counter_maxvalue + 1
             else:
-                flag_seek_pos1_fast_counter_top.next = Signal(bool(0))
-                reg_pos1_seeking_fast_counter.next = reg_pos1_seeking_fast_counter + 1
+                reg_pos1_seeking_fast_counter.next = pos1_reverse_base - reg_pos2_seeking_fast_counter
+        else:
+            flag_seek_pos1_fast_counter_top.next = 0
+            reg_pos1_seeking_fast_counter.next = 0
 
     @always_seq(clk.posedge, reset=reset)
     def pos2_seeking_slow_counter():
-        if flag_seek_pos2_slow_enable == Signal(bool(1)):
-            if reg_pos2_seeking_slow_counter > c_pos2_seeking_slow_counter_maxvalue:
-                flag_seek_pos2_slow_counter_top.next = Signal(bool(1))
-            else:
-                flag_seek_pos2_slow_counter_top.next = Signal(bool(0))
-                reg_pos2_seeking_slow_counter.next = reg_pos2_seeking_slow_counter + 1
+        if state == m_state.pos2_seeking_slow:
+            if flag_seek_pos2_slow_enable == 1:
+                if reg_pos2_seeking_slow_counter > pos2_seeking_slow_counter_maxvalue:
+                    flag_seek_pos2_slow_counter_top.next = 1
+                else:
+                    flag_seek_pos2_slow_counter_top.next = 0
+                    reg_pos2_seeking_slow_counter.next = reg_pos2_seeking_slow_counter + 1
+        else:
+            flag_seek_pos2_slow_counter_top.next = 0
+            reg_pos2_seeking_slow_counter.next = 0
 
     @always_seq(clk.posedge, reset=reset)
     def pos2_seeking_fast_counter():
-        if flag_seek_pos2_fast_enable == Signal(bool(1)):
-            if reg_pos2_seeking_fast_counter > c_pos2_seeking_fast_counter_maxvalue:
-                flag_seek_pos2_fast_counter_top.next = Signal(bool(1))
+        if state == m_state.pos2_seeking_fast:
+            if flag_seek_pos2_fast_enable == 1:
+                if reg_pos2_seeking_fast_counter > pos2_seeking_fast_counter_maxvalue:
+                    flag_seek_pos2_fast_counter_top.next = 1
+                else:
+                    flag_seek_pos2_fast_counter_top.next = 0
+                    reg_pos2_seeking_fast_counter.next = reg_pos2_seeking_fast_counter + 1
+        elif flag_reverse_to_pos2 == 1:
+            flag_seek_pos2_fast_counter_top.next = 0
+            if state == m_state.pos1_seeking_slow:
+                reg_pos2_seeking_fast_counter.next = pos2_reverse_from_slow
+            elif reg_pos1_seeking_fast_counter >= pos2_reverse_base:
+                reg_pos2_seeking_fast_counter.next = 0
+            elif reg_pos1_seeking_fast_counter <= pos2_reverse_margin:
+                reg_pos2_seeking_fast_counter.next = pos2_seeking_fast_counter_maxvalue + 1
             else:
-                flag_seek_pos2_fast_counter_top.next = Signal(bool(0))
-                reg_pos2_seeking_fast_counter.next = reg_pos2_seeking_fast_counter + 1
+                reg_pos2_seeking_fast_counter.next = pos2_reverse_base - reg_pos1_seeking_fast_counter
+        else:
+            flag_seek_pos2_fast_counter_top.next = 0
+            reg_pos2_seeking_fast_counter.next = 0
 
     @always_seq(clk.posedge, reset=reset)
     def fsm():
         if state == m_state.init:
             state.next = m_state.seek_home
-            flag_stepper_direction.next = Signal(bool(c_direction_pos1))
-            flag_stepper_speed.next = Signal(bool(c_speed_slow))
-            flag_stepper_enable.next = Signal(bool(0))
-            flag_seek_home_slow_counter_top.next = Signal(bool(0))
-            flag_seek_pos1_slow_counter_top.next = Signal(bool(0))
-            flag_seek_pos1_fast_counter_top.next = Signal(bool(0))
-            flag_seek_pos2_slow_counter_top.next = Signal(bool(0))
-            flag_seek_pos2_fast_counter_top.next = Signal(bool(0))
-            target_position.next = Signal(bool(c_position_pos1))
-            reg_home_seeking_slow_counter.next = Signal(0)
-            reg_pos1_seeking_fast_counter.next = Signal(0)
-            reg_pos1_seeking_slow_counter.next = Signal(0)
-            reg_pos2_seeking_fast_counter.next = Signal(0)
-            reg_pos2_seeking_slow_counter.next = Signal(0)
+            flag_stepper_direction.next = c_direction_pos1
+            flag_stepper_speed.next = c_speed_slow
+            flag_stepper_enable.next = 0
 
         elif state == m_state.seek_home:
-            flag_seek_home_slow_enable.next = Signal(bool(1))
-            flag_stepper_enable.next = Signal(bool(1))
-            if flag_seek_home_slow_counter_top == Signal(bool(c_reached)):
+            flag_seek_home_slow_enable.next = 1
+            flag_stepper_enable.next = 1
+            if flag_time_up == c_reached:
                 state.next = m_state.seek_home_timeout
             else:
-                if hall1 == Signal(bool(c_reached)) and hall2 == Signal(bool(c_not_reached)):
+                if hall1 == c_reached and hall2 == c_not_reached:
                     state.next = m_state.pos1_resting
                 else:
                     state.next = m_state.seek_home
 
         elif state == m_state.seek_home_timeout:
-            flag_seek_home_slow_enable.next = Signal(bool(0))
-            flag_stepper_enable.next = Signal(bool(0))
-            if state_reset == Signal(bool(1)):
+            flag_seek_home_slow_enable.next = 0
+            flag_stepper_enable.next = 0
+            if state_reset == 1:
                 state.next = m_state.init
             else:
                 state.next = m_state.seek_home_timeout
 
         elif state == m_state.pos1_resting:
-            reg_home_seeking_slow_counter.next = Signal(0)
-            reg_pos1_seeking_slow_counter.next = Signal(0)
-            flag_seek_home_slow_enable.next = Signal(bool(0))
-            flag_seek_pos1_slow_enable.next = Signal(bool(0))
-            flag_stepper_enable.next = Signal(bool(0))
-            if target_position == Signal(bool(c_position_pos2)):
+            flag_seek_home_slow_enable.next = 0
+            flag_seek_pos1_slow_enable.next = 0
+            flag_stepper_enable.next = 0
+            if target_position == c_position_pos2:
                 state.next = m_state.pos2_seeking_fast
-                reg_pos2_seeking_fast_counter.next = Signal(0)
-                flag_stepper_direction.next = Signal(bool(c_direction_pos2))
-                flag_stepper_speed.next = Signal(bool(c_speed_fast))
-                flag_stepper_enable.next = Signal(bool(0))
+                flag_stepper_direction.next = c_direction_pos2
+                flag_stepper_speed.next = c_speed_fast
+                flag_stepper_enable.next = 0
             else:
-                if hall1 == Signal(bool(c_reached)):
+                if hall1 == c_reached:
                     state.next = m_state.pos1_resting
                 else:
                     state.next = m_state.pos1_resting_error
 
         elif state == m_state.pos2_resting:
-            reg_pos2_seeking_slow_counter.next = Signal(0)
-            flag_seek_pos2_slow_enable.next = Signal(bool(0))
-            flag_stepper_enable.next = Signal(bool(0))
-            if target_position == Signal(bool(c_position_pos1)):
+            flag_seek_pos2_slow_enable.next = 0
+            flag_stepper_enable.next = 0
+            if target_position == c_position_pos1:
                 state.next = m_state.pos1_seeking_fast
-                reg_pos1_seeking_fast_counter.next = Signal(0)
-                flag_stepper_direction.next = Signal(bool(c_direction_pos1))
-                flag_stepper_speed.next = Signal(bool(c_speed_fast))
-                flag_stepper_enable.next = Signal(bool(0))
+                flag_stepper_direction.next = c_direction_pos1
+                flag_stepper_speed.next = c_speed_fast
+                flag_stepper_enable.next = 0
             else:
-                if hall2 == Signal(bool(c_reached)):
+                if hall2 == c_reached:
                     state.next = m_state.pos2_resting
                 else:
                     state.next = m_state.pos2_resting_error
 
         elif state == m_state.pos1_resting_error:
-            flag_stepper_enable.next = Signal(bool(0))
-            if state_reset == Signal(bool(1)):
+            flag_stepper_enable.next = 0
+            if state_reset == 1:
                 state.next = m_state.init
             else:
                 state.next = m_state.pos1_resting_error
 
         elif state == m_state.pos2_resting_error:
-            flag_stepper_enable.next = Signal(bool(0))
-            if state_reset == Signal(bool(1)):
+            flag_stepper_enable.next = 0
+            if state_reset == 1:
                 state.next = m_state.init
             else:
                 state.next = m_state.pos2_resting_error
 
         elif state == m_state.pos1_seeking_slow:
-            flag_seek_pos1_fast_enable.next = Signal(bool(0))
-            flag_seek_pos1_slow_enable.next = Signal(bool(1))
-            reg_pos1_seeking_fast_counter.next = Signal(0)
-            flag_stepper_direction.next = Signal(bool(c_direction_pos1))
-            flag_stepper_speed.next = Signal(bool(c_speed_slow))
-            flag_stepper_enable.next = Signal(bool(1))
-            if hall1 == Signal(bool(c_reached)):
+            flag_seek_pos1_fast_enable.next = 0
+            flag_seek_pos1_slow_enable.next = 1
+            flag_stepper_direction.next = c_direction_pos1
+            flag_stepper_speed.next = c_speed_slow
+            flag_stepper_enable.next = 1
+            if hall1 == c_reached:
                 state.next = m_state.pos1_resting
+            elif flag_reverse_to_pos2 == 1:
+                # the stepper keeps its direction for the reversal phase of pos2_seeking_fast
+                flag_seek_pos1_slow_enable.next = 0
+                if flag_stepper_slow == 1:
+                    flag_stepper_enable.next = 0
+                state.next = m_state.pos2_seeking_fast
             else:
-                if flag_seek_pos1_slow_counter_top == Signal(bool(c_reached)):
+                if flag_time_up == c_reached:
                     state.next = m_state.pos1_seeking_timeout
                 else:
                     state.next = m_state.pos1_seeking_slow
 
         elif state == m_state.pos2_seeking_slow:
-            flag_stepper_enable.next = Signal(bool(1))
-            reg_pos2_seeking_fast_counter.next = Signal(0)
-            flag_stepper_direction.next = Signal(bool(c_direction_pos2))
-            flag_stepper_speed.next = Signal(bool(c_speed_slow))
-            flag_seek_pos2_fast_enable.next = Signal(bool(0))
-            flag_seek_pos2_slow_enable.next = Signal(bool(1))
-            if hall2 == Signal(bool(c_reached)):
+            flag_stepper_enable.next = 1
+            flag_stepper_direction.next = c_direction_pos2
+            flag_stepper_speed.next = c_speed_slow
+            flag_seek_pos2_fast_enable.next = 0
+            flag_seek_pos2_slow_enable.next = 1
+            if hall2 == c_reached:
                 state.next = m_state.pos2_resting
+            elif flag_reverse_to_pos1 == 1:
+                # the stepper keeps its direction for the reversal phase of pos1_seeking_fast
+                flag_seek_pos2_slow_enable.next = 0
+                if flag_stepper_slow == 1:
+                    flag_stepper_enable.next = 0
+                state.next = m_state.pos1_seeking_fast
             else:
-                if flag_seek_pos2_slow_counter_top == Signal(bool(1)):
+                if flag_time_up == 1:
                     state.next = m_state.pos2_seeking_timeout
                 else:
                     state.next = m_state.pos2_seeking_slow
 
+        elif state == m_state.pos1_seeking_fast and flag_reversing == 1:
+            # reversal phase of a preempted seek towards position 2: slow down, stop, stand still, turn around
+            flag_seek_pos1_fast_enable.next = 0
+            flag_seek_pos2_slow_enable.next = 0
+            flag_stepper_speed.next = c_speed_slow
+            if flag_reverse_ready == 1:
+                flag_stepper_direction.next = c_direction_pos1
+                flag_stepper_speed.next = c_speed_fast
+            elif flag_stepper_slow == 1:
+                flag_stepper_enable.next = 0
+            state.next = m_state.pos1_seeking_fast
+
+        elif state == m_state.pos2_seeking_fast and flag_reversing == 1:
+            # reversal phase of a preempted seek towards position 1
+            flag_seek_pos2_fast_enable.next = 0
+            flag_seek_pos1_slow_enable.next = 0
+            flag_stepper_speed.next = c_speed_slow
+            if flag_reverse_ready == 1:
+                flag_stepper_direction.next = c_direction_pos2
+                flag_stepper_speed.next = c_speed_fast
+            elif flag_stepper_slow == 1:
+                flag_stepper_enable.next = 0
+            state.next = m_state.pos2_seeking_fast
+
         elif state == m_state.pos1_seeking_fast:
-            flag_stepper_enable.next = Signal(bool(1))
-            flag_stepper_enable.next = Signal(bool(1))
-            flag_stepper_direction.next = Signal(bool(c_direction_pos1))
-            flag_stepper_speed.next = Signal(bool(c_speed_fast))
-            flag_seek_pos1_fast_enable.next = Signal(bool(1))
-            if flag_seek_pos1_fast_counter_top == Signal(bool(1)):
-                reg_pos1_seeking_slow_counter.next = Signal(0)
+            flag_stepper_enable.next = 1
+            flag_stepper_direction.next = c_direction_pos1
+            flag_stepper_speed.next = c_speed_fast
+            flag_seek_pos1_fast_enable.next = 1
+            if flag_reverse_to_pos2 == 1:
+                # the stepper keeps its direction for the reversal phase of pos2_seeking_fast
+                flag_seek_pos1_fast_enable.next = 0
+                flag_stepper_speed.next = c_speed_slow
+                if flag_stepper_slow == 1:
+                    flag_stepper_enable.next = 0
+                state.next = m_state.pos2_seeking_fast
+            elif flag_seek_pos1_fast_done == 1:
                 state.next = m_state.pos1_seeking_slow
-                flag_stepper_enable.next = Signal(0)
-                flag_stepper_speed.next = Signal(c_speed_slow)
-                flag_stepper_direction.next = Signal(c_direction_pos1)
+                flag_stepper_enable.next = 0
+                flag_stepper_speed.next = c_speed_slow
+                flag_stepper_direction.next = c_direction_pos1
             else:
                 state.next = m_state.pos1_seeking_fast
 
         elif state == m_state.pos2_seeking_fast:
-            flag_stepper_enable.next = Signal(bool(1))
-            flag_seek_pos2_fast_enable.next = Signal(bool(1))
-            flag_seek_pos2_slow_enable.next = Signal(bool(0))
-            if flag_seek_pos2_fast_counter_top == Signal(bool(1)):
-                reg_pos2_seeking_slow_counter.next = Signal(0)
+            flag_stepper_enable.next = 1
+            flag_seek_pos2_fast_enable.next = 1
+            flag_seek_pos2_slow_enable.next = 0
+            if flag_reverse_to_pos1 == 1:
+                flag_seek_pos2_fast_enable.next = 0
+                flag_stepper_speed.next = c_speed_slow
+                if flag_stepper_slow == 1:
+                    flag_stepper_enable.next = 0
+                state.next = m_state.pos1_seeking_fast
+            elif flag_seek_pos2_fast_done == 1:
                 state.next = m_state.pos2_seeking_slow
-                flag_stepper_enable.next = Signal(0)
-                flag_stepper_speed.next = Signal(c_speed_slow)
-                flag_stepper_direction.next = Signal(c_direction_pos2)
+                flag_stepper_enable.next = 0
+                flag_stepper_speed.next = c_speed_slow
+                flag_stepper_direction.next = c_direction_pos2
             else:
                 state.next = m_state.pos2_seeking_fast
 
         elif state == m_state.pos1_seeking_timeout:
-            flag_stepper_enable.next = Signal(bool(0))
-            if state_reset == Signal(bool(1)):
+            flag_stepper_enable.next = 0
+            if state_reset == 1:
                 state.next = m_state.init
             else:
                 state.next = m_state.pos1_seeking_timeout
 
         elif state == m_state.pos2_seeking_timeout:
-            flag_stepper_enable.next = Signal(bool(0))
-            if state_reset == Signal(bool(1)):
+            flag_stepper_enable.next = 0
+            if state_reset == 1:
                 state.next = m_state.init
             else:
                 state.next = m_state.pos2_seeking_timeout
         else:
             state.next = m_state.init
 
-    # return fsm, inverter_hall1, inverter_hall2, pos1_seeking_fast_counter, pos2_seeking_fast_counter,\
-    #        pos1_seeking_slow_counter. pos2_seeking_slow_counter, home_seeking_slow_counter, update_target_position
-    return fsm, inverter_hall1, inverter_hall2, pos1_seeking_fast_counter, pos2_seeking_fast_counter,\
-           pos1_seeking_slow_counter, home_seeking_slow_counter, update_target_position, pos2_seeking_slow_counter,\
-            step_generator_slow, step_generator_fast, step_output, generate_stepper_direction
-
-
-
-
-
-
-
+    if config.c_learn_travel:
+        seek_end = travel_memory(clk, reset, state, hall1, hall2, stepper_steps, stepper_direction, flag_time_up,
+                                 flag_seek_pos1_fast_done, flag_seek_pos2_fast_done, config)
+    else:
+        seek_end = seek_fast_done
 
+    if config.c_timeout_timer:
+        timers = timeout_timer(clk, reset, state, timebase_tick, flag_time_up, config)
+    else:
+        timers = home_seeking_slow_counter, pos1_seeking_fast_counter, pos1_seeking_slow_counter,\
+            pos2_seeking_fast_counter, pos2_seeking_slow_counter, seek_time_up
 
+    # return fsm, inverter_hall1, inverter_hall2, pos1_seeking_fast_counter, pos2_seeking_fast_counter,\
+    #        pos1_seeking_slow_counter. pos2_seeking_slow_counter, home_seeking_slow_counter, update_target_position
+    if preempt_seek:
+        reversal = seek_reverse, reverse_dwell(clk, reset, flag_reversing, flag_stepper_enable, flag_reverse_ready,
+                                               config)
+    else:
+        reversal = seek_reverse
 
+    if config.c_step_generator_ramp:
+        step_generator = step_generator_ramp(clk, reset, flag_stepper_enable, flag_stepper_speed, step_clock_ramp,
+                                             flag_stepper_slow, config)
+        return fsm, inverter_hall1, inverter_hall2, update_target_position, reversal, timers, step_generator,\
+            step_output_ramp, generate_stepper_direction, seek_end
+    return fsm, inverter_hall1, inverter_hall2, update_target_position, reversal, timers, step_output,\
+        generate_stepper_direction, seek_end
 
 
+def mirror_box_controller(
+        clk,                # input, main clock
+        reset,              # input, main reset, active low
+        state_reset,        # input, synchronous reset for the FSM state, active low
+        state,              # output, state of the FSM for debugging purposes
+        hall1_not,          # input, raw signal of the hallsensor on position 1, active low
+        hall2_not,          # input, raw signal of the hallsensor on position 2, active low
+        drive2pos1_manual,  # input, driving this signal high sets the target_position to pos1, manual operation
+        drive2pos2_manual,  # input, driving this signal high sets the target_position to pos2, manual operation
+        drive2pos1_PIO,     # input, driving this signal high sets the target_position to pos1, PIO interface
+        drive2pos2_PIO,     # input, driving this signal high sets the target_position to pos2, PIO interface
+        lock_manual_input,  # input, driving this signal high disables the manual operation
+        stepper_direction,  # output, direction signal for the stepper driver, 1==CW, 0==CCW
+        stepper_steps,      # output, step signal for the stepper driver, each cycle equals one microstep
+        config=None,        # ControllerConfig, default: the module level constants
+        telemetry_select=None,  # input, PIO readout address of seek_telemetry, only with c_telemetry
+        telemetry_data=None     # output, PIO readout data of seek_telemetry, only with c_telemetry
+):
+    config = config or ControllerConfig()
+    if config.c_telemetry and (telemetry_select is None or telemetry_data is None):
+        raise ValueError('c_telemetry needs the telemetry_select and telemetry_data ports')
 
+    # definition of internal signals
+    step_clock_slow = Signal(bool(0))    # clock for the stepper driver when seeking slowly
+    step_clock_fast = Signal(bool(0))    # clock for the stepper driver when seeking fast
+    timebase_tick = Signal(bool(0))      # tick of timebase for timeout_timer
 
+    axis = mirror_box_axis(clk, reset, state_reset, state, hall1_not, hall2_not, drive2pos1_manual, drive2pos2_manual,
+                           drive2pos1_PIO, drive2pos2_PIO, lock_manual_input, stepper_direction, stepper_steps,
+                           step_clock_slow, step_clock_fast, timebase_tick, config)
+    shared = shared_generators(clk, reset, step_clock_slow, step_clock_fast, timebase_tick, config)
+    if config.c_telemetry:
+        telemetry = seek_telemetry(clk, reset, state, telemetry_select, telemetry_data, config)
+        return axis, shared, telemetry
+    return axis, shared
 
 
+def multi_axis_controller(
+        clk,                # input, main clock
+        reset,              # input, main reset, active low
+        state_reset,        # input, one bit per axis, see mirror_box_controller
+        hall1_not,          # input, one bit per axis
+        hall2_not,          # input, one bit per axis
+        drive2pos1_manual,  # input, one bit per axis
+        drive2pos2_manual,  # input, one bit per axis
+        drive2pos1_PIO,     # input, one bit per axis
+        drive2pos2_PIO,     # input, one bit per axis
+        lock_manual_input,  # input, one bit per axis
+        stepper_direction,  # output, one bit per axis
+        stepper_steps,      # output, one bit per axis
+        config=None         # ControllerConfig of all axes, default: the module level constants
+):
+    # one mirror_box_axis per bit of the ports, the number of axes is their width. The axes share one instance of
+    # shared_generators, so per axis only the fsm, the seek counters or timeout_timer and the step output are added.
+    config = config or ControllerConfig()
+    if config.c_telemetry:
+        raise ValueError('seek_telemetry is only available in mirror_box_controller')
+    n_axes = len(stepper_steps)
 
+    # definition of internal signals
+    step_clock_slow = Signal(bool(0))
+    step_clock_fast = Signal(bool(0))
+    timebase_tick = Signal(bool(0))
+    states = [Signal(m_state.init) for i in range(n_axes)]
+    directions = [Signal(bool(c_direction_pos1)) for i in range(n_axes)]
+    steps = [Signal(bool(0)) for i in range(n_axes)]
+    # bit i of the outputs is axis i
+    directions_bus = ConcatSignal(*reversed(directions)) if n_axes > 1 else directions[0]
+    steps_bus = ConcatSignal(*reversed(steps)) if n_axes > 1 else steps[0]
 
+    shared = shared_generators(clk, reset, step_clock_slow, step_clock_fast, timebase_tick, config)
+    axes = [mirror_box_axis(clk, reset, state_reset(i), states[i], hall1_not(i), hall2_not(i), drive2pos1_manual(i),
+                            drive2pos2_manual(i), drive2pos1_PIO(i), drive2pos2_PIO(i), lock_manual_input(i),
+                            directions[i], steps[i], step_clock_slow, step_clock_fast, timebase_tick, config)
+            for i in range(n_axes)]
 
+    @always_comb
+    def outputs():
+        stepper_direction.next = directions_bus
+        stepper_steps.next = steps_bus
 
+    return shared, axes, outputs
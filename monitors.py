@@ -0,0 +1,326 @@
+import argparse
+import sys
+from time import time as wall_time
+from main import *
+from event_log import internal_signal
+from fast_model import c_clock_period
+from fsm_coverage import target_transitions
+from scenarios import scenarios, scenario_by_name
+
+# streaming assertion monitors for a simulation of mirror_box_controller
+#
+# Every monitor is a generator that watches a few signals of the dut and keeps nothing but the last values and times it
+# needs, so it costs the same on a run of a million clock cycles as on a short one and the run needs no trace. The
+# first violation raises MonitorError with the simulation time, which ends Simulation.run there. tb.testbench attaches
+# all of them with assertions=True.
+#
+# With their default seek counters the seeks of scenarios.py end after a few clock cycles, long before a second step,
+# so step_frequency has nothing to check in them. long_seek_scenario homes and moves to pos2 with the seek counters
+# (and timeout_timer) of long_seek_config, which give every seeking state several step periods. The run fails if
+# step_frequency did not check step periods at both speeds there, or if it does not fail at the right speed on the
+# same run when it expects other step rates than those of the dut, see wrong_rates. With --preempt long_preempt_scenario
+# turns such a move around, the run fails if reversal_stand_still did not check the turn.
+#
+#   python monitors.py [names] [--timer] [--preempt] [--ramp]    runs the scenarios with all monitors
+
+
+class MonitorError(AssertionError):
+
+    def __init__(self, t, monitor, message):
+        AssertionError.__init__(self, '%d ns: %s: %s' % (t, monitor, message))
+        self.time = t
+        self.monitor = monitor
+
+
+def legal_transitions(config=None):
+    # set of (state name, state name) the fsm may take without the asynchronous reset, which goes to init from anywhere
+    config = config or ControllerConfig()
+    transitions = set(target_transitions)
+    transitions.add(('undefined', 'init'))
+    if config.c_preempt_seek:
+        # see mirror_box_axis, a preempted seek goes to the fast state of the other position, which stops the stepper,
+        # waits a slow step period and turns around
+        for a, b in (('pos1', 'pos2'), ('pos2', 'pos1')):
+            transitions.add(('%s_seeking_fast' % a, '%s_seeking_fast' % b))
+            transitions.add(('%s_seeking_slow' % a, '%s_seeking_fast' % b))
+    return transitions
+
+
+def steps_quiet(dut, stepper_steps, config=None, clock_period=c_clock_period):
+    # no rising edge of stepper_steps while flag_stepper_enable is 0. step_generator_ramp lets its step clock run
+    # through the clock cycle after the stepper was disabled, so with it that cycle is allowed.
+    config = config or ControllerConfig()
+    enable = internal_signal(dut, 'flag_stepper_enable')
+    grace = clock_period if config.c_step_generator_ramp else 0
+
+    @instance
+    def monitor_steps_quiet():
+        disabled_since = now() if enable == 0 else None
+        steps_last = bool(stepper_steps)
+        while True:
+            yield stepper_steps, enable
+            t = now()
+            if enable == 0 and disabled_since is None:
+                disabled_since = t
+            elif enable == 1:
+                disabled_since = None
+            if stepper_steps and not steps_last and disabled_since is not None and t - disabled_since >= grace:
+                raise MonitorError(t, 'steps_quiet', 'step while the stepper is disabled since %d ns' % disabled_since)
+            steps_last = bool(stepper_steps)
+
+    return monitor_steps_quiet
+
+
+def step_period_range(config, speed):
+    # (shortest, longest) period of stepper_steps in clock cycles at flag_stepper_speed speed
+    if config.c_step_generator_ramp:
+        # the speed ramps between slow and cruise whatever the flag says
+        fastest = max(config.c_microsteps_per_seconds_cruise, config.c_microsteps_per_seconds_slow)
+        return config.c_clock_freq / float(fastest), config.c_clock_freq / float(config.c_microsteps_per_seconds_slow)
+    period = config.c_prescaler_fast if speed == c_speed_fast else config.c_prescaler_slow
+    return period, period
+
+
+def step_frequency(dut, stepper_steps, config=None, clock_period=c_clock_period, tolerance=0.02, checks=None):
+    # the time between two rising edges of stepper_steps while the stepper is enabled at the same speed is the period of
+    # c_microsteps_per_seconds_fast/slow (with step_generator_ramp anything between slow and cruise), give or take
+    # tolerance. The step clocks run freely, so a rising edge at the moment the stepper is enabled or changes speed
+    # does not start a period. checks, a dict, gets the number of checked periods by 'fast' and 'slow'.
+    config = config or ControllerConfig()
+    enable = internal_signal(dut, 'flag_stepper_enable')
+    speed = internal_signal(dut, 'flag_stepper_speed')
+    checks = checks if checks is not None else {}
+
+    @instance
+    def monitor_step_frequency():
+        segment_start = now()
+        last_step = None
+        steps_last = bool(stepper_steps)
+        enable_last, speed_last = bool(enable), bool(speed)
+        while True:
+            yield stepper_steps, enable, speed
+            t = now()
+            if bool(enable) != enable_last or bool(speed) != speed_last:
+                enable_last, speed_last = bool(enable), bool(speed)
+                segment_start = t
+                last_step = None
+            if stepper_steps and not steps_last and enable:
+                if last_step is not None:
+                    cycles = float(t - last_step) / clock_period
+                    shortest, longest = step_period_range(config, speed)
+                    speed_name = 'fast' if speed == c_speed_fast else 'slow'
+                    if cycles < shortest * (1 - tolerance) or cycles > longest * (1 + tolerance):
+                        raise MonitorError(t, 'step_frequency', 'step period of %g clock cycles at %s speed, expected '
+                                           '%g to %g' % (cycles, speed_name, shortest, longest))
+                    checks[speed_name] = checks.get(speed_name, 0) + 1
+                if t != segment_start:
+                    last_step = t
+            steps_last = bool(stepper_steps)
+
+    return monitor_step_frequency
+
+
+def direction_stable(dut, stepper_direction, stepper_steps):
+    # stepper_direction only changes while the stepper is disabled and stepper_steps is low
+    enable = internal_signal(dut, 'flag_stepper_enable')
+
+    @instance
+    def monitor_direction_stable():
+        while True:
+            yield stepper_direction
+            if enable or stepper_steps:
+                raise MonitorError(now(), 'direction_stable', 'stepper_direction changed to %d while %s' %
+                                   (stepper_direction, 'stepping' if enable else 'stepper_steps is high'))
+
+    return monitor_direction_stable
+
+
+def reversal_stand_still(state, stepper_direction, stepper_steps, config=None, clock_period=c_clock_period,
+                         checks=None):
+    # a change of stepper_direction while the state stays the same, the turn of a preempted seek, comes at least one
+    # slow step period after the last rising edge of stepper_steps. At the start of a move the state changes with it.
+    # checks, a dict, gets the number of checked turns as 'reversals'.
+    config = config or ControllerConfig()
+    checks = checks if checks is not None else {}
+    dwell = config.c_prescaler_slow * clock_period
+
+    @instance
+    def monitor_reversal_stand_still():
+        state_last, state_changed = str(state.val), now()
+        last_step = None
+        steps_last = bool(stepper_steps)
+        direction_last = int(stepper_direction)
+        while True:
+            yield state, stepper_direction, stepper_steps
+            t = now()
+            if str(state.val) != state_last:
+                state_last, state_changed = str(state.val), t
+            if stepper_steps and not steps_last:
+                last_step = t
+            steps_last = bool(stepper_steps)
+            if int(stepper_direction) != direction_last:
+                direction_last = int(stepper_direction)
+                if state_changed != t:
+                    if last_step is not None and t - last_step < dwell:
+                        raise MonitorError(t, 'reversal_stand_still', 'turned around in %s %d ns after the last step, '
+                                           'expected %d ns' % (state, t - last_step, dwell))
+                    checks['reversals'] = checks.get('reversals', 0) + 1
+
+    return monitor_reversal_stand_still
+
+
+def state_transitions(state, reset, config=None):
+    # every change of state is an edge of legal_transitions or goes to init while reset is asserted
+    legal = legal_transitions(config)
+
+    @instance
+    def monitor_state_transitions():
+        state_last = str(state.val)
+        while True:
+            yield state
+            current = str(state.val)
+            if (state_last, current) not in legal and not (current == 'init' and reset == reset.active):
+                raise MonitorError(now(), 'state_transitions', 'illegal transition %s -> %s' % (state_last, current))
+            state_last = current
+
+    return monitor_state_transitions
+
+
+def assertion_monitors(dut, reset, state, stepper_direction, stepper_steps, config=None, clock_period=c_clock_period,
+                       checks=None):
+    # all monitors above for one mirror_box_controller, checks see step_frequency and reversal_stand_still
+    return [steps_quiet(dut, stepper_steps, config, clock_period),
+            step_frequency(dut, stepper_steps, config, clock_period, checks=checks),
+            direction_stable(dut, stepper_direction, stepper_steps),
+            reversal_stand_still(state, stepper_direction, stepper_steps, config, clock_period, checks),
+            state_transitions(state, reset, config)]
+
+
+long_seek_steps = 4    # step periods of the fast phase of long_seek_config, its slow phases get twice as many
+
+
+def long_seek_config(config=None):
+    # config with seek counters and timeout_timer times that let every seeking state run for several step periods
+    config = config or ControllerConfig()
+    fast_cycles = (long_seek_steps + 1) * config.c_prescaler_fast
+    slow_cycles = 2 * long_seek_steps * config.c_prescaler_slow
+    fast_ms = fast_cycles * 1000.0 / config.c_clock_freq
+    slow_ms = slow_cycles * 1000.0 / config.c_clock_freq
+    values = config.as_dict()
+    values.update(c_home_seeking_slow_counter_maxvalue=slow_cycles, c_pos1_seeking_slow_counter_maxvalue=slow_cycles,
+                  c_pos2_seeking_slow_counter_maxvalue=slow_cycles, c_pos1_seeking_fast_counter_maxvalue=fast_cycles,
+                  c_pos2_seeking_fast_counter_maxvalue=fast_cycles, c_home_seeking_timeout_ms=slow_ms,
+                  c_pos1_seeking_fast_ms=fast_ms, c_pos1_seeking_timeout_ms=slow_ms, c_pos2_seeking_fast_ms=fast_ms,
+                  c_pos2_seeking_timeout_ms=slow_ms)
+    return ControllerConfig(**values)
+
+
+def long_seek_scenario(config):
+    # homing that takes long_seek_steps slow step periods, then a move to pos2 that reaches hall sensor 2 after the
+    # fast phase and long_seek_steps slow step periods, for a config of long_seek_config
+    slow_ns = config.c_prescaler_slow * c_clock_period
+    fast_ns = (long_seek_steps + 1) * config.c_prescaler_fast * c_clock_period
+    homed = 400 + long_seek_steps * slow_ns
+    command = homed + 10000
+    arrival = command + fast_ns + long_seek_steps * slow_ns
+    return {'name': 'long_seek',
+            'cycles': (arrival + 10000) / c_clock_period,
+            'events': [(homed, 'hall1_not', 0), (command, 'drive2pos2_PIO', 1), (command + 100, 'drive2pos2_PIO', 0),
+                       (command + 500, 'hall1_not', 1), (arrival, 'hall2_not', 0)],
+            'expect': {'final_state': 'pos2_resting', 'visits': ['pos2_seeking_fast', 'pos2_seeking_slow']}}
+
+
+def long_preempt_scenario(config):
+    # homing as in long_seek_scenario, then a move to pos2 that is preempted by target position 1 in the middle of its
+    # fast phase, the stepper stops, turns around and reaches hall sensor 1 again after long_seek_steps slow step
+    # periods, for a config of long_seek_config with c_preempt_seek
+    slow_ns = config.c_prescaler_slow * c_clock_period
+    fast_ns = (long_seek_steps + 1) * config.c_prescaler_fast * c_clock_period
+    homed = 400 + long_seek_steps * slow_ns
+    command = homed + 10000
+    preempt = command + fast_ns / 2
+    arrival = preempt + 2 * slow_ns + fast_ns + long_seek_steps * slow_ns
+    return {'name': 'long_preempt',
+            'cycles': (arrival + 10000) / c_clock_period,
+            'events': [(homed, 'hall1_not', 0), (command, 'drive2pos2_PIO', 1), (command + 100, 'drive2pos2_PIO', 0),
+                       (command + 500, 'hall1_not', 1), (preempt, 'drive2pos1_PIO', 1),
+                       (preempt + 100, 'drive2pos1_PIO', 0), (arrival, 'hall1_not', 0)],
+            'expect': {'final_state': 'pos1_resting', 'visits': ['pos2_seeking_fast', 'pos1_seeking_fast']}}
+
+
+def check_scenario(scenario, config=None, checks=None):
+    # runs the scenario with all monitors, returns the MonitorError of the first violation or None, checks see
+    # assertion_monitors
+    from tb import testbench
+    try:
+        Simulation(testbench(scenario, config=config, assertions=True, assertion_checks=checks)).run(quiet=1)
+    except MonitorError as e:
+        return e
+    return None
+
+
+# (step rates, factor) by speed that check_wrong_frequency makes step_frequency expect instead of those of the dut. With
+# step_generator_ramp a fast period may be anything between slow and cruise, so the fast rates are made lower, which
+# makes the periods of the ramp too short.
+wrong_rates = {'fast': (('c_microsteps_per_seconds_fast', 'c_microsteps_per_seconds_cruise'), 0.25),
+               'slow': (('c_microsteps_per_seconds_slow',), 1.25)}
+
+
+def check_wrong_frequency(config=None, speed='fast'):
+    # runs long_seek_scenario with a step_frequency that expects the wrong_rates of speed, returns its MonitorError,
+    # None means that the monitor missed the wrong step rates
+    from tb import testbench
+    config = long_seek_config(config)
+    values = config.as_dict()
+    names, factor = wrong_rates[speed]
+    for name in names:
+        values[name] = int(values[name] * factor)
+    tb = testbench(long_seek_scenario(config), config=config)
+    dut = tb[0]
+    try:
+        Simulation(tb, step_frequency(dut, internal_signal(dut, 'stepper_steps'), ControllerConfig(**values))).run(
+            quiet=1)
+    except MonitorError as e:
+        return e
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='runs scenarios of mirror_box_controller with the assertion monitors')
+    parser.add_argument('names', nargs='*', help='scenarios to run, default: all')
+    parser.add_argument('--timer', action='store_true', help='timeout_timer instead of the seek counters')
+    parser.add_argument('--preempt', action='store_true', help='c_preempt_seek')
+    parser.add_argument('--ramp', action='store_true', help='step_generator_ramp instead of the fixed prescalers')
+    args = parser.parse_args()
+    if args.timer and args.preempt:
+        parser.error('c_preempt_seek needs the seek counters, it cannot be combined with --timer')
+
+    config = ControllerConfig(c_timeout_timer=args.timer, c_preempt_seek=args.preempt,
+                              c_step_generator_ramp=args.ramp)
+    selected = [scenario_by_name[name] for name in args.names] if args.names else scenarios
+    seek_config = long_seek_config(config)
+    runs = [(scenario, config) for scenario in selected] + [(long_seek_scenario(seek_config), seek_config)]
+    if args.preempt:
+        runs.append((long_preempt_scenario(seek_config), seek_config))
+    failed = 0
+    for scenario, run_config in runs:
+        start = wall_time()
+        checks = {}
+        error = check_scenario(scenario, run_config, checks)
+        if error is None and scenario['name'] == 'long_seek' and not (checks.get('fast') and checks.get('slow')):
+            error = 'step_frequency checked no step period at %s speed' % (
+                'fast' if not checks.get('fast') else 'slow')
+        if error is None and scenario['name'] == 'long_preempt' and not checks.get('reversals'):
+            error = 'reversal_stand_still checked no turn of a preempted seek'
+        failed += error is not None
+        print '%-30s  %-4s  %7.2f s  %3d fast, %3d slow periods  %s' % (
+            scenario['name'], 'FAIL' if error else 'ok', wall_time() - start, checks.get('fast', 0),
+            checks.get('slow', 0), error or '')
+    for speed in ('fast', 'slow'):
+        start = wall_time()
+        error = check_wrong_frequency(config, speed)
+        caught = error is not None and 'at %s speed' % speed in str(error)
+        failed += not caught
+        print '%-30s  %-4s  %7.2f s  %s' % ('long_seek_wrong_%s_rate' % speed, 'ok' if caught else 'FAIL',
+                                            wall_time() - start, error or 'step_frequency missed the wrong step rate')
+    sys.exit(1 if failed else 0)
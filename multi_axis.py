@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import sys
+from time import time as wall_time
+from main import *
+from event_log import internal_signal
+from fast_model import c_clock_period, myhdl_trace
+from gen_verilog import controller_resources, multi_axis_ports, multi_axis_resources, to_verilog
+from scenarios import scenarios
+
+# multi_axis_controller: simulation with a growing number of axes, resource report and Verilog
+#
+# Axis i of the simulation gets the stimulus of scenarios[i % len(scenarios)] on bit i of the input ports. Its
+# state, stepper_direction and stepper_steps trace has to be the one of mirror_box_controller on the same stimulus.
+# The resource report compares the flip-flops of multi_axis_controller with those of as many mirror_box_controllers.
+#
+#   python multi_axis.py [--axes 1 2 4 8] [--cycles 2000] [--timer] [--verilog DIR] [--json multi_axis.json]
+
+
+def axis_trace(trace, state, stepper_direction, stepper_steps):
+    # recorder of the trace of one axis in the format of fast_model.myhdl_trace
+    @instance
+    def recorder():
+        trace.append((0, state.val, int(stepper_direction.val), int(stepper_steps.val)))
+        while True:
+            yield state, stepper_direction, stepper_steps
+            if trace[-1][0] == now():
+                trace.pop()
+            out = (state.val, int(stepper_direction.val), int(stepper_steps.val))
+            if not trace or trace[-1][1:] != out:
+                trace.append((now(),) + out)
+
+    return recorder
+
+
+def simulate(n_axes, stimuli, n_cycles, config):
+    # stimuli: one event list per axis, returns one trace per axis
+    ports = multi_axis_ports(n_axes)
+    clk, reset = ports[:2]
+    inputs = dict(zip(('state_reset', 'hall1_not', 'hall2_not', 'drive2pos1_manual', 'drive2pos2_manual',
+                       'drive2pos1_PIO', 'drive2pos2_PIO', 'lock_manual_input'), ports[2:10]))
+    traces = [[] for i in range(n_axes)]
+
+    def testbench():
+        dut = multi_axis_controller(*(ports + (config,)))
+        shared, axes, outputs = dut
+        recorders = [axis_trace(traces[i], internal_signal(axes[i], 'state'),
+                                internal_signal(axes[i], 'stepper_direction'),
+                                internal_signal(axes[i], 'stepper_steps')) for i in range(n_axes)]
+
+        @always(delay(c_clock_period / 2))
+        def clkgen():
+            clk.next = not clk
+
+        @instance
+        def stimulus():
+            events = sorted(((t, axis, name, value) for axis, axis_events in enumerate(stimuli)
+                             for t, name, value in axis_events), key=lambda e: e[0])
+            t = 0
+            for event_time, axis, name, value in events:
+                if event_time > t:
+                    yield delay(event_time - t)
+                    t = event_time
+                if name == 'reset':
+                    raise ValueError('the axes share reset')
+                inputs[name].next[axis] = bool(value)
+
+        return dut, recorders, clkgen, stimulus
+
+    Simulation(testbench()).run(n_cycles * c_clock_period, quiet=1)
+    return traces
+
+
+def run_scaling(axes_counts, n_cycles, config):
+    references = {}
+    results = []
+    for n_axes in axes_counts:
+        selected = [scenarios[i % len(scenarios)] for i in range(n_axes)]
+        stimuli = [[event for event in scenario['events'] if event[1] != 'reset'] for scenario in selected]
+        start = wall_time()
+        traces = simulate(n_axes, stimuli, n_cycles, config)
+        elapsed = wall_time() - start
+        mismatches = []
+        for scenario, events, trace in zip(selected, stimuli, traces):
+            if scenario['name'] not in references:
+                references[scenario['name']] = myhdl_trace(events, n_cycles, config)
+            if trace != references[scenario['name']]:
+                mismatches.append(scenario['name'])
+        shared, axes = multi_axis_resources(config, n_axes)
+        results.append({'axes': n_axes,
+                         'wall_time': elapsed,
+                         'cycles_per_second': n_cycles / elapsed,
+                         'axis_cycles_per_second': n_axes * n_cycles / elapsed,
+                         'mismatches': mismatches,
+                         'shared_ffs': sum(shared.values()),
+                         'axis_ffs': sum(sum(axis.values()) for axis in axes) / n_axes,
+                         'total_ffs': sum(shared.values()) + sum(sum(axis.values()) for axis in axes)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='multi_axis_controller simulation, resources and Verilog')
+    parser.add_argument('--axes', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of axes')
+    parser.add_argument('--cycles', type=int, default=2000, help='clock cycles to simulate')
+    parser.add_argument('--timer', action='store_true', help='timeout_timer instead of the seek counters')
+    parser.add_argument('--verilog', help='write the Verilog for the largest number of axes to this directory')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    config = ControllerConfig(c_timeout_timer=args.timer)
+    single = sum(controller_resources(config).values())
+    results = run_scaling(args.axes, args.cycles, config)
+    print '%4s  %10s  %10s  %10s  %7s  %7s  %7s  %9s  %s' % ('axes', 'wall s', 'cycles/s', 'axis cyc/s', 'shared',
+                                                               'axis', 'total', 'separate', 'traces')
+    for result in results:
+        print '%4d  %10.3f  %10.0f  %10.0f  %7d  %7d  %7d  %9d  %s' % (
+            result['axes'], result['wall_time'], result['cycles_per_second'], result['axis_cycles_per_second'],
+            result['shared_ffs'], result['axis_ffs'], result['total_ffs'], result['axes'] * single,
+            'differ: ' + ', '.join(result['mismatches']) if result['mismatches'] else 'equal')
+    if args.verilog:
+        if not os.path.isdir(args.verilog):
+            os.makedirs(args.verilog)
+        toVerilog.directory = args.verilog
+        toVerilog.no_testbench = True
+        try:
+            to_verilog(multi_axis_controller, *(multi_axis_ports(max(args.axes)) + (config,)))
+        except Exception as e:
+            print >>sys.stderr, 'conversion of multi_axis_controller failed: %s: %s' % (type(e).__name__,
+                                                                                       str(e).strip())
+            sys.exit(2)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': config.as_dict(), 'cycles': args.cycles, 'single_controller_ffs': single,
+                       'results': results}, f, indent=2)
+    sys.exit(1 if any(result['mismatches'] for result in results) else 0)
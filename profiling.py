@@ -0,0 +1,134 @@
+import argparse
+import gc
+import json
+from timeit import default_timer
+from myhdl import Simulation
+from myhdl._instance import _Instantiator
+from myhdl._Signal import _Signal
+from scenarios import scenario_tb, scenario_by_name
+
+# opt-in per generator profiling of MyHDL simulations
+#
+#   profiler = GeneratorProfiler()
+#   dut = profiler.instrument(mirror_box_controller(...))
+#
+# wraps every generator of the instance tree and records per generator:
+#   resumes      -- number of times the simulator resumed it, including the start
+#   total_time   -- wall time in s spent inside it
+#   allocations  -- net number of garbage collected objects (Signals, lists, ...) it left allocated
+#   signals      -- number of Signal objects it constructed, e.g. by assigning Signal(bool(1)) to .next
+#
+#   python profiling.py [scenario] [--json profile.json]
+
+
+class GeneratorStats(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.resumes = 0
+        self.total_time = 0.0
+        self.allocations = 0
+        self.signals = 0
+
+    def as_dict(self):
+        return {'name': self.name,
+                'resumes': self.resumes,
+                'total_time': self.total_time,
+                'mean_time': self.total_time / self.resumes if self.resumes else 0.0,
+                'allocations': self.allocations,
+                'signals': self.signals}
+
+
+class GeneratorProfiler(object):
+
+    def __init__(self):
+        self.stats = []
+        self.signal_count = [0]
+
+    def instrument(self, tree):
+        # wraps all generators in a (nested) tuple/list of instances in place and returns the tree
+        if isinstance(tree, (tuple, list)):
+            for item in tree:
+                self.instrument(item)
+        elif isinstance(tree, _Instantiator):
+            func = getattr(tree, 'func', None) or tree.genfunc
+            name = func.__name__
+            names = [stats.name for stats in self.stats]
+            if name in names:
+                name = '%s#%d' % (name, len([n for n in names if n.split('#')[0] == name]) + 1)
+            stats = GeneratorStats(name)
+            self.stats.append(stats)
+            tree.gen = self.profiled(tree.gen, stats)
+            tree.waiter = tree.waiter.__class__(tree.gen)
+        return tree
+
+    def profiled(self, gen, stats):
+        signal_count = self.signal_count
+        while True:
+            signals = signal_count[0]
+            allocations = gc.get_count()[0]
+            start = default_timer()
+            trigger = next(gen)
+            stats.total_time += default_timer() - start
+            stats.allocations += gc.get_count()[0] - allocations
+            stats.signals += signal_count[0] - signals
+            stats.resumes += 1
+            yield trigger
+
+    def run(self, sim, duration=None):
+        # runs the simulation with automatic garbage collection off (so the allocation counters are not reset) and
+        # Signal construction counted
+        signal_init = _Signal.__init__
+        signal_count = self.signal_count
+
+        def counting_init(self, *args, **kwargs):
+            signal_count[0] += 1
+            signal_init(self, *args, **kwargs)
+
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        _Signal.__init__ = counting_init
+        try:
+            sim.run(duration, quiet=1)
+        finally:
+            _Signal.__init__ = signal_init
+            if gc_enabled:
+                gc.enable()
+
+    def report(self):
+        return sorted((stats.as_dict() for stats in self.stats), key=lambda s: -s['total_time'])
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def print_report(self):
+        report = self.report()
+        total = sum(s['total_time'] for s in report) or 1.0
+        width = max(len(s['name']) for s in report)
+        print '%-*s  %9s  %10s  %9s  %6s  %11s  %9s' % (width, 'generator', 'resumes', 'total ms', 'mean us',
+                                                        'share', 'allocations', 'signals')
+        for s in report:
+            print '%-*s  %9d  %10.1f  %9.2f  %5.1f%%  %11d  %9d' % (
+                width, s['name'], s['resumes'], s['total_time'] * 1e3, s['mean_time'] * 1e6,
+                100 * s['total_time'] / total, s['allocations'], s['signals'])
+
+
+def profile_scenario(scenario=scenario_tb):
+    from tb import testbench
+    profiler = GeneratorProfiler()
+    sim = Simulation(testbench(scenario, profiler=profiler))
+    profiler.run(sim)
+    return profiler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='per generator profile of the tb.py simulation')
+    parser.add_argument('scenario', nargs='?', default=scenario_tb['name'])
+    parser.add_argument('--json', help='write the profile to this file')
+    args = parser.parse_args()
+
+    profiler = profile_scenario(scenario_by_name[args.scenario])
+    profiler.print_report()
+    if args.json:
+        profiler.write_json(args.json)
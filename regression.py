@@ -0,0 +1,167 @@
+import argparse
+import json
+import sys
+from multiprocessing import Pool, cpu_count
+from StringIO import StringIO
+from time import time as wall_time
+from main import *
+from scenarios import scenarios, scenario_by_name, prefixes
+
+# runs the scenarios of scenarios.py in a process pool and reports pass/fail and the final state of every scenario
+#
+#   python regression.py                  all scenarios on all cores
+#   python regression.py -j 4 tb homing   selected scenarios on 4 processes
+#   python regression.py --engine model   use the fast_model twin instead of the MyHDL simulation
+#   python regression.py --no-fork        simulate every scenario from time 0
+#   python regression.py --self-test      check that a scenario that raises is reported as failed
+#
+# Scenarios with a prefix are forked from a snapshot at the end of their prefix (see checkpoint.py). The prefixes are
+# simulated once in this process and their snapshots are sent to the workers along with the scenarios. The report
+# estimates the simulation time saved as the time of every prefix times the number of scenarios forked from it, less
+# the time of taking the snapshots.
+
+
+def visited_states(transitions):
+    states = []
+    for t, state in transitions:
+        if not states or states[-1] != str(state):
+            states.append(str(state))
+    return states
+
+
+def simulate_myhdl(scenario):
+    from tb import testbench
+    from event_log import EventLog
+    log = EventLog()
+    sim = Simulation(testbench(scenario, log))
+    sim.run(quiet=1)
+    return log.events('state')
+
+
+def simulate_model(scenario):
+    from fast_model import simulate
+    return [(t, state) for t, state, direction, steps in simulate(scenario['events'], scenario['cycles'])]
+
+
+engines = {'myhdl': simulate_myhdl, 'model': simulate_model}
+
+
+def run_scenario(args):
+    scenario, engine, snapshot = args
+    prefix = scenario.get('prefix') if snapshot is not None else None
+    start = wall_time()
+    try:
+        if snapshot is not None:
+            from checkpoint import fork
+            transitions = fork(snapshot, scenario)
+        else:
+            transitions = engines[engine](scenario)
+    except Exception as e:
+        return {'name': scenario['name'], 'passed': False, 'failures': ['%s: %s' % (type(e).__name__, e)],
+                'final_state': None, 'states': [], 'wall_time': wall_time() - start, 'prefix': prefix}
+    states = visited_states(transitions)
+    expect = scenario.get('expect', {})
+    failures = []
+    if 'final_state' in expect and states[-1] != expect['final_state']:
+        failures.append('final state %s, expected %s' % (states[-1], expect['final_state']))
+    for name in expect.get('visits', []):
+        if name not in states:
+            failures.append('state %s not visited' % name)
+    return {'name': scenario['name'], 'passed': not failures, 'failures': failures, 'final_state': states[-1],
+            'states': states, 'wall_time': wall_time() - start, 'prefix': prefix}
+
+
+def take_snapshots(selected, engine):
+    # {prefix name: snapshot} for the prefixes of the selected scenarios
+    from checkpoint import take_snapshot
+    names = set(scenario['prefix'] for scenario in selected if 'prefix' in scenario)
+    snapshots = {}
+    for name in names:
+        start = wall_time()
+        snapshots[name] = take_snapshot(prefixes[name], engine)
+        snapshots[name]['wall_time'] = wall_time() - start
+    return snapshots
+
+
+def run_regression(selected, engine='myhdl', processes=None, fork=True):
+    snapshots = take_snapshots(selected, engine) if fork else {}
+    pool = Pool(processes or cpu_count())
+    try:
+        # longest scenarios first so that they do not end up as the tail of the run
+        jobs = sorted(selected, key=lambda scenario: -scenario['cycles'])
+        results = dict((result['name'], result) for result in
+                       pool.imap_unordered(run_scenario, [(scenario, engine, snapshots.get(scenario.get('prefix')))
+                                                          for scenario in jobs]))
+    finally:
+        pool.close()
+        pool.join()
+    return [results[scenario['name']] for scenario in selected], snapshots
+
+
+def fork_savings(results, snapshots):
+    # (forked scenarios, prefix cycles not simulated again, estimated seconds saved)
+    forked = [result for result in results if result.get('prefix')]
+    cycles = sum(snapshots[result['prefix']]['cycles'] for result in forked)
+    saved = sum(snapshots[result['prefix']]['wall_time'] for result in forked)
+    return len(forked), cycles, saved - sum(snapshot['wall_time'] for snapshot in snapshots.values())
+
+
+def check_raising_scenario(engine='myhdl', processes=None):
+    # runs a scenario forked from homed together with one whose stimulus makes the simulation raise and checks that
+    # the broken one is reported as failed, while the report and the fork savings still come out
+    broken = {'name': 'broken', 'cycles': 20, 'prefix': 'homed',
+              'events': prefixes['homed']['events'] + [(1500, 'hall1_not')]}     # an event without a value
+    results, snapshots = run_regression([scenario_by_name['drive2pos2_PIO'], broken], engine, processes)
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        print_report(results, 0)
+        forked, cycles, saved = fork_savings(results, snapshots)
+        report = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    assert [result['passed'] for result in results] == [True, False], results
+    assert results[1]['final_state'] is None, results[1]    # the simulation raised
+    assert 'broken' in report and 'FAIL' in report and '2 scenarios, 1 failed' in report, report
+    assert forked == 2, forked
+
+
+def print_report(results, elapsed):
+    width = max(len(result['name']) for result in results)
+    for result in results:
+        print '%-*s  %-4s  %7.2f s  %s' % (width, result['name'], 'PASS' if result['passed'] else 'FAIL',
+                                            result['wall_time'], result['final_state'])
+        for failure in result['failures']:
+            print '%*s  %s' % (width, '', failure)
+    failed = len([result for result in results if not result['passed']])
+    print '%d scenarios, %d failed, %.2f s wall time, %.2f s simulation time' % (
+        len(results), failed, elapsed, sum(result['wall_time'] for result in results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='parallel scenario regression for mirror_box_controller')
+    parser.add_argument('names', nargs='*', help='scenarios to run, default: all')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes, default: all cores')
+    parser.add_argument('--engine', choices=sorted(engines), default='myhdl')
+    parser.add_argument('--no-fork', action='store_true', help='do not fork scenarios from snapshots of prefixes')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--self-test', action='store_true', help='check the report of a scenario that raises')
+    args = parser.parse_args()
+
+    if args.self_test:
+        check_raising_scenario(args.engine, args.processes)
+        print 'a raising scenario is reported as failed'
+        sys.exit(0)
+
+    selected = [scenario_by_name[name] for name in args.names] if args.names else scenarios
+    start = wall_time()
+    results, snapshots = run_regression(selected, args.engine, args.processes, not args.no_fork)
+    elapsed = wall_time() - start
+    print_report(results, elapsed)
+    if snapshots:
+        forked, cycles, saved = fork_savings(results, snapshots)
+        print '%d scenarios forked from %d prefixes, %d prefix cycles not simulated again, about %.2f s saved' % (
+            forked, len(snapshots), cycles, saved)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'engine': args.engine, 'wall_time': elapsed, 'results': results}, f, indent=2)
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
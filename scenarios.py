@@ -0,0 +1,133 @@
+# stimulus scenarios for tb.py, fast_model and the regression runner
+#
+# events:  (time in ns, input name, value), inputs not mentioned keep their initial value from tb.py
+# cycles:  number of rising clock edges to simulate
+# expect:  final_state -- state of the fsm after the last clock edge
+#          visits      -- states that have to show up at least once during the run
+# prefix:  name of an entry of prefixes whose events the scenario starts with, the regression simulates the prefix
+#          once and forks the scenario from a snapshot at its end, see checkpoint.py
+
+
+def shuttle_events(switches, period=200, start=2000):
+    # homing, then switches drive2pos2_PIO/drive2pos1_PIO commands every period clock cycles from start ns on. The hall
+    # sensor that is left goes inactive 500 ns after the command and the one of the target active 1500 ns after it.
+    events = [(400, 'hall1_not', 0)]
+    for k in range(switches):
+        t = start + k * period * 100
+        if k % 2 == 0:
+            drive, leave, arrive = 'drive2pos2_PIO', 'hall1_not', 'hall2_not'
+        else:
+            drive, leave, arrive = 'drive2pos1_PIO', 'hall2_not', 'hall1_not'
+        events += [(t, drive, 1), (t + 100, drive, 0), (t + 500, leave, 1), (t + 1500, arrive, 0)]
+    return events
+
+
+# common beginnings of scenarios, cycles is the number of clock edges after which the snapshot is taken. shuttled
+# moves the mirror back and forth 21 times and ends in pos2_resting, the scenarios forked from it skip 4100 cycles.
+prefixes = {
+    'homed': {'name': 'homed',
+              'cycles': 10,
+              'events': [(400, 'hall1_not', 0)]},
+    'shuttled': {'name': 'shuttled',
+                 'cycles': 4100,
+                 'events': shuttle_events(21)},
+}
+
+scenario_tb = {
+    'name': 'tb',
+    'prefix': 'homed',
+    'cycles': 5000,
+    'events': [(400, 'hall1_not', 0), (1300, 'hall1_not', 1), (13000, 'hall1_not', 0), (14000, 'hall1_not', 1),
+               (19500, 'hall1_not', 0),
+               (4000, 'hall2_not', 0), (6000, 'hall2_not', 1), (16000, 'hall2_not', 0),
+               (9000, 'state_reset', 1), (10000, 'state_reset', 0), (12000, 'state_reset', 1),
+               (13000, 'state_reset', 0),
+               (1000, 'drive2pos2_manual', 1), (1100, 'drive2pos2_manual', 0),
+               (13500, 'drive2pos2_PIO', 1), (14000, 'drive2pos2_PIO', 0),
+               (17000, 'drive2pos1_manual', 1), (18000, 'drive2pos1_manual', 0)],
+    'expect': {'final_state': 'pos1_resting',
+               'visits': ['seek_home', 'pos1_resting', 'pos2_seeking_fast', 'pos2_seeking_slow', 'pos2_seeking_timeout',
+                          'seek_home_timeout', 'pos2_resting', 'pos1_seeking_fast', 'pos1_seeking_slow']},
+}
+
+scenarios = [
+    scenario_tb,
+    {'name': 'homing',
+     'prefix': 'homed',
+     'cycles': 100,
+     'events': [(400, 'hall1_not', 0)],
+     'expect': {'final_state': 'pos1_resting', 'visits': ['seek_home']}},
+    {'name': 'homing_timeout',
+     'cycles': 100,
+     'events': [],
+     'expect': {'final_state': 'seek_home_timeout', 'visits': ['seek_home']}},
+    {'name': 'homing_timeout_state_reset',
+     'cycles': 100,
+     'events': [(3000, 'state_reset', 1), (3200, 'state_reset', 0), (3500, 'hall1_not', 0)],
+     'expect': {'final_state': 'pos1_resting', 'visits': ['seek_home_timeout', 'init', 'seek_home']}},
+    {'name': 'drive2pos2_PIO',
+     'prefix': 'homed',
+     'cycles': 100,
+     'events': [(400, 'hall1_not', 0), (1000, 'drive2pos2_PIO', 1), (1100, 'drive2pos2_PIO', 0),
+                (1500, 'hall1_not', 1), (3000, 'hall2_not', 0)],
+     'expect': {'final_state': 'pos2_resting', 'visits': ['pos1_resting', 'pos2_seeking_fast', 'pos2_seeking_slow']}},
+    {'name': 'drive2pos2_manual_and_back',
+     'prefix': 'homed',
+     'cycles': 120,
+     'events': [(400, 'hall1_not', 0), (1000, 'drive2pos2_manual', 1), (1100, 'drive2pos2_manual', 0),
+                (1500, 'hall1_not', 1), (3000, 'hall2_not', 0),
+                (5000, 'drive2pos1_manual', 1), (5100, 'drive2pos1_manual', 0),
+                (5500, 'hall2_not', 1), (7000, 'hall1_not', 0)],
+     'expect': {'final_state': 'pos1_resting',
+                'visits': ['pos2_resting', 'pos1_seeking_fast', 'pos1_seeking_slow']}},
+    {'name': 'pos2_seeking_timeout',
+     'prefix': 'homed',
+     'cycles': 100,
+     'events': [(400, 'hall1_not', 0), (1000, 'drive2pos2_PIO', 1), (1100, 'drive2pos2_PIO', 0),
+                (1500, 'hall1_not', 1)],
+     'expect': {'final_state': 'pos2_seeking_timeout', 'visits': ['pos2_seeking_slow']}},
+    {'name': 'pos1_seeking_timeout',
+     'prefix': 'homed',
+     'cycles': 120,
+     'events': [(400, 'hall1_not', 0), (1000, 'drive2pos2_PIO', 1), (1100, 'drive2pos2_PIO', 0),
+                (1500, 'hall1_not', 1), (3000, 'hall2_not', 0),
+                (5000, 'drive2pos1_PIO', 1), (5100, 'drive2pos1_PIO', 0), (5500, 'hall2_not', 1)],
+     'expect': {'final_state': 'pos1_seeking_timeout', 'visits': ['pos2_resting', 'pos1_seeking_slow']}},
+    {'name': 'pos1_resting_error',
+     'prefix': 'homed',
+     'cycles': 100,
+     'events': [(400, 'hall1_not', 0), (2000, 'hall1_not', 1)],
+     'expect': {'final_state': 'pos1_resting_error', 'visits': ['pos1_resting']}},
+    {'name': 'pos2_resting_error',
+     'prefix': 'homed',
+     'cycles': 100,
+     'events': [(400, 'hall1_not', 0), (1000, 'drive2pos2_PIO', 1), (1100, 'drive2pos2_PIO', 0),
+                (1500, 'hall1_not', 1), (3000, 'hall2_not', 0), (5000, 'hall2_not', 1)],
+     'expect': {'final_state': 'pos2_resting_error', 'visits': ['pos2_resting']}},
+    {'name': 'reset',
+     'prefix': 'homed',
+     'cycles': 100,
+     'events': [(400, 'hall1_not', 0), (1000, 'drive2pos2_PIO', 1), (1100, 'drive2pos2_PIO', 0),
+                (1500, 'hall1_not', 1), (3000, 'hall2_not', 0),
+                (5020, 'reset', 0), (5200, 'reset', 1), (5300, 'hall2_not', 1), (6000, 'hall1_not', 0)],
+     'expect': {'final_state': 'pos1_resting', 'visits': ['pos2_resting', 'init', 'seek_home']}},
+    {'name': 'shuttled_drive2pos1',
+     'prefix': 'shuttled',
+     'cycles': 4300,
+     'events': shuttle_events(21) + [(420000, 'drive2pos1_PIO', 1), (420100, 'drive2pos1_PIO', 0),
+                                     (420500, 'hall2_not', 1), (421500, 'hall1_not', 0)],
+     'expect': {'final_state': 'pos1_resting', 'visits': ['pos2_resting', 'pos1_seeking_fast', 'pos1_seeking_slow']}},
+    {'name': 'shuttled_pos1_seeking_timeout',
+     'prefix': 'shuttled',
+     'cycles': 4300,
+     'events': shuttle_events(21) + [(420000, 'drive2pos1_PIO', 1), (420100, 'drive2pos1_PIO', 0),
+                                     (420500, 'hall2_not', 1)],
+     'expect': {'final_state': 'pos1_seeking_timeout', 'visits': ['pos2_resting', 'pos1_seeking_slow']}},
+    {'name': 'shuttled_pos2_resting_error',
+     'prefix': 'shuttled',
+     'cycles': 4300,
+     'events': shuttle_events(21) + [(420000, 'hall2_not', 1)],
+     'expect': {'final_state': 'pos2_resting_error', 'visits': ['pos2_resting']}},
+]
+
+scenario_by_name = dict((scenario['name'], scenario) for scenario in scenarios)
@@ -1,6 +1,36 @@
+import sys
 from main import *
-
-def testbench():
+from scenarios import scenario_tb, scenarios
+from event_log import EventLog, event_logger
+from fast_model import c_clock_period
+import telemetry
+
+
+def stim(name, sig, waveform):
+    # drives sig with the (time, value) pairs of waveform, the generator is called stim_<name>
+    def stim_signal():
+        t = 0
+        for event_time, value in waveform:
+            if event_time > t:
+                yield delay(event_time - t)
+                t = event_time
+            sig.next = bool(value)
+    stim_signal.__name__ = 'stim_' + name
+    return instance(stim_signal)
+
+
+def testbench(scenario=scenario_tb, event_log=None, profiler=None, snapshot=None, config=None, telemetry_words=None,
+              assertions=False, assertion_checks=None):
+    # scenario: see scenarios.py
+    # event_log: event_log.EventLog that records state transitions, stepper and command changes
+    # profiler: profiling.GeneratorProfiler that gets all generators of the dut and the testbench instrumented
+    # snapshot: signal values of checkpoint.take_snapshot the dut starts with instead of the initial values
+    # config: ControllerConfig of the dut, default: the module level constants
+    # telemetry_words: list that gets the words of seek_telemetry read over the PIO readout after the last clock
+    #                  cycle, needs c_telemetry in config
+    # assertions: True attaches the streaming monitors of monitors.py, the first violation raises MonitorError
+    # assertion_checks: dict that gets the number of step periods monitors.step_frequency checked by speed
+    config = config or ControllerConfig()
     clk = Signal(bool(0))
     reset = ResetSignal(1, active=0, async=True)
     state_reset = Signal(bool(0))
@@ -14,88 +44,88 @@ def testbench():
     lock_manual_input = Signal(bool(0))
     stepper_direction = Signal(bool(c_direction_pos1))
     stepper_steps = Signal(bool(0))
+    telemetry_select = Signal(intbv(0)[telemetry_select_width:])
+    telemetry_data = Signal(intbv(0)[config.c_telemetry_width:])
+    read_telemetry = telemetry_words is not None
+    words = telemetry_words if read_telemetry else []
 
     dut = mirror_box_controller(clk, reset, state_reset, state, hall1_not, hall2_not, drive2pos1_manual,
                                 drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO, lock_manual_input, stepper_direction,
-                                stepper_steps)
-
-
-
-    @always(delay(50))
+                                stepper_steps, config,
+                                *((telemetry_select, telemetry_data) if config.c_telemetry else ()))
+    if snapshot is not None:
+        from checkpoint import restore_signals
+        restore_signals(dut, snapshot)
+
+    inputs = {'reset': reset, 'state_reset': state_reset, 'hall1_not': hall1_not, 'hall2_not': hall2_not,
+              'drive2pos1_manual': drive2pos1_manual, 'drive2pos2_manual': drive2pos2_manual,
+              'drive2pos1_PIO': drive2pos1_PIO, 'drive2pos2_PIO': drive2pos2_PIO,
+              'lock_manual_input': lock_manual_input}
+
+    @always(delay(c_clock_period / 2))
     def clkgen():
         clk.next = not clk
 
     @instance
     def stimulus_clock():
-        for i in range(5000):
+        for i in range(scenario['cycles']):
             yield clk.posedge
+        if read_telemetry:
+            for address in range(len(telemetry_names)):
+                telemetry_select.next = address
+                yield clk.negedge
+                words.append(int(telemetry_data))
         raise StopSimulation
 
-    @instance
-    def stim_hall1_not():
-        yield delay(400)
-        hall1_not.next = Signal(bool(0))
-        yield delay(900)
-        hall1_not.next = Signal(bool(1))
-        yield delay(11700)
-        hall1_not.next = Signal(bool(0))
-        yield delay(1000)
-        hall1_not.next = Signal(bool(1))
-        yield delay(5500)
-        hall1_not.next = Signal(bool(0))
-
-    @instance
-    def stim_hall2_not():
-        yield delay(4000)
-        hall2_not.next = Signal(bool(0))
-        yield delay(2000)
-        hall2_not.next = Signal(bool(1))
-        yield delay(10000)
-        hall2_not.next = Signal(bool(0))
-
-    @instance
-    def stim_state_reset():
-        yield delay(9000)
-        state_reset.next = Signal(bool(1))
-        yield delay(1000)
-        state_reset.next = Signal(bool(0))
-        yield delay(2000)
-        state_reset.next = Signal(bool(1))
-        yield delay(1000)
-        state_reset.next = Signal(bool(0))
-
-    @instance
-    def stim_drive2pos2_man():
-        yield delay(1000)
-        drive2pos2_manual.next = Signal(bool(1))
-        yield delay(100)
-        drive2pos2_manual.next = Signal(bool(0))
-
-    @instance
-    def stim_drive2pos2_PIO():
-        yield delay(13500)
-        drive2pos2_PIO.next = Signal(bool(1))
-        yield delay(500)
-        drive2pos2_PIO.next = Signal(bool(0))
-
-    @instance
-    def stim_drive2pos1_man():
-        yield delay(17000)
-        drive2pos1_manual.next = Signal(bool(1))
-        yield delay(1000)
-        drive2pos1_manual.next = Signal(bool(0))
-
-    @always_seq(clk.posedge, reset=reset)
-    def output_printer():
-        print now(), state
-
-    #return dut, clkgen, stimulus, output_printer
-    return dut, clkgen, stimulus_clock, stim_hall1_not, stim_hall2_not, output_printer, stim_drive2pos2_man,\
-        stim_state_reset, stim_drive2pos2_PIO, stim_drive2pos1_man
-
-
-tb_fsm = traceSignals(testbench)
-sim = Simulation(tb_fsm)
-sim.run()
-
-
+    waveforms = {}
+    for event_time, name, value in sorted(scenario['events'], key=lambda e: e[0]):
+        waveforms.setdefault(name, []).append((event_time, value))
+    stimuli = [stim(name, inputs[name], waveform) for name, waveform in sorted(waveforms.items())]
+
+    monitors = []
+    if event_log is not None:
+        monitors.append(event_logger(event_log, dut, state, stepper_direction,
+                                     (drive2pos1_manual, drive2pos2_manual, drive2pos1_PIO, drive2pos2_PIO)))
+    if assertions:
+        from monitors import assertion_monitors
+        monitors.extend(assertion_monitors(dut, reset, state, stepper_direction, stepper_steps, config,
+                                           checks=assertion_checks))
+
+    if profiler is not None:
+        profiler.instrument((dut, clkgen, stimulus_clock, stimuli, monitors))
+
+    return dut, clkgen, stimulus_clock, stimuli, monitors
+
+
+def check_telemetry(scenario=scenario_tb, config=None):
+    # runs the scenario with seek_telemetry, returns (decoded words, mismatches with the state transitions)
+    config = config or ControllerConfig(c_telemetry=True)
+    log = EventLog()
+    words = []
+    Simulation(testbench(scenario, log, config=config, telemetry_words=words)).run(quiet=1)
+    # the words are cleared by reset and transitions during the readout are not in them
+    start_time = max([t for t, name, value in scenario['events'] if name == 'reset' and not value] or [0])
+    end_time = scenario['cycles'] * c_clock_period
+    transitions = [(t, name) for t, name in log.events('state') if start_time <= t < end_time]
+    return telemetry.decode(words, config), telemetry.mismatches(words, transitions, config)
+
+
+if __name__ == '__main__':
+    log = EventLog()
+    tb_fsm = traceSignals(testbench, scenario_tb, log)
+    sim = Simulation(tb_fsm)
+    sim.run()
+    log.finish(now())
+    log.write_csv('testbench_events.csv')
+    for t, name in log.events('state'):
+        print t, name
+    for name, duration in sorted(log.time_in_state().items(), key=lambda item: -item[1]):
+        print '%-22s %8d ns' % (name, duration)
+
+    failed = 0
+    for scenario in scenarios:
+        decoded, mismatches = check_telemetry(scenario)
+        failed += bool(mismatches)
+        print 'telemetry %-30s %s' % (scenario['name'], '; '.join(mismatches) or 'ok')
+    print 'pos2 telemetry of %s: %s' % (scenario_tb['name'], check_telemetry()[0]['pos2'])
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,64 @@
+from main import *
+
+# decoding of the words of seek_telemetry (c_telemetry), read one address after the other over telemetry_select and
+# telemetry_data, and the values they should have after a simulation
+#
+#   decode(words, config)                   {'pos1': {'fast_last_ms': ..., 'timeouts': ...}, 'pos2': {...},
+#                                            'home': {'timeouts': ...}}
+#   mismatches(words, transitions, config)  descriptions of the words that do not fit the state transitions
+#                                           [(time in ns, state name), ...] of the same simulation
+
+
+def decode(words, config):
+    # words: the words in the order of telemetry_names, durations are converted from clock cycles to ms
+    ms = 1000.0 / config.c_clock_freq
+    result = {}
+    for name, word in zip(telemetry_names, words):
+        position, quantity = name.split('_', 1)
+        if quantity == 'timeouts':
+            result.setdefault(position, {})[quantity] = int(word)
+        else:
+            result.setdefault(position, {})[quantity + '_ms'] = int(word) * ms
+    return result
+
+
+def expected_words(transitions, config):
+    # {name: value} from the state transitions, durations in clock cycles and not rounded
+    cycle = 1e9 / config.c_clock_freq
+    word_max = 2 ** config.c_telemetry_width - 1
+    words = dict((name, 0) for name in telemetry_names)
+    seek_start = None
+    for (t, state), (next_t, next_state) in zip(transitions, transitions[1:]):
+        if state == next_state:
+            continue
+        if next_state == 'seek_home_timeout':
+            words['home_timeouts'] = min(words['home_timeouts'] + 1, word_max)
+        for position in ('pos1', 'pos2'):
+            seeking = (position + '_seeking_fast', position + '_seeking_slow')
+            if state in seeking:
+                phase = 'fast' if state == seeking[0] else 'slow'
+                duration = min((next_t - t) / cycle, word_max)
+                words[position + '_' + phase + '_last'] = duration
+                words[position + '_' + phase + '_max'] = max(words[position + '_' + phase + '_max'], duration)
+            if next_state == position + '_resting' and state == seeking[1]:
+                duration = min((next_t - seek_start) / cycle, word_max)
+                words[position + '_total_last'] = duration
+                words[position + '_total_max'] = max(words[position + '_total_max'], duration)
+            if next_state == position + '_seeking_timeout':
+                words[position + '_timeouts'] = min(words[position + '_timeouts'] + 1, word_max)
+            if next_state in seeking and state not in seeking:
+                seek_start = next_t
+    return words
+
+
+def mismatches(words, transitions, config):
+    # durations may differ by one clock cycle
+    expected = expected_words(transitions, config)
+    result = []
+    for name, word in zip(telemetry_names, words):
+        if name.endswith('_timeouts'):
+            if word != expected[name]:
+                result.append('%s is %d, expected %d' % (name, word, expected[name]))
+        elif abs(word - expected[name]) > 1:
+            result.append('%s is %d clock cycles, expected %.1f' % (name, word, expected[name]))
+    return result
@@ -0,0 +1,284 @@
+import argparse
+import gzip
+import json
+from collections import deque
+from myhdl import Simulation, instance, now
+from myhdl._extractHierarchy import _HierExtr
+from myhdl._enum import EnumItemType
+
+# compact alternative to traceSignals: a gzip compressed binary change log of selected signals
+#
+# Only allowlisted signals are recorded, fast toggling signals like step_clock_fast can be decimated to every Nth
+# period (two changes, both of which are logged, so a decimated clock still toggles in the log) and the log is written
+# while the simulation runs. In ring buffer mode only the changes of the last N clock
+# cycles are kept in memory and written out whenever the fsm enters an error state.
+#
+# file format: 'MBCL1\n', one line of json with the signal table, then a sequence of varint encoded records:
+#   0, time, value of every signal                   start of a segment (a snapshot of all signals)
+#   signal index + 1, time since last record, value  change of one signal
+#
+#   python trace_log.py run out.mbcl [--signals state stepper_steps ...] [--decimate step_clock_fast=100]
+#                                    [--ring 2000] [--scenario tb]
+#   python trace_log.py vcd out.mbcl out.vcd
+
+magic = 'MBCL1\n'
+default_signals = ('state', 'stepper_direction', 'stepper_steps', 'hall1_not', 'hall2_not', 'drive2pos1_manual',
+                   'drive2pos2_manual', 'drive2pos1_PIO', 'drive2pos2_PIO', 'state_reset', 'step_clock_slow',
+                   'step_clock_fast')
+error_state_suffixes = ('_timeout', '_resting_error')
+flush_size = 1 << 16
+
+
+def encode_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_value(value):
+    # zigzag, so that negative values stay short
+    return (value << 1) ^ (value >> 63) if value < 0 else value << 1
+
+
+def decode_value(code):
+    return (code >> 1) ^ -(code & 1)
+
+
+def signal_code(sig):
+    # the value of a signal as an integer, enum items by their index
+    val = sig.val
+    if isinstance(val, EnumItemType):
+        return val._index
+    return int(val)
+
+
+def signal_info(name, sig):
+    val = sig.val
+    if isinstance(val, EnumItemType):
+        return {'name': name, 'width': val._nrbits, 'enum': list(val._type._names)}
+    return {'name': name, 'width': len(sig) if len(sig) else 32, 'enum': None}
+
+
+class ChangeLogWriter(object):
+
+    def __init__(self, filename, infos, clock_period=100, ring_cycles=None, error_signal='state'):
+        self.file = gzip.open(filename, 'wb')
+        self.file.write(magic)
+        self.file.write(json.dumps({'signals': infos, 'clock_period': clock_period}) + '\n')
+        self.infos = infos
+        self.buffer = bytearray()
+        self.last_time = 0
+        self.window = ring_cycles * clock_period if ring_cycles else None
+        self.ring = deque()
+        self.error_index = [info['name'] for info in infos].index(error_signal) if ring_cycles else None
+        self.error_codes = set()
+        if ring_cycles:
+            names = infos[self.error_index]['enum']
+            self.error_codes = set(k for k, name in enumerate(names) if name.endswith(error_state_suffixes))
+        self.segments = 0
+
+    def start(self, t, values):
+        self.values = list(values)
+        self.window_time = t
+        self.window_values = list(values)
+        if self.window is None:
+            self.write_segment(t, values, ())
+
+    def write_segment(self, t, values, changes):
+        buf = self.buffer
+        buf.append(0)
+        encode_varint(buf, t)
+        for value in values:
+            encode_varint(buf, encode_value(value))
+        last_time = t
+        for change_time, index, value in changes:
+            encode_varint(buf, index + 1)
+            encode_varint(buf, change_time - last_time)
+            encode_varint(buf, encode_value(value))
+            last_time = change_time
+        self.last_time = last_time
+        self.segments += 1
+        self.flush_buffer()
+
+    def change(self, t, index, value):
+        if self.window is None:
+            buf = self.buffer
+            encode_varint(buf, index + 1)
+            encode_varint(buf, t - self.last_time)
+            encode_varint(buf, encode_value(value))
+            self.last_time = t
+            if len(buf) >= flush_size:
+                self.flush_buffer()
+        else:
+            ring = self.ring
+            ring.append((t, index, value))
+            while ring[0][0] < t - self.window:
+                old_time, old_index, old_value = ring.popleft()
+                self.window_values[old_index] = old_value
+                self.window_time = old_time
+            if index == self.error_index and value in self.error_codes and self.values[index] not in self.error_codes:
+                self.write_segment(self.window_time, self.window_values, ring)
+                self.window_values = list(self.values)
+                self.window_values[index] = value
+                self.window_time = t
+                ring.clear()
+        self.values[index] = value
+
+    def flush_buffer(self):
+        self.file.write(bytes(self.buffer))
+        del self.buffer[:]
+
+    def close(self):
+        self.flush_buffer()
+        self.file.close()
+
+
+def collect_signals(hierarchy):
+    # name -> signal of all signals in an extracted hierarchy, signals of the top level first, the name of a signal
+    # of a sub instance gets the instance name as prefix if it is already taken
+    signals = {}
+    seen = set()
+    for inst in hierarchy:
+        for name, sig in sorted(inst.sigdict.items()):
+            if id(sig) in seen:
+                continue
+            seen.add(id(sig))
+            if name in signals:
+                name = '%s.%s' % (inst.name, name)
+            signals[name] = sig
+    return signals
+
+
+def trace_changes(func, filename, args=(), kwargs=None, allowlist=default_signals, decimate=None, ring_cycles=None,
+                  clock_period=100):
+    # like traceSignals: elaborates func(*args, **kwargs) and returns its instances together with a generator that
+    # writes the change log, and the writer that has to be closed after the simulation. decimate maps signal names to
+    # N, of those only the two changes of every Nth period are logged.
+    h = _HierExtr(func.__name__, func, *args, **(kwargs or {}))
+    available = collect_signals(h.hierarchy)
+    names = [name for name in allowlist if name in available]
+    missing = [name for name in allowlist if name not in available]
+    if missing:
+        raise ValueError('unknown signals: %s' % ', '.join(missing))
+    sigs = [available[name] for name in names]
+    writer = ChangeLogWriter(filename, [signal_info(name, sig) for name, sig in zip(names, sigs)], clock_period,
+                             ring_cycles)
+    decimation = [(decimate or {}).get(name, 1) for name in names]
+
+    @instance
+    def change_logger():
+        values = [signal_code(sig) for sig in sigs]
+        changes = [0] * len(sigs)
+        writer.start(now(), values)
+        while True:
+            yield sigs
+            t = now()
+            for k, sig in enumerate(sigs):
+                value = signal_code(sig)
+                if value != values[k]:
+                    values[k] = value
+                    if changes[k] // 2 % decimation[k] == 0:
+                        writer.change(t, k, value)
+                    changes[k] += 1
+
+    return h.top, change_logger, writer
+
+
+def decode_varints(f):
+    value = shift = 0
+    while True:
+        chunk = f.read(flush_size)
+        if not chunk:
+            break
+        for byte in bytearray(chunk):
+            value |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                yield value
+                value = shift = 0
+
+
+def read_changelog(filename):
+    # returns the header and an iterator over ('segment', time, values) and ('change', time, index, value)
+    f = gzip.open(filename, 'rb')
+    if f.readline() != magic:
+        raise ValueError('%s is not a change log' % filename)
+    header = json.loads(f.readline())
+    n = len(header['signals'])
+
+    def records():
+        numbers = decode_varints(f)
+        t = 0
+        for kind in numbers:
+            if kind == 0:
+                t = next(numbers)
+                yield 'segment', t, [decode_value(next(numbers)) for k in range(n)]
+            else:
+                t += next(numbers)
+                yield 'change', t, kind - 1, decode_value(next(numbers))
+        f.close()
+
+    return header, records()
+
+
+def vcd_value(info, code, value):
+    if info['width'] == 1 and not info['enum']:
+        return '%d%s' % (value, code)
+    return 'b%s %s' % (format(value & ((1 << info['width']) - 1), 'b'), code)
+
+
+def to_vcd(changelog, vcd_filename):
+    header, records = read_changelog(changelog)
+    infos = header['signals']
+    codes = [chr(33 + k) if k < 94 else chr(33 + k / 94) + chr(33 + k % 94) for k in range(len(infos))]
+    with open(vcd_filename, 'w') as f:
+        f.write('$timescale 1ns $end\n$scope module changelog $end\n')
+        for info, code in zip(infos, codes):
+            f.write('$var reg %d %s %s $end\n' % (info['width'], code, info['name']))
+            if info['enum']:
+                f.write('$comment %s: %s $end\n' % (info['name'], ' '.join(
+                    '%d=%s' % (k, name) for k, name in enumerate(info['enum']))))
+        f.write('$upscope $end\n$enddefinitions $end\n')
+        last_time = None
+        for record in records:
+            if record[1] != last_time:
+                last_time = record[1]
+                f.write('#%d\n' % last_time)
+            if record[0] == 'segment':
+                for info, code, value in zip(infos, codes, record[2]):
+                    f.write(vcd_value(info, code, value) + '\n')
+            else:
+                f.write(vcd_value(infos[record[2]], codes[record[2]], record[3]) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='change log tracing of the tb.py simulation')
+    sub = parser.add_subparsers(dest='command')
+    run = sub.add_parser('run', help='simulate a scenario and write a change log')
+    run.add_argument('changelog')
+    run.add_argument('--scenario', default='tb')
+    run.add_argument('--signals', nargs='+', default=list(default_signals))
+    run.add_argument('--decimate', nargs='*', default=[], metavar='SIGNAL=N',
+                     help='only log every Nth period (both changes) of SIGNAL')
+    run.add_argument('--ring', type=int, default=None, metavar='CYCLES',
+                     help='keep the last CYCLES clock cycles and write them when the fsm enters an error state')
+    vcd = sub.add_parser('vcd', help='convert a change log to VCD')
+    vcd.add_argument('changelog')
+    vcd.add_argument('vcd')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        from tb import testbench
+        from scenarios import scenario_by_name
+        decimate = dict((item.split('=')[0], int(item.split('=')[1])) for item in args.decimate)
+        top, logger, writer = trace_changes(testbench, args.changelog, (scenario_by_name[args.scenario],),
+                                            allowlist=args.signals, decimate=decimate, ring_cycles=args.ring)
+        try:
+            Simulation(top, logger).run(quiet=1)
+        finally:
+            writer.close()
+        print '%s: %d segments' % (args.changelog, writer.segments)
+    else:
+        to_vcd(args.changelog, args.vcd)